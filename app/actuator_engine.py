@@ -0,0 +1,97 @@
+import threading
+import time
+
+import metrics
+
+RELAY_ON_SECONDS = metrics.histogram('bark_relay_on_seconds', 'How long a relay stayed on for one move.')
+
+
+# The ActuatorEngine replaces the busy wait that used to run while the door moved.
+# A move turns a relay on and schedules a deadline on a timer thread.  The caller gets
+# control back right away.  When the deadline passes, the relay is turned off and the
+# on_done callback is called with the move that ended.  cancel() turns the relay off and
+# throws away the pending deadline, so a Stop no longer has to wait for the move to finish.
+
+class ActuatorEngine:
+
+    def __init__(self, output):
+        # output is called as output(pin, value).  On the Pi this is GPIO.output.
+        self._output = output
+        self._lock = threading.Lock()
+        self._timer = None
+        self._pin = None
+        self._on_done = None
+        # Bumped on every start/cancel so a deadline that fires late knows it is stale.
+        self._generation = 0
+        self.started_at = None
+
+    @property
+    def moving(self):
+        return self._pin is not None
+
+    def is_current(self, move):
+        """
+        True if move (what start() returned) is still in progress.
+        """
+        with self._lock:
+            return move == self._generation and self._pin is not None
+
+    def start(self, pin, seconds, on_done=None):
+        """
+        Turn the relay on pin on and schedule it to be turned off after seconds.  Any move in
+        progress is cancelled first (without calling its on_done).  Returns a number identifying
+        this move for finish().  on_done(move) is called, after the engine's lock is released, with
+        that same number, so a caller can tell a late on_done from the move it started since.
+        """
+        with self._lock:
+            self._cancel_locked()
+            self._generation += 1
+            self._pin = pin
+            self._on_done = on_done
+            self.started_at = time.monotonic()
+            self._output(pin, True)
+            self._timer = threading.Timer(seconds, self._expire, args=(self._generation,))
+            self._timer.daemon = True
+            self._timer.start()
+            return self._generation
+
+    def cancel(self):
+        """
+        Turn off the relay of the move in progress.  Returns True if a move was cancelled.
+        """
+        with self._lock:
+            return self._cancel_locked()
+
+    def finish(self, move=None):
+        """
+        End the move in progress now, as if its deadline had passed.  on_done is called.  If move
+        (what start() returned) is given, only end the move if it is still that one.
+        """
+        self._expire(self._generation if move is None else move)
+
+    def _cancel_locked(self):
+        if self._pin is None:
+            return False
+        self._timer.cancel()
+        self._output(self._pin, False)
+        RELAY_ON_SECONDS.observe(time.monotonic() - self.started_at)
+        self._generation += 1
+        self._pin = None
+        self._timer = None
+        self._on_done = None
+        return True
+
+    def _expire(self, generation):
+        with self._lock:
+            if generation != self._generation or self._pin is None:
+                # Cancelled or restarted while the timer was firing.
+                return
+            self._timer.cancel()
+            self._output(self._pin, False)
+            RELAY_ON_SECONDS.observe(time.monotonic() - self.started_at)
+            on_done = self._on_done
+            self._pin = None
+            self._timer = None
+            self._on_done = None
+        if on_done is not None:
+            on_done(generation)
@@ -16,81 +16,371 @@
 #   The code that handles sending commands to the Raspberry Pi pins and understanding
 #   what needs to happen is in sliding_door.py as the SlidingDoor class.
 #
+#   create_app() builds the app.  serve.py runs it on a production WSGI server.  The app
+#   can serve pages right away; the door hardware is set up on a background thread, and
+#   /get_open_close answers 503 until it is ready.  Passwords are checked on a small pool
+#   of workers, with a limit on attempts per client (login_guard.py), so a burst of logins
+#   can't hold up the door.
+#
 #   I've started evolving a logging class - HandleLogging - that has been very useful
 #   logging what is going on in a log file so I can review when stuff doesn't run
 #   as expected.
 #
 
+import math
 import os
-from flask import Flask, render_template, redirect, url_for, request, jsonify, flash
-from flask_bcrypt import check_password_hash
+import threading
+import time
+
+from flask import Flask, Response, g, render_template, redirect, url_for, request, jsonify, flash
 from flask_bootstrap import Bootstrap
 from flask_cors import CORS
 from flask_login import LoginManager, login_user, login_required
 
-from login_user import User, LoginForm
-from sliding_door import SlidingDoor
+import metrics
+from camera_stream import CameraStream, PiCameraSource
+from config import load_config
+from door_registry import DEFAULT_DOOR, DoorRegistry
+from event_hub import EventHub
+from event_store import EVENT_TYPES
+from handle_logging_lib import HandleLogging
+from login_guard import LOGIN_ATTEMPTS, LoginBusy, LoginThrottle, PasswordChecker, SessionCache
+from snapshots import SNAPSHOT_ID, SnapshotStore
+from static_assets import CACHE_CONTROL, AssetBundle
 
-app = Flask(__name__)
-Bootstrap(app)
-# Now add the class for opening and closing the door.
-door = SlidingDoor()
-#
-# I use the Flask-CORS module so that we can access this over the router's IP.
-# see https://flask-cors.readthedocs.io/en/latest/
-CORS(app)
+HTTP_REQUEST_SECONDS = metrics.histogram('bark_http_request_seconds',
+                                         'Time to build the response, by route.', ['endpoint'])
+HTTP_REQUESTS = metrics.counter('bark_http_requests_total', 'Requests, by route and status.',
+                                ['endpoint', 'status'])
+# Most events /history returns at once.
+HISTORY_LIMIT = 1000
+# Most snapshots /snapshots lists at once.
+SNAPSHOT_LIMIT = 1000
+_RIGHT = LOGIN_ATTEMPTS.labels(result='right')
+_WRONG = LOGIN_ATTEMPTS.labels(result='wrong')
+_THROTTLED = LOGIN_ATTEMPTS.labels(result='throttled')
+_BUSY = LOGIN_ATTEMPTS.labels(result='busy')
 
-# Secret key is needed because we are using sessions...
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
-login_manager = LoginManager()
-login_manager.init_app(app)
-# Now set the html page to be displayed.
-login_manager.login_view = 'login'
 
+def _start_hardware(app, settings, timer, on_ready):
+    # Runs on its own thread so the app can serve while GPIO and the sensors come up.
+    log = HandleLogging()
+    try:
+        with timer.phase('hardware'):
+            from door_registry import build_registry
+            app.doors = build_registry(settings, events=app.events)
+            app.door = app.doors.primary
+            for door_id, door in app.doors.items():
+                door.use_snapshots(app.snapshots, settings.public_url)
+            _start_vision(app)
+    except Exception as e:
+        log.print("Could not set up the door hardware: %s", e)
+        return
+    app.door_ready.set()
+    if on_ready is not None:
+        on_ready()
 
-#
-# Function used by LoginManager to grab the user object to use.
-# We don't have multiple users, so just create an instance of the
-# User class.
-@login_manager.user_loader
-def load_user(userid):
-    # user will always exist.
-    user = User()
-    return user
 
+def _start_vision(app):
+    # Doors with a vision_roi check the PIR against the camera.
+    for door_id, door in app.doors.items():
+        roi = door.config.vision_roi
+        if roi:
+            from vision_motion import VisionMotionDetector, parse_roi
+            detector = VisionMotionDetector(roi=parse_roi(roi))
+            door.use_vision(detector)
+            detector.watch(app.camera)
 
-#
-# Here we show the video feed as well as ability to open/close/stop the actuator that controls door movement.
-@app.route('/dashboard')
-@app.route('/')
-@app.route('/index')
-@login_required
-def dashboard():
-    return render_template('dashboard.html')
-
-
-@app.route('/login', methods=('GET', 'POST'))
-def login():
-    form = LoginForm()
-    # Person has 'submitted' the form by clicking button to check password.
-    # Validators set in the LoginForm are run..if all checks...
-    if form.validate_on_submit():
-        user = User()
-        if check_password_hash(user.hashed_password, form.password.data):
-            login_user(user)
-            return redirect(url_for('dashboard'))
-        else:
-            flash("your password is incorrect!", "error")
-    return render_template('login.html', form=form)
-
-
-@app.route('/get_open_close', methods=['POST'])
-def get_open_close():
-    action = request.get_json()
-    door.do_action(action['action'])
-    resp = jsonify(success=True)
-    return resp
+
+def create_app(door=None, doors=None, camera=None, events=None, assets=None, snapshots=None, passwords=None,
+               settings=None, timer=None, on_ready=None, **config):
+    """
+    Build the Flask app around the door controllers.  door is a single door, doors a DoorRegistry of
+    several.  If neither is given, the SlidingDoors that talk to the Raspberry Pi pins are created on
+    a background thread (see door_registry.py).  camera is the frame source behind /stream, the Pi
+    camera if not given.  events is the EventHub behind /events, which the doors publish to.  assets
+    is the AssetBundle behind /assets, snapshots the SnapshotStore behind /snapshots, and passwords the
+    login_guard.PasswordChecker behind /login.  settings is the Config (loaded from the environment if
+    not given), timer a startup.PhaseTimer, and on_ready is called once the doors can be controlled.
+    Extra keyword arguments are added to app.config.
+    """
+    settings = load_config() if settings is None else settings
+    app = Flask(__name__)
+    Bootstrap(app)
+    app.events = EventHub() if events is None else events
+    # Now add the classes for opening and closing the doors.  app.door is the first of them, the one
+    # the dashboard and /get_open_close drive.
+    if doors is None:
+        doors = DoorRegistry() if door is None else DoorRegistry([(DEFAULT_DOOR, door)])
+    app.doors = doors
+    app.door = doors.primary
+    app.door_ready = threading.Event()
+    if app.door is None:
+        from startup import PhaseTimer
+        threading.Thread(target=_start_hardware, name='hardware', daemon=True,
+                         args=(app, settings, PhaseTimer() if timer is None else timer, on_ready)).start()
+    else:
+        app.door_ready.set()
+        if on_ready is not None:
+            on_ready()
+    # One capture of the camera shared by every /stream client.
+    app.camera = CameraStream(PiCameraSource() if camera is None else camera)
+    # Camera snapshots of each dog at the door (see snapshots.py).
+    app.snapshots = (SnapshotStore(app.camera, settings.snapshot_dir, settings.snapshot_memory_bytes,
+                                   settings.snapshot_disk_bytes) if snapshots is None else snapshots)
+    # Password checks off the request threads, a limit on attempts, and the sessions that got the
+    # password right (see login_guard.py).
+    app.passwords = (PasswordChecker(workers=settings.login_workers, queue_limit=settings.login_queue)
+                     if passwords is None else passwords)
+    app.login_throttle = LoginThrottle(settings.login_attempts_per_minute, settings.login_burst)
+    app.sessions = SessionCache(settings.login_max_sessions, settings.login_session_days * 24 * 3600)
+    # The CSS, JavaScript and images the pages use, served from the Pi (see static_assets.py).
+    app.assets = AssetBundle() if assets is None else assets
+    app.jinja_env.globals['asset_url'] = lambda name: url_for('asset', name=app.assets.url_name(name))
+    #
+    # I use the Flask-CORS module so that we can access this over the router's IP.
+    # see https://flask-cors.readthedocs.io/en/latest/
+    CORS(app)
+
+    # Secret key is needed because we are using sessions...
+    app.config['SECRET_KEY'] = settings.SECRET_KEY
+    app.config.update(config)
+    login_manager = LoginManager()
+    login_manager.init_app(app)
+    # Now set the html page to be displayed.
+    login_manager.login_view = 'login'
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        endpoint = request.endpoint or 'none'
+        HTTP_REQUEST_SECONDS.labels(endpoint=endpoint).observe(time.perf_counter() - g.request_started)
+        HTTP_REQUESTS.labels(endpoint=endpoint, status=response.status_code).inc()
+        return response
+
+    #
+    # Function used by LoginManager to grab the user object to use.
+    # The user id is the token of a session that logged in, so this is
+    # a lookup in app.sessions.  None sends the browser back to /login.
+    @login_manager.user_loader
+    def load_user(userid):
+        return app.sessions.get(userid)
+
+    #
+    # Here we show the video feed as well as ability to open/close/stop the actuator that controls door movement.
+    @app.route('/dashboard')
+    @app.route('/')
+    @app.route('/index')
+    @login_required
+    def dashboard():
+        # The door the buttons drive.  The events of the other doors are left out of its badge.
+        door_id = app.doors.primary_id
+        if door_id is None:
+            from door_registry import primary_door_id
+            door_id = primary_door_id(settings)
+        return render_template('dashboard.html', door_id=door_id)
+
+    #
+    # The live video shown on the dashboard, as an MJPEG stream.
+    @app.route('/stream')
+    @login_required
+    def stream():
+        return Response(app.camera.mjpeg(),
+                        mimetype='multipart/x-mixed-replace; boundary=' + CameraStream.BOUNDARY.decode())
+
+    #
+    # Door state changes, motion detections and command acknowledgements, pushed as Server-Sent Events.
+    @app.route('/events')
+    @login_required
+    def events():
+        # Sent by the browser when it reconnects, so the client gets the events it missed.
+        last_event_id = request.headers.get('Last-Event-ID', type=int)
+
+        def stream():
+            # Subscribed only once the body is read, so a response closed before then (the client
+            # went away first) never holds a subscription that nothing will close.
+            subscription = app.events.subscribe(last_event_id)
+            try:
+                door = app.door
+                door_state = 'UNKNOWN' if door is None else door.door_state_str(door.door_state)
+                # Start every client off with where the door is now.
+                yield EventHub.format('state', {'door_state': door_state})
+                for chunk in subscription:
+                    yield chunk
+            finally:
+                subscription.close()
+
+        return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    #
+    # What the door has been doing, from the history file.  Takes start and end (seconds since the
+    # epoch), any number of type=command|state|motion, and limit.
+    @app.route('/history')
+    @login_required
+    def history():
+        store = getattr(app.door, 'history', None)
+        if store is None:
+            return jsonify(events=[])
+        types = request.args.getlist('type') or None
+        if types is not None and not set(types) <= set(EVENT_TYPES):
+            return jsonify(error="type must be one of {}".format(', '.join(sorted(EVENT_TYPES)))), 400
+        limit = request.args.get('limit', HISTORY_LIMIT, type=int)
+        if limit < 0:
+            return jsonify(error="limit must be 0 or more"), 400
+        events = store.query(start=request.args.get('start', type=float),
+                             end=request.args.get('end', type=float),
+                             types=types,
+                             limit=min(limit, HISTORY_LIMIT))
+        return jsonify(events=events)
+
+    #
+    # The pages' CSS, JavaScript and images, by content hashed name.  They never change under a name,
+    # so browsers may cache them for good.
+    @app.route('/assets/<name>')
+    def asset(name):
+        found = app.assets.lookup(name)
+        if found is None:
+            return jsonify(error="No such asset"), 404
+        encoding = AssetBundle.choose_encoding(found, request.headers.get('Accept-Encoding', ''))
+        response = Response(found.encodings[encoding], mimetype=found.mimetype)
+        response.set_etag(found.etag(encoding))
+        response.headers['Cache-Control'] = CACHE_CONTROL
+        response.headers['Vary'] = 'Accept-Encoding'
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        return response.make_conditional(request)
+
+    #
+    # Camera snapshots of motion, newest first.  Takes limit.
+    @app.route('/snapshots')
+    @login_required
+    def snapshots_page():
+        limit = request.args.get('limit', SNAPSHOT_LIMIT, type=int)
+        if limit < 0:
+            return jsonify(error="limit must be 0 or more"), 400
+        return jsonify(snapshots=[{'id': info.id, 'door': info.door, 'timestamp': info.timestamp,
+                                   'bytes': info.size,
+                                   'url': url_for('snapshot', snapshot_id=info.id),
+                                   'thumbnail_url': None if info.thumbnail_size is None else
+                                   url_for('snapshot', snapshot_id=info.id, kind='thumb')}
+                                  for info in app.snapshots.list(min(limit, SNAPSHOT_LIMIT))])
+
+    #
+    # One snapshot's JPEG.  A snapshot never changes, so it is served with an ETag and may be cached
+    # for good.  One still being taken is waited for.
+    @app.route('/snapshots/<snapshot_id>')
+    @app.route('/snapshots/<snapshot_id>/<kind>')
+    @login_required
+    def snapshot(snapshot_id, kind='full'):
+        if not SNAPSHOT_ID.match(snapshot_id) or kind not in ('full', 'thumb'):
+            return jsonify(error="No such snapshot"), 404
+        data = app.snapshots.get(snapshot_id, kind)
+        if data is None:
+            return jsonify(error="No such snapshot"), 404
+        response = Response(data, mimetype='image/jpeg')
+        response.set_etag('{}-{}'.format(snapshot_id, kind))
+        response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return response.make_conditional(request)
+
+    #
+    # Counters, gauges and latency histograms for Prometheus to scrape.
+    @app.route('/metrics')
+    def metrics_page():
+        return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/login', methods=('GET', 'POST'))
+    def login():
+        # The form libraries are only imported once someone logs in.
+        from login_user import User, LoginForm
+        form = LoginForm()
+        if request.method == 'POST':
+            # Turn away a client making too many attempts before any hashing.
+            wait = app.login_throttle.allow(request.remote_addr)
+            if wait:
+                _THROTTLED.inc()
+                flash("Too many tries.  Try again in {:.0f} seconds.".format(math.ceil(wait)), "error")
+                return render_template('login.html', form=form), 429, {'Retry-After': str(int(math.ceil(wait)))}
+        # Person has 'submitted' the form by clicking button to check password.
+        # Validators set in the LoginForm are run..if all checks...
+        if form.validate_on_submit():
+            try:
+                right = app.passwords.check(form.password.data)
+            except LoginBusy:
+                _BUSY.inc()
+                flash("The door is busy checking passwords.  Try again in a moment.", "error")
+                return render_template('login.html', form=form), 503, {'Retry-After': '1'}
+            if right:
+                _RIGHT.inc()
+                user = User()
+                app.sessions.add(user)
+                login_user(user)
+                return redirect(url_for('dashboard'))
+            else:
+                _WRONG.inc()
+                flash("your password is incorrect!", "error")
+        return render_template('login.html', form=form)
+
+    #
+    # Every door the Pi runs, and commands to each one by id.
+    def find_door(door_id):
+        # (door, None), or (None, the error response).
+        door = app.doors.get(door_id)
+        if door is not None:
+            return door, None
+        if not app.door_ready.is_set():
+            return None, (jsonify(success=False, error="The doors are still starting up."), 503)
+        return None, (jsonify(success=False, error="No door {}".format(door_id)), 404)
+
+    @app.route('/doors')
+    @login_required
+    def doors_page():
+        return jsonify(doors=[{'id': door_id, 'door_state': door.door_state_str(door.door_state)}
+                              for door_id, door in app.doors.items()])
+
+    @app.route('/doors/<door_id>/state')
+    @login_required
+    def door_state_page(door_id):
+        door, error = find_door(door_id)
+        if error is not None:
+            return error
+        position = door.door_position() if hasattr(door, 'door_position') else None
+        return jsonify(id=door_id, door_state=door.door_state_str(door.door_state), position=position)
+
+    @app.route('/doors/<door_id>/action', methods=['POST'])
+    @login_required
+    def door_action(door_id):
+        door, error = find_door(door_id)
+        if error is not None:
+            return error
+        action = (request.get_json(silent=True) or {}).get('action')
+        # True == 1, so a bool would pass for a button.
+        if isinstance(action, bool) or action not in door.button_states:
+            return jsonify(success=False, error="Send {\"action\": 0 (close), 1 (open) or 2 (stop)}"), 400
+        # Each door carries out commands on its own thread, so a busy door doesn't hold up this one.
+        door_state = door.do_action(action)
+        app.events.publish('ack', door=door_id, action=action, door_state=door.door_state_str(door_state))
+        return jsonify(success=True, id=door_id, door_state=door.door_state_str(door_state)), 202
+
+    @app.route('/get_open_close', methods=['POST'])
+    def get_open_close():
+        action = request.get_json()
+        door = app.door
+        if door is None:
+            return jsonify(success=False, error="The door is still starting up."), 503
+        # do_action() returns as soon as the relay is switched.  The door keeps moving after we reply,
+        # so tell the caller the request was accepted along with the door state it caused.
+        door_state = door.do_action(action['action'])
+        app.events.publish('ack', door=app.doors.primary_id, action=action['action'],
+                           door_state=door.door_state_str(door_state))
+        resp = jsonify(success=True, door_state=door.door_state_str(door_state))
+        return resp, 202
+
+    return app
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8519, debug=True)
+    # The Flask development server, for trying things out.  serve.py is what BARK.service runs.
+    create_app().run(host='0.0.0.0', port=8519, debug=os.getenv('FLASK_DEBUG') == '1')
@@ -0,0 +1,178 @@
+import threading
+
+from handle_logging_lib import HandleLogging
+
+
+# The dashboard's video used to come from a separate streamer process on port 8081, opened once per
+# dashboard and not covered by the login.  Now the app serves /stream itself:
+#    - one capture thread reads JPEG frames from a frame source into a FrameBuffer.
+#    - every /stream client waits on the same FrameBuffer and is handed a reference to the newest
+#      frame.  Frames are immutable bytes, so nothing is copied per client.
+#    - a client that is slower than the camera skips to the newest frame rather than queueing the
+#      ones it missed.
+#
+# A frame source has open(), read() and close().  read() blocks until the next JPEG is ready and
+# returns it as bytes.
+
+class PiCameraSource:
+    """
+    JPEG frames from the Raspberry Pi camera through picamera's video port.
+    """
+
+    def __init__(self, resolution=(640, 480), framerate=15):
+        self.resolution = resolution
+        self.framerate = framerate
+        self._camera = None
+        self._frames = None
+
+    def open(self):
+        # picamera is only there on the Pi, so only import it once a client wants to watch.
+        import io
+        import picamera
+        self._camera = picamera.PiCamera(resolution=self.resolution, framerate=self.framerate)
+        self._stream = io.BytesIO()
+        self._frames = self._camera.capture_continuous(self._stream, format='jpeg', use_video_port=True)
+
+    def read(self):
+        next(self._frames)
+        frame = self._stream.getvalue()
+        self._stream.seek(0)
+        self._stream.truncate()
+        return frame
+
+    def close(self):
+        if self._camera is not None:
+            self._camera.close()
+            self._camera = None
+
+
+class FrameBuffer:
+    """
+    Ring of the last few frames, written by one capture thread and read by any number of clients.
+    """
+
+    def __init__(self, size=4):
+        self._frames = [None] * size
+        self._condition = threading.Condition()
+        # Sequence number of the newest frame.  0 means no frame yet.
+        self.seq = 0
+
+    def put(self, frame):
+        with self._condition:
+            self.seq += 1
+            self._frames[self.seq % len(self._frames)] = frame
+            self._condition.notify_all()
+
+    def latest(self):
+        with self._condition:
+            return self.seq, self._frames[self.seq % len(self._frames)]
+
+    def wait_newer(self, seq, timeout=None):
+        """
+        Wait for a frame newer than seq.  Returns (seq, frame) of the newest frame, or (seq, None)
+        on timeout.  Frames between seq and the newest one are skipped.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.seq > seq, timeout):
+                return seq, None
+            return self.seq, self._frames[self.seq % len(self._frames)]
+
+
+class CameraStream:
+    """
+    Runs the capture thread while at least one client is watching.
+    """
+
+    BOUNDARY = b'frame'
+
+    def __init__(self, source, buffer_size=4, frame_timeout=5):
+        self.source = source
+        self.buffer = FrameBuffer(buffer_size)
+        self.frame_timeout = frame_timeout
+        self.log = HandleLogging()
+        self._lock = threading.Lock()
+        self._source_lock = threading.Lock()
+        self._clients = 0
+        self._thread = None
+
+    @property
+    def clients(self):
+        return self._clients
+
+    def _join(self):
+        with self._lock:
+            self._clients += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._capture, name='camera', daemon=True)
+                self._thread.start()
+
+    def _leave(self):
+        with self._lock:
+            self._clients -= 1
+
+    def _capture(self):
+        # A capture thread that is still closing the camera holds _source_lock until it is done.
+        with self._source_lock:
+            opened = False
+            try:
+                self.source.open()
+                opened = True
+                self.log.print("Camera capture started.")
+                while True:
+                    with self._lock:
+                        if self._clients == 0:
+                            self._thread = None
+                            break
+                    self.buffer.put(self.source.read())
+            except Exception as e:
+                self.log.print("Camera capture failed: %s", e)
+            finally:
+                # However capture ended, the next client starts it again.  A thread already started
+                # for a new client is left alone.
+                with self._lock:
+                    if self._thread is threading.current_thread():
+                        self._thread = None
+                if opened:
+                    self.source.close()
+                    self.log.print("Camera capture stopped.")
+
+    def frames(self):
+        """
+        Generator of the frames one client is shown, newest first, until it is closed.
+        """
+        self._join()
+        try:
+            seq = self.buffer.seq
+            while True:
+                seq, frame = self.buffer.wait_newer(seq, self.frame_timeout)
+                if frame is None:
+                    # No frame for frame_timeout seconds.  Give up if the capture thread died.
+                    if self._thread is None:
+                        return
+                    continue
+                yield frame
+        finally:
+            self._leave()
+
+    def snapshot(self, timeout=5):
+        """
+        The next frame from the camera, starting the capture for it if nobody is watching.  None if
+        no frame came within timeout seconds.
+        """
+        self._join()
+        try:
+            seq, frame = self.buffer.wait_newer(self.buffer.seq, timeout)
+            return frame
+        finally:
+            self._leave()
+
+    def mjpeg(self):
+        """
+        The multipart/x-mixed-replace body for one client.  Each frame is yielded on its own,
+        after its part header, so it is never copied into a bigger string.
+        """
+        for frame in self.frames():
+            yield (b'--' + self.BOUNDARY + b'\r\nContent-Type: image/jpeg\r\nContent-Length: ' +
+                   str(len(frame)).encode() + b'\r\n\r\n')
+            yield frame
+            yield b'\r\n'
@@ -0,0 +1,132 @@
+import collections
+import threading
+import time
+
+import metrics
+
+COMMANDS_COALESCED = metrics.counter('bark_commands_coalesced_total',
+                                     'Commands merged into the same command already waiting.')
+COMMANDS_PREEMPTED = metrics.counter('bark_commands_preempted_total',
+                                     'Waiting commands dropped because a STOP came in.')
+COMMAND_SECONDS = metrics.histogram('bark_command_seconds',
+                                    'Time from a command being given to its result, queueing included.')
+
+
+# The CommandArbiter is the only thread that changes the door because of a command.  Request threads
+# (several phones can press buttons at once) put commands in its queue and wait for the result:
+#    - A command the same as the last one waiting is merged into it.  Both callers get its result.
+#    - STOP goes to the front of the queue, and the commands already waiting are dropped.  Their
+#      callers get the result of the STOP.
+#    - Everything else runs in the order it came in.
+# apply(command, source) does the work and returns the resulting state.  It should return quickly
+# (SlidingDoor's moves run on the ActuatorEngine's timer), since every other command waits for it.
+
+class _Command:
+
+    def __init__(self, command, source):
+        self.command = command
+        self.source = source
+        self.given = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # Commands dropped for this one (a STOP), which get its result.
+        self.dropped = []
+
+    def finish(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.done.set()
+
+
+class CommandArbiter:
+
+    def __init__(self, apply, stop_command):
+        """
+        apply is called as apply(command, source) on the arbiter's thread.  stop_command is the
+        command that preempts the others.
+        """
+        self._apply = apply
+        self.stop_command = stop_command
+        self._queue = collections.deque()
+        self._ready = threading.Condition()
+        self._closed = False
+        self.applied = 0
+        self.coalesced = 0
+        self.preempted = 0
+        self._thread = threading.Thread(target=self._run, name='commands', daemon=True)
+        self._thread.start()
+
+    def submit(self, command, source='unknown', timeout=None):
+        """
+        Give a command and wait for it to be carried out.  Returns what apply returned, and raises
+        whatever it raised.  Raises TimeoutError if there is no result within timeout seconds.
+        """
+        if threading.current_thread() is self._thread:
+            # apply() gave a command of its own.  Queueing it would wait on ourselves.
+            return self._apply(command, source)
+        with self._ready:
+            if self._closed:
+                raise RuntimeError("The command arbiter is closed")
+            entry = self._enqueue(command, source)
+            self._ready.notify()
+        if not entry.done.wait(timeout):
+            raise TimeoutError("No result for command {} within {} seconds".format(command, timeout))
+        if entry.error is not None:
+            raise entry.error
+        return entry.result
+
+    def _enqueue(self, command, source):
+        # Returns the entry the caller should wait on.  Called with _ready held.
+        if command == self.stop_command:
+            if self._queue and self._queue[0].command == command:
+                COMMANDS_COALESCED.inc()
+                self.coalesced += 1
+                entry = self._queue.popleft()
+            else:
+                entry = _Command(command, source)
+            # The STOP wins over everything waiting.  Those callers get the STOP's result.
+            dropped = list(self._queue)
+            self._queue.clear()
+            self._queue.append(entry)
+            if dropped:
+                COMMANDS_PREEMPTED.inc(len(dropped))
+                self.preempted += len(dropped)
+                entry.dropped.extend(dropped)
+            return entry
+        if self._queue and self._queue[-1].command == command:
+            COMMANDS_COALESCED.inc()
+            self.coalesced += 1
+            return self._queue[-1]
+        entry = _Command(command, source)
+        self._queue.append(entry)
+        return entry
+
+    def queue_depth(self):
+        return len(self._queue)
+
+    def close(self, timeout=None):
+        """
+        Stop taking commands.  Commands already waiting are still carried out.
+        """
+        with self._ready:
+            self._closed = True
+            self._ready.notify()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._ready:
+                while not self._queue and not self._closed:
+                    self._ready.wait()
+                if not self._queue:
+                    return
+                entry = self._queue.popleft()
+            try:
+                result, error = self._apply(entry.command, entry.source), None
+            except Exception as e:
+                result, error = None, e
+            self.applied += 1
+            for waiting in [entry] + entry.dropped:
+                COMMAND_SECONDS.observe(time.perf_counter() - waiting.given)
+                waiting.finish(result, error)
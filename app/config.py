@@ -0,0 +1,105 @@
+import os
+from collections import namedtuple
+
+# All of BARK's settings from the environment file (.env in pycharm, environment_BARK for the systemd
+# service), read and checked in one place at startup.  A missing or mistyped setting is reported
+# with every other problem found, instead of as a crash wherever the first os.getenv() happens to be.
+#
+# The logging settings (logfile, log_*) are read by handle_logging_lib itself, so that a bad config
+# can still be logged.
+
+REQUIRED = object()
+
+Setting = namedtuple('Setting', ['name', 'type', 'default'])
+
+SETTINGS = (
+    # Raspberry Pi (BCM) pins.
+    Setting('open_pin', int, REQUIRED),
+    Setting('close_pin', int, REQUIRED),
+    Setting('pir_pin', int, REQUIRED),
+    # 'simulated' to run without the hardware.  See gpio_backend.py.
+    Setting('gpio_backend', str, 'rpi'),
+    # Longest a move may take.  With the distance sensor the relays are usually cut sooner.
+    Setting('seconds_to_open_door', float, REQUIRED),
+    # How long the PIR must be quiet before motion counts as a new dog at the door.
+    Setting('mins_between_detecting_motion', float, REQUIRED),
+    # Distance sensor readings for a closed and an open door.  Leave unset if there is no sensor.
+    Setting('door_closed_mm', int, None),
+    Setting('door_open_mm', int, None),
+    # Where to keep the event history.  Leave unset for no history.
+    Setting('history_file', str, None),
+    # The part of the camera's picture outside the door, as x0,y0,x1,y1 fractions of the frame.  When
+    # set, motion counts only if the camera agrees with the PIR, or is sure on its own (see
+    # vision_motion.py).  Leave unset to go by the PIR alone.
+    Setting('vision_roi', str, None),
+    Setting('SECRET_KEY', str, None),
+    # Password attempts each client may make: login_burst at once, then login_attempts_per_minute.
+    # Passwords are checked on login_workers threads, with at most login_queue more waiting (see
+    # login_guard.py).  Keep login_workers + login_queue well under server_threads.
+    Setting('login_attempts_per_minute', float, 10.0),
+    Setting('login_burst', int, 5),
+    Setting('login_workers', int, 1),
+    Setting('login_queue', int, 2),
+    # Most sessions kept logged in at once, and for how many days each.
+    Setting('login_max_sessions', int, 64),
+    Setting('login_session_days', float, 30.0),
+    # Where to keep motion snapshots, and how many bytes of them to keep on disk and in memory (see
+    # snapshots.py).  Without snapshot_dir they are only kept in memory.
+    Setting('snapshot_dir', str, None),
+    Setting('snapshot_memory_bytes', int, 4000000),
+    Setting('snapshot_disk_bytes', int, 64000000),
+    # How phones reach the app, e.g. http://raspberrypi.lan:8519.  When set, alerts link to the
+    # motion's snapshot.
+    Setting('public_url', str, None),
+    # A file describing several doors, each with its own pins and timing (see door_registry.py).  Leave
+    # unset for the one door described here.
+    Setting('doors_file', str, None),
+    # Rules for opening and closing the door by itself on motion (see rules_engine.py).  Leave unset
+    # for none.
+    Setting('rules_file', str, None),
+    # serve.py
+    Setting('server_host', str, '0.0.0.0'),
+    Setting('server_port', int, 8519),
+    # Each open dashboard holds two threads (/events and /stream).  24 is 8 viewers plus 8 to spare.
+    Setting('server_threads', int, 24),
+    Setting('server_backlog', int, 64),
+    Setting('server_keepalive_seconds', int, 30),
+    Setting('server_connection_limit', int, 100),
+    # Bytes of a response waitress holds for a slow client before the request's thread waits for
+    # it to catch up.  A few camera frames, so /stream skips to the newest frame instead of queueing.
+    Setting('server_outbuf_bytes', int, 262144),
+)
+
+Config = namedtuple('Config', [setting.name for setting in SETTINGS])
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def load_config(environ=None, **overrides):
+    """
+    Build a Config from environ (os.environ if not given).  Keyword arguments replace settings, already
+    typed.  Raises ConfigError listing every setting that is missing or can't be converted.
+    """
+    environ = os.environ if environ is None else environ
+    values = {}
+    problems = []
+    for setting in SETTINGS:
+        if setting.name in overrides:
+            values[setting.name] = overrides[setting.name]
+            continue
+        raw = environ.get(setting.name)
+        if raw is None or raw == '':
+            if setting.default is REQUIRED:
+                problems.append("{} is not set".format(setting.name))
+            else:
+                values[setting.name] = setting.default
+            continue
+        try:
+            values[setting.name] = setting.type(raw)
+        except ValueError:
+            problems.append("{} should be {}, not {!r}".format(setting.name, setting.type.__name__, raw))
+    if problems:
+        raise ConfigError("Bad settings in the environment file: " + '; '.join(problems))
+    return Config(**values)
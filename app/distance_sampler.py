@@ -0,0 +1,165 @@
+import threading
+import time
+
+from handle_logging_lib import HandleLogging
+
+
+# The DistanceSampler reads the VL6180X time of flight sensor at a fixed rate on its own thread and
+# keeps the readings in a ring buffer.  The I2C bus and sensor are opened once, not per read.  Asking
+# where the door is reads the buffer instead of the bus.  SlidingDoor uses watch() to cut the relays
+# as soon as the door gets where it is going.
+#
+# A sensor backend has open(), read() (range in mm) and close().
+
+class VL6180XBackend:
+
+    def open(self):
+        # The Adafruit libraries are only there on the Pi.
+        import adafruit_vl6180x
+        import board
+        import busio
+        self._i2c = busio.I2C(board.SCL, board.SDA)
+        self._sensor = adafruit_vl6180x.VL6180X(self._i2c)
+
+    def read(self):
+        # See tests/test_distance_sensor.py for what range_status means.  Anything but 0 is not a
+        # valid reading.
+        if self._sensor.range_status != 0:
+            return None
+        return self._sensor.range
+
+    def close(self):
+        self._i2c.deinit()
+
+
+class FakeRangeSensor:
+    """
+    Sensor backend for tests and the simulator.  read() returns range_mm, which can be set from
+    outside, or the result of calling it if it is a function.
+    """
+
+    def __init__(self, range_mm=0):
+        self.range_mm = range_mm
+        self.reads = 0
+
+    def open(self):
+        pass
+
+    def read(self):
+        self.reads += 1
+        return self.range_mm() if callable(self.range_mm) else self.range_mm
+
+    def close(self):
+        pass
+
+
+class DistanceSampler:
+
+    def __init__(self, backend, rate_hz=20, size=64, smoothing=3):
+        """
+        backend   - where readings come from.
+        rate_hz   - readings per second.
+        size      - readings kept in the ring.
+        smoothing - how many of the newest readings position() averages.
+        """
+        self.backend = backend
+        self.interval = 1.0 / rate_hz
+        self.smoothing = smoothing
+        self.log = HandleLogging()
+        self._times = [0.0] * size
+        self._ranges = [None] * size
+        self._lock = threading.Lock()
+        # Number of readings taken so far.  The newest is at (count - 1) % size.
+        self.count = 0
+        self._watch = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.backend.open()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='distance', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.backend.close()
+
+    def _run(self):
+        next_read = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                range_mm = self.backend.read()
+            except Exception as e:
+                self.log.print("Distance read failed: %s", e)
+                range_mm = None
+            if range_mm is not None:
+                self._add(time.monotonic(), range_mm)
+            next_read += self.interval
+            delay = next_read - time.monotonic()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                # Fell behind (slow bus).  Don't try to catch up with a burst of reads.
+                next_read = time.monotonic()
+
+    def _add(self, timestamp, range_mm):
+        with self._lock:
+            slot = self.count % len(self._ranges)
+            self._times[slot] = timestamp
+            self._ranges[slot] = range_mm
+            self.count += 1
+            watch = self._watch
+        if watch is not None:
+            reached, callback = watch
+            if reached(self.position()):
+                with self._lock:
+                    if self._watch is not watch:
+                        return
+                    self._watch = None
+                callback()
+
+    def latest(self):
+        """
+        (timestamp, range in mm) of the newest reading, or None if there hasn't been one.
+        """
+        with self._lock:
+            if self.count == 0:
+                return None
+            slot = (self.count - 1) % len(self._ranges)
+            return self._times[slot], self._ranges[slot]
+
+    def readings(self):
+        """
+        The readings in the ring as (timestamp, range in mm), oldest first.
+        """
+        with self._lock:
+            size = len(self._ranges)
+            first = max(0, self.count - size)
+            return [(self._times[n % size], self._ranges[n % size]) for n in range(first, self.count)]
+
+    def position(self):
+        """
+        Average of the newest smoothing readings, or None if there haven't been any.
+        """
+        with self._lock:
+            n = min(self.smoothing, self.count)
+            if n == 0:
+                return None
+            size = len(self._ranges)
+            return sum(self._ranges[(self.count - 1 - i) % size] for i in range(n)) / n
+
+    def watch(self, reached, callback):
+        """
+        Call callback() once, from the sampler's thread, the first time reached(position) is True.
+        Replaces any watch already set.
+        """
+        with self._lock:
+            self._watch = (reached, callback)
+
+    def unwatch(self):
+        with self._lock:
+            self._watch = None
@@ -0,0 +1,164 @@
+import collections
+import configparser
+import os
+import re
+
+from config import SETTINGS, ConfigError, load_config
+
+# One Pi can run several doors and gates.  They are described in the file named by doors_file in the
+# environment file, one section per door:
+#
+#    [back]
+#    open_pin = 20
+#    close_pin = 21
+#    pir_pin = 4
+#
+#    [gate]
+#    open_pin = 5
+#    close_pin = 6
+#    pir_pin = 13
+#    seconds_to_open_door = 25
+#    history_file = /home/pi/gate_history
+#
+# A section takes the same settings as the environment file (see config.py).  Anything a section
+# leaves out comes from the environment file.  The section name is the door's id in /doors/<id>/...
+# Without doors_file there is one door, 'default', set up from the environment file alone.
+#
+# Every door is its own SlidingDoor, with its own command arbiter, actuator engine and motion
+# pipeline threads, so a slow move on one door never holds up a command to another.
+
+DEFAULT_DOOR = 'default'
+
+_DOOR_ID = re.compile(r'^[A-Za-z0-9_-]+$')
+# Settings that belong to the process, not to a door.
+_SHARED = ('gpio_backend', 'SECRET_KEY', 'login_attempts_per_minute', 'login_burst', 'login_workers',
+           'login_queue', 'login_max_sessions', 'login_session_days', 'doors_file', 'rules_file', 'snapshot_dir',
+           'snapshot_memory_bytes', 'snapshot_disk_bytes', 'public_url', 'server_host', 'server_port',
+           'server_threads', 'server_backlog', 'server_keepalive_seconds', 'server_connection_limit',
+           'server_outbuf_bytes')
+_PER_DOOR = [setting.name for setting in SETTINGS if setting.name not in _SHARED]
+
+
+def load_door_configs(settings, environ=None):
+    """
+    {door id: Config}, in the order the doors are in settings.doors_file.  Raises ConfigError listing
+    every problem in the file.
+    """
+    if not settings.doors_file:
+        return collections.OrderedDict([(DEFAULT_DOOR, settings)])
+    environ = os.environ if environ is None else environ
+    parser = configparser.ConfigParser(interpolation=None)
+    # Keep the settings' case (SECRET_KEY style names).
+    parser.optionxform = str
+    try:
+        with open(settings.doors_file) as f:
+            parser.read_file(f)
+    except (OSError, configparser.Error) as e:
+        raise ConfigError("Can't read doors_file {}: {}".format(settings.doors_file, e))
+    configs = collections.OrderedDict()
+    problems = []
+    for door_id in parser.sections():
+        if not _DOOR_ID.match(door_id):
+            problems.append("[{}] door ids may only use letters, digits, - and _".format(door_id))
+        section = dict(parser.items(door_id))
+        unknown = sorted(set(section) - set(_PER_DOOR))
+        if unknown:
+            problems.append("[{}] unknown settings: {}".format(door_id, ', '.join(unknown)))
+        door_environ = dict(environ)
+        door_environ.update(section)
+        try:
+            configs[door_id] = load_config(door_environ, **dict((name, getattr(settings, name)) for name in _SHARED))
+        except ConfigError as e:
+            problems.append("[{}] {}".format(door_id, e))
+    if not parser.sections():
+        problems.append("no doors in {}".format(settings.doors_file))
+    problems.extend(_clashes(configs))
+    if problems:
+        raise ConfigError("Bad doors_file {}: {}".format(settings.doors_file, '; '.join(problems)))
+    return configs
+
+
+def _clashes(configs):
+    # Two doors driving the same pin, or writing the same history file, would fight over it.
+    problems = []
+    pins = {}
+    history_files = {}
+    for door_id, config in configs.items():
+        for name in ('open_pin', 'close_pin', 'pir_pin'):
+            pin = getattr(config, name)
+            if pin in pins and pins[pin] != door_id:
+                problems.append("[{}] {} {} is already used by [{}]".format(door_id, name, pin, pins[pin]))
+            pins.setdefault(pin, door_id)
+        if config.history_file:
+            if config.history_file in history_files:
+                problems.append("[{}] history_file {} is already used by [{}]".format(
+                    door_id, config.history_file, history_files[config.history_file]))
+            history_files.setdefault(config.history_file, door_id)
+    return problems
+
+
+class DoorRegistry:
+
+    def __init__(self, doors=()):
+        """
+        doors is a list of (door id, door) pairs.
+        """
+        self._doors = collections.OrderedDict(doors)
+
+    def add(self, door_id, door):
+        self._doors[door_id] = door
+
+    def get(self, door_id):
+        return self._doors.get(door_id)
+
+    def ids(self):
+        return list(self._doors)
+
+    def items(self):
+        return list(self._doors.items())
+
+    @property
+    def primary(self):
+        """
+        The first door, which /get_open_close and the dashboard drive.  None if there are no doors.
+        """
+        return next(iter(self._doors.values()), None)
+
+    @property
+    def primary_id(self):
+        return next(iter(self._doors), None)
+
+    def __len__(self):
+        return len(self._doors)
+
+    def __contains__(self, door_id):
+        return door_id in self._doors
+
+
+def primary_door_id(settings):
+    """
+    The id of the door the dashboard drives, before the doors are built.
+    """
+    try:
+        return next(iter(load_door_configs(settings)))
+    except ConfigError:
+        # The hardware thread reports the problem.
+        return DEFAULT_DOOR
+
+
+def build_registry(settings, events=None, factory=None, environ=None):
+    """
+    A DoorRegistry with a door for each section of settings.doors_file (or the one door settings
+    describes).  factory(config, events=, gpio=, door_id=) makes each door, SlidingDoor if not given.
+    The doors share one GPIO backend.
+    """
+    configs = load_door_configs(settings, environ)
+    if factory is None:
+        from sliding_door import SlidingDoor
+        factory = SlidingDoor
+    from gpio_backend import default_backend
+    gpio = default_backend(settings.gpio_backend)
+    registry = DoorRegistry()
+    for door_id, config in configs.items():
+        registry.add(door_id, factory(config, events=events, gpio=gpio, door_id=door_id))
+    return registry
@@ -0,0 +1,92 @@
+import json
+import threading
+
+
+# The EventHub pushes what the door is doing to the dashboards over Server-Sent Events (/events).
+# SlidingDoor publishes state changes and motion detections, the /get_open_close route publishes
+# command acknowledgements.
+#
+# Like the camera's FrameBuffer, published events go into one ring that every subscriber reads with
+# its own cursor.  An event is turned into SSE text once, however many dashboards are listening, and
+# a subscriber that disconnects leaves nothing behind in the hub.
+
+class EventHub:
+
+    def __init__(self, size=64, heartbeat=15):
+        """
+        size      - how many events are kept for subscribers that fall behind or reconnect.
+        heartbeat - seconds between keep-alive comments when nothing happens.  Writing them is also
+                    how a dead connection gets noticed and its subscriber cleaned up.
+        """
+        self.heartbeat = heartbeat
+        self._events = [None] * size
+        self._condition = threading.Condition()
+        self._lock = threading.Lock()
+        # Sequence number (SSE id) of the newest event.
+        self.seq = 0
+        self.subscribers = 0
+
+    @staticmethod
+    def format(name, data, seq=None):
+        lines = ['event: ' + name]
+        if seq is not None:
+            lines.append('id: {}'.format(seq))
+        lines.append('data: ' + json.dumps(data))
+        return ('\n'.join(lines) + '\n\n').encode()
+
+    def publish(self, name, **data):
+        with self._condition:
+            self.seq += 1
+            self._events[self.seq % len(self._events)] = self.format(name, data, self.seq)
+            self._condition.notify_all()
+
+    def _since(self, cursor):
+        # Called with the condition held.  Skips events that have already been overwritten.
+        start = max(cursor, self.seq - len(self._events)) + 1
+        return [self._events[seq % len(self._events)] for seq in range(start, self.seq + 1)]
+
+    def subscribe(self, last_event_id=None):
+        """
+        Start following the hub from after last_event_id (the newest event if None).  Events
+        published from here on are kept for the returned Subscription until it is closed.
+        """
+        with self._condition:
+            cursor = self.seq if last_event_id is None else min(last_event_id, self.seq)
+        with self._lock:
+            self.subscribers += 1
+        return Subscription(self, cursor)
+
+    def _unsubscribe(self):
+        with self._lock:
+            self.subscribers -= 1
+
+
+class Subscription:
+    """
+    Iterator of SSE text for one client.  Each item holds every event published since the last one,
+    or a keep-alive comment if nothing happened for heartbeat seconds.
+    """
+
+    def __init__(self, hub, cursor):
+        self._hub = hub
+        self._cursor = cursor
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
+            raise StopIteration
+        hub = self._hub
+        with hub._condition:
+            if not hub._condition.wait_for(lambda: hub.seq > self._cursor, hub.heartbeat):
+                return b': keep-alive\n\n'
+            events = hub._since(self._cursor)
+            self._cursor = hub.seq
+        return b''.join(events)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._hub._unsubscribe()
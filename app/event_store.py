@@ -0,0 +1,157 @@
+import mmap
+import os
+import struct
+import threading
+import time
+
+
+# The EventStore keeps a history of door commands, state changes and motion detections in a file of
+# fixed-size binary records.  The file is created at its full size and memory mapped, and is used
+# as a ring: once it is full the oldest record is overwritten.  So it never grows past its budget on
+# the SD card, and appending is a 16 byte copy into the map.  It is read back after a restart.
+#
+# Records are written in time order, so a time range is found by binary search over the ring
+# instead of by reading the whole file.
+
+# seq, timestamp, event type, door state, source, detail
+RECORD = struct.Struct('<IdBBBB')
+# Where the event type is in a record.
+_TYPE_OFFSET = struct.calcsize('<Id')
+# magic, version, record size, capacity, records written so far
+HEADER = struct.Struct('<8sHHIQ')
+HEADER_SIZE = 64
+MAGIC = b'BARKHIST'
+VERSION = 1
+
+EVENT_TYPES = {'command': 1, 'state': 2, 'motion': 3}
+SOURCES = {'unknown': 0, 'dashboard': 1, 'pir': 2, 'timer': 3, 'sensor': 4, 'rule': 5}
+DOOR_STATES = {'CLOSING': 0, 'OPENING': 1, 'IDLE': 2, 'UNKNOWN': 3}
+
+_EVENT_TYPE_NAMES = dict((v, k) for k, v in EVENT_TYPES.items())
+_SOURCE_NAMES = dict((v, k) for k, v in SOURCES.items())
+_DOOR_STATE_NAMES = dict((v, k) for k, v in DOOR_STATES.items())
+
+
+class EventStore:
+
+    def __init__(self, path, capacity=65536):
+        """
+        Open the history at path, creating it with room for capacity records if it isn't there.
+        An existing file keeps the capacity it was created with.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        exists = os.path.exists(path) and os.path.getsize(path) >= HEADER_SIZE
+        self._file = open(path, 'r+b' if exists else 'w+b')
+        if exists:
+            magic, version, record_size, capacity, count = HEADER.unpack_from(self._file.read(HEADER.size))
+            if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+                self._file.close()
+                raise ValueError("{} is not a BARK history file".format(path))
+        else:
+            count = 0
+            self._file.truncate(HEADER_SIZE + capacity * RECORD.size)
+        self.capacity = capacity
+        self.count = count
+        self._map = mmap.mmap(self._file.fileno(), HEADER_SIZE + capacity * RECORD.size)
+        if not exists:
+            self._write_header()
+        self._last_timestamp = self._read(count - 1)[1] if count else 0.0
+
+    def _write_header(self):
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, RECORD.size, self.capacity, self.count)
+
+    def _read(self, seq):
+        return RECORD.unpack_from(self._map, self._offset(seq))
+
+    def append(self, event_type, door_state='UNKNOWN', source='unknown', detail=0, timestamp=None):
+        """
+        Add a record.  event_type, door_state and source are names from EVENT_TYPES, DOOR_STATES and
+        SOURCES.  detail is a small number whose meaning depends on the type (the button for commands).
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        record_type = EVENT_TYPES[event_type]
+        record_state = DOOR_STATES.get(door_state, DOOR_STATES['UNKNOWN'])
+        record_source = SOURCES.get(source, SOURCES['unknown'])
+        with self._lock:
+            # Keep the file in time order even if the clock steps back, so the binary search holds.
+            timestamp = max(timestamp, self._last_timestamp)
+            self._last_timestamp = timestamp
+            RECORD.pack_into(self._map, self._offset(self.count), self.count & 0xffffffff, timestamp,
+                             record_type, record_state, record_source, detail)
+            self.count += 1
+            self._write_header()
+
+    def _first(self):
+        # Sequence number of the oldest record still in the ring.
+        return max(0, self.count - self.capacity)
+
+    def _offset(self, seq):
+        return HEADER_SIZE + (seq % self.capacity) * RECORD.size
+
+    def _copy(self, lo, hi):
+        # The raw records lo to hi (at most capacity of them), in one or two slices of the map.
+        if lo >= hi:
+            return b''
+        start, end = self._offset(lo), self._offset(hi - 1) + RECORD.size
+        if start < end:
+            return self._map[start:end]
+        return self._map[start:HEADER_SIZE + self.capacity * RECORD.size] + self._map[HEADER_SIZE:end]
+
+    def _bisect(self, timestamp, lo, hi):
+        # First seq in [lo, hi) whose timestamp is >= timestamp.
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._read(mid)[1] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def query(self, start=None, end=None, types=None, limit=None):
+        """
+        Records with start <= timestamp < end, oldest first, as dicts.  types is a list of event type
+        names to keep.  limit keeps only the newest limit records.
+        """
+        if limit is not None and limit < 0:
+            raise ValueError("limit must be 0 or more, not {}".format(limit))
+        wanted = None if types is None else set(EVENT_TYPES[t] for t in types)
+        # Only the raw bytes are copied with the lock held; appends wait for that and nothing more.
+        with self._lock:
+            first, last = self._first(), self.count
+            lo = first if start is None else self._bisect(start, first, last)
+            hi = last if end is None else self._bisect(end, lo, last)
+            if limit is None:
+                raw = self._copy(lo, hi)
+            elif wanted is None:
+                raw = self._copy(max(lo, hi - limit), hi)
+            else:
+                # Walk back from the newest record, looking only at the type byte, until there are
+                # limit matches.
+                matches = []
+                seq = hi
+                while seq > lo and len(matches) < limit:
+                    seq -= 1
+                    offset = self._offset(seq)
+                    if self._map[offset + _TYPE_OFFSET] in wanted:
+                        matches.append(self._map[offset:offset + RECORD.size])
+                raw = b''.join(reversed(matches))
+        records = RECORD.iter_unpack(raw)
+        if wanted is not None:
+            records = [r for r in records if r[2] in wanted]
+        return [{'timestamp': timestamp,
+                 'type': _EVENT_TYPE_NAMES.get(record_type, str(record_type)),
+                 'door_state': _DOOR_STATE_NAMES.get(door_state, str(door_state)),
+                 'source': _SOURCE_NAMES.get(source, str(source)),
+                 'detail': detail}
+                for seq, timestamp, record_type, door_state, source, detail in records]
+
+    def flush(self):
+        with self._lock:
+            self._map.flush()
+
+    def close(self):
+        with self._lock:
+            self._map.flush()
+            self._map.close()
+            self._file.close()
@@ -0,0 +1,123 @@
+import threading
+import time
+
+
+# The GPIO backends are the only code that talks to the Raspberry Pi's pins.  SlidingDoor takes one
+# so the same code runs on the Pi (RPiGPIO) and on any Linux box (SimulatedGPIO), which records
+# every pin write and lets tests and benchmarks inject PIR edges with exact timing.
+#
+# Set gpio_backend=simulated in the environment file to run the whole app without the hardware.
+
+def default_backend(name='rpi'):
+    if name == 'simulated':
+        return SimulatedGPIO()
+    return RPiGPIO()
+
+
+class RPiGPIO:
+
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        self._GPIO = GPIO
+        GPIO.setwarnings(False)
+        GPIO.setmode(GPIO.BCM)
+
+    def setup_output(self, pin):
+        self._GPIO.setup(pin, self._GPIO.OUT)
+
+    def setup_input(self, pin):
+        self._GPIO.setup(pin, self._GPIO.IN, self._GPIO.PUD_DOWN)
+
+    def output(self, pin, value):
+        self._GPIO.output(pin, value)
+
+    def input(self, pin):
+        return self._GPIO.input(pin)
+
+    def add_rising_callback(self, pin, callback):
+        # The event could have already been added.  This will cause a runtime error on add_event_detect
+        # if the event hasn't been removed first.
+        self._GPIO.remove_event_detect(pin)
+        self._GPIO.add_event_detect(pin, self._GPIO.RISING)
+        self._GPIO.add_event_callback(pin, callback)
+
+    def cleanup(self):
+        self._GPIO.cleanup()
+
+
+class SimulatedGPIO:
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.modes = {}
+        self.levels = {}
+        # (timestamp, pin, value) for every output() call.
+        self.writes = []
+        self._callbacks = {}
+        self._written = threading.Condition()
+
+    def setup_output(self, pin):
+        self.modes[pin] = 'out'
+        self.levels[pin] = False
+
+    def setup_input(self, pin):
+        self.modes[pin] = 'in'
+        self.levels[pin] = False
+
+    def output(self, pin, value):
+        with self._written:
+            self.levels[pin] = bool(value)
+            self.writes.append((self.clock(), pin, bool(value)))
+            self._written.notify_all()
+
+    def input(self, pin):
+        return self.levels.get(pin, False)
+
+    def add_rising_callback(self, pin, callback):
+        self._callbacks.setdefault(pin, []).append(callback)
+
+    def cleanup(self):
+        self._callbacks.clear()
+
+    def rising_edge(self, pin):
+        """
+        Drive pin high and call its callbacks on this thread, the way RPi.GPIO calls them on its
+        event thread.
+        """
+        self.levels[pin] = True
+        for callback in self._callbacks.get(pin, []):
+            callback(pin)
+        self.levels[pin] = False
+
+    def inject_edges(self, pin, times):
+        """
+        Fire rising edges on pin at the given clock times from a background thread.  Returns the
+        thread so the caller can join it.
+        """
+        def run():
+            for at in times:
+                delay = at - self.clock()
+                if delay > 0:
+                    time.sleep(delay)
+                self.rising_edge(pin)
+
+        thread = threading.Thread(target=run, name='edges', daemon=True)
+        thread.start()
+        return thread
+
+    def wait_for_write(self, pin, value, after=0, timeout=None):
+        """
+        Wait for a write of value to pin at index after or later in writes.  Returns the write's
+        timestamp, or None on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._written:
+            while True:
+                for when, written_pin, written in self.writes[after:]:
+                    if written_pin == pin and written == value:
+                        return when
+                after = len(self.writes)
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._written.wait(remaining)
@@ -1,29 +1,134 @@
-import inspect
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
 import sys
+import threading
+
+# All the HandleLogging instances share one logger.  Records are put on a queue and a QueueListener
+# thread formats and writes them, so the caller (a request thread or the GPIO callback) never waits
+# on the SD card.
+#
+# Settings come from the environment file:
+#   logfile          - file to log to.  Logs go to stderr if it isn't set.
+#   log_max_bytes    - rotate when the file gets this big (default 1MB).
+#   log_backup_count - how many rotated files to keep (default 3).
+#   log_rotate_when  - rotate on time instead of size, e.g. 'midnight' (see TimedRotatingFileHandler).
+#   log_json         - set to 1 to write one JSON object per line instead of text.
+
+LOGGER_NAME = 'bark'
+TEXT_FORMAT = '%(asctime)s %(levelname)s  : %(caller_file)s - %(caller_line)s - %(caller_func)s : %(message)s'
+DATE_FORMAT = '%b %-d,%Y %H:%M:%S'
+
+_configure_lock = threading.Lock()
+_listener = None
+# co_filename -> basename, so the path is only split once per source file.
+_basenames = {}
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    # The stock QueueHandler formats the message before queueing it.  We hand the record over as is
+    # so the '%' formatting happens on the listener's thread.
+    def prepare(self, record):
+        return record
+
+
+class JsonLinesFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {'time': self.formatTime(record, DATE_FORMAT),
+                 'level': record.levelname,
+                 'file': getattr(record, 'caller_file', record.filename),
+                 'line': getattr(record, 'caller_line', record.lineno),
+                 'function': getattr(record, 'caller_func', record.funcName),
+                 'message': record.getMessage()}
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def configure(logfile=None, max_bytes=1000000, backup_count=3, rotate_when=None, json_lines=False):
+    """
+    (Re)build the handler that the queue listener writes to.  Called with the environment settings
+    by the first HandleLogging() if nothing has called it yet.
+    """
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+        if logfile is None:
+            handler = logging.StreamHandler()
+        elif rotate_when is not None:
+            handler = logging.handlers.TimedRotatingFileHandler(logfile, when=rotate_when,
+                                                                backupCount=backup_count)
+        else:
+            handler = logging.handlers.RotatingFileHandler(logfile, maxBytes=max_bytes,
+                                                           backupCount=backup_count)
+        if json_lines:
+            handler.setFormatter(JsonLinesFormatter())
+        else:
+            handler.setFormatter(logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT))
+        log_queue = queue.Queue(-1)
+        logger = logging.getLogger(LOGGER_NAME)
+        logger.handlers = [_LazyQueueHandler(log_queue)]
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+        _listener = logging.handlers.QueueListener(log_queue, handler)
+        _listener.start()
+
+
+def _configure_from_env():
+    configure(logfile=os.getenv('logfile'),
+              max_bytes=int(os.getenv('log_max_bytes', 1000000)),
+              backup_count=int(os.getenv('log_backup_count', 3)),
+              rotate_when=os.getenv('log_rotate_when'),
+              json_lines=os.getenv('log_json') == '1')
+
+
+def flush():
+    """
+    Wait until everything logged so far has been written.
+    """
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener.start()
+
+
+def _shutdown():
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+
+
+atexit.register(_shutdown)
 
 
 class HandleLogging:
 
     def __init__(self):
-        logfile = os.getenv("logfile")
-        # set DEBUG for everything
-        # In the docs: https://docs.python.org/3/library/logging.html
-        # 16.6.7 Talks about LogRecord Attributes.  I am using this to
-        # provide date/time info...i tried a few others to get stack
-        # info, however returned info on this module.  So used inspect.
-        logging.basicConfig(filename=logfile, level=logging.DEBUG,
-                            format='%(asctime)s %(levelname)s  %(message)s',
-                            datefmt='%b %-d,%Y %H:%M:%S')
-
-    def _make_message(self, message):
-        # getting to the caller's caller since
-        # this function is called from within
-        (filepathname, line_number,
-         name, lines, index) = inspect.getframeinfo(sys._getframe(2))
-        code_info_str = ": {} - {} - {} : ".format(os.path.basename(filepathname), line_number, name)
-        return (code_info_str + message)
-
-    def print(self, message):
-        logging.info(self._make_message(message))
+        if _listener is None:
+            _configure_from_env()
+        self._logger = logging.getLogger(LOGGER_NAME)
+
+    def print(self, message, *args):
+        """
+        Log message at INFO.  If args are given, message is a '%' format string and is only
+        formatted when the record is written, e.g. log.print("Door state: %s", state).
+        """
+        if not self._logger.isEnabledFor(logging.INFO):
+            return
+        # Caller info comes from the caller's frame and code object.  Unlike inspect.getframeinfo()
+        # this doesn't read the source file.
+        frame = sys._getframe(1)
+        code = frame.f_code
+        filename = _basenames.get(code.co_filename)
+        if filename is None:
+            filename = _basenames[code.co_filename] = os.path.basename(code.co_filename)
+        self._logger.info(message, *args, extra={'caller_file': filename,
+                                                 'caller_line': frame.f_lineno,
+                                                 'caller_func': code.co_name})
@@ -0,0 +1,151 @@
+import binascii
+import collections
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+LOGIN_ATTEMPTS = metrics.counter('bark_login_attempts_total', 'Password attempts, by what happened to them.',
+                                 ['result'])
+PASSWORD_CHECK_SECONDS = metrics.histogram('bark_password_check_seconds',
+                                           'Time to check a password, waiting for a worker included.')
+LOGIN_SESSIONS = metrics.gauge('bark_login_sessions', 'Logged in sessions held in memory.')
+
+
+# bcrypt is slow on purpose: a few hundred milliseconds of CPU per password on a Pi.  Checked on the
+# request thread, a burst of logins (or something on the LAN guessing) takes up waitress's threads
+# and the door's buttons wait behind it.  So:
+#    - LoginThrottle gives each client a token bucket of attempts.  An attempt over it is turned
+#      away before any hashing, with how long to wait.
+#    - PasswordChecker checks passwords on a small pool of workers (login_workers) with a bounded
+#      queue (login_queue).  When it is full the attempt is turned away too, so at most
+#      login_workers + login_queue request threads are ever waiting on bcrypt.
+#    - SessionCache remembers each session that got the password right.  flask_login's user id is
+#      the session's random token, so load_user() (every @login_required request) is a dict lookup
+#      and never runs bcrypt.  Sessions are only kept in memory: restarting BARK, or changing
+#      HASHED_PASSWORD, signs everyone out.
+
+class LoginThrottle:
+
+    def __init__(self, per_minute=10.0, burst=5, max_clients=1024, clock=time.monotonic):
+        """
+        Each client may make burst attempts at once, then per_minute attempts a minute.  Only the
+        max_clients seen most recently are remembered.
+        """
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_clients = max_clients
+        self.clock = clock
+        # client: (tokens, when they were counted), least recently seen first.
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, client):
+        """
+        Take an attempt from client's bucket.  Returns 0 if there was one, otherwise the seconds until
+        there will be.
+        """
+        now = self.clock()
+        with self._lock:
+            tokens, counted = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - counted) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[client] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class LoginBusy(Exception):
+    pass
+
+
+class PasswordChecker:
+
+    def __init__(self, hashed_password=None, workers=1, queue_limit=2):
+        """
+        Checks passwords against hashed_password (HASHED_PASSWORD, read through login_user if not
+        given) on workers threads.  At most queue_limit checks wait for a worker.
+        """
+        self.hashed_password = hashed_password
+        self.workers = workers
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        # Checks running or waiting.
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+
+    def check(self, password):
+        """
+        True if password is right.  Raises LoginBusy, without hashing, if too many checks are waiting.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise LoginBusy()
+        started = time.perf_counter()
+        try:
+            return self._pool.submit(self._check, password).result()
+        finally:
+            self._slots.release()
+            PASSWORD_CHECK_SECONDS.observe(time.perf_counter() - started)
+
+    def _check(self, password):
+        # bcrypt is only imported once someone logs in.
+        from flask_bcrypt import check_password_hash
+        hashed_password = self.hashed_password
+        if hashed_password is None:
+            from login_user import User
+            hashed_password = User.hashed_password
+        return bool(hashed_password) and check_password_hash(hashed_password, password)
+
+
+class SessionCache:
+
+    def __init__(self, max_sessions=64, max_age=30 * 24 * 3600, clock=time.monotonic):
+        """
+        Holds the users of up to max_sessions logged in sessions, for max_age seconds each.
+        """
+        self.max_sessions = max_sessions
+        self.max_age = max_age
+        self.clock = clock
+        # token: (user, expires), oldest first.
+        self._sessions = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, user):
+        """
+        Remember user for a session that got the password right.  Sets user.id to the session's token,
+        which flask_login keeps in the session cookie.
+        """
+        token = binascii.hexlify(os.urandom(16)).decode('ascii')
+        user.id = token
+        with self._lock:
+            self._sessions[token] = (user, self.clock() + self.max_age)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            LOGIN_SESSIONS.set(len(self._sessions))
+        return token
+
+    def get(self, token):
+        """
+        The user of a logged in session, or None.
+        """
+        entry = self._sessions.get(token)
+        if entry is None:
+            return None
+        user, expires = entry
+        if self.clock() > expires:
+            self.discard(token)
+            return None
+        return user
+
+    def discard(self, token):
+        with self._lock:
+            self._sessions.pop(token, None)
+            LOGIN_SESSIONS.set(len(self._sessions))
+
+    def __len__(self):
+        return len(self._sessions)
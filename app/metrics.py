@@ -0,0 +1,213 @@
+import bisect
+import threading
+import time
+
+
+# A small Prometheus style metrics registry, served as text at /metrics.  Counters, gauges and
+# fixed-bucket histograms each have their own lock, held for a couple of additions, so recording a
+# value on a hot path costs about a microsecond and threads recording different metrics never wait
+# on each other.
+#
+# Metrics are made once, at module level, where they are used:
+#    DOOR_COMMANDS = metrics.counter('bark_door_commands_total', 'Commands sent to the door.', ['action'])
+#    DOOR_COMMANDS.labels(action='OPEN').inc()
+# Looking up labels is a dict lookup.  On the hottest paths, look the child up once and keep it.
+
+# Seconds.  Covers a relay switch (microseconds) up to a slow webhook (seconds).
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = ['{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+             for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._children_lock = threading.Lock()
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._children_lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _samples(self):
+        if not self.labelnames:
+            return self._child_samples(self, ())
+        samples = []
+        for key, child in sorted(self._children.items()):
+            samples.extend(self._child_samples(child, key))
+        return samples
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        for name, labels, value in self._samples():
+            lines.append('{}{} {}'.format(name, labels, _format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def _new_child(self):
+        return Counter(self.name, self.documentation)
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def _child_samples(self, child, key):
+        return [(self.name, _format_labels(self.labelnames, key), child.value)]
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        """
+        If function is given, the gauge's value is whatever it returns when /metrics is read.
+        """
+        super().__init__(name, documentation, labelnames)
+        self._lock = threading.Lock()
+        self._function = function
+        self.value = 0
+
+    def _new_child(self):
+        return Gauge(self.name, self.documentation)
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, function):
+        self._function = function
+
+    def _child_samples(self, child, key):
+        value = child._function() if child._function is not None else child.value
+        return [(self.name, _format_labels(self.labelnames, key), value)]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # Count per bucket (not cumulative), with the last one for values above every bound.
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def _new_child(self):
+        return Histogram(self.name, self.documentation, buckets=self.buckets)
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+    def _child_samples(self, child, key):
+        with child._lock:
+            counts = list(child._counts)
+            count, total = child.count, child.sum
+        samples = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float('inf'),), counts):
+            cumulative += n
+            samples.append((self.name + '_bucket', _format_labels(self.labelnames, key, [('le', _format_value(
+                float(bound)))]), cumulative))
+        samples.append((self.name + '_count', _format_labels(self.labelnames, key), count))
+        samples.append((self.name + '_sum', _format_labels(self.labelnames, key), total))
+        return samples
+
+
+class _Timer:
+    # with HISTOGRAM.time(): ... observes how long the block took.
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start)
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # Modules can be imported more than once (tests); hand back the metric already there.
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self._add(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        """
+        Every metric in the Prometheus text exposition format (version 0.0.4).
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+# The registry /metrics serves.
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
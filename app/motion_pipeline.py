@@ -0,0 +1,105 @@
+import threading
+import time
+
+
+# The MotionPipeline sits between the PIR's GPIO edge callback and whatever wants to know a dog is
+# at the door.  It used to be RPi.GPIO's bouncetime, set in minutes, that did this.  That lost real
+# detections for minutes at a time and still let through the motion caused by the door itself.
+#
+# Every rising edge is recorded with a monotonic timestamp.  Then:
+#    - an edge within debounce_seconds of the last one is a bounce (the PIR fires twice per
+#      detection) and is dropped.
+#    - while the door is moving, and for settle_seconds after it stops, edges are masked.
+#    - an edge only starts a new "dog at door" event once the PIR has been quiet for rearm_seconds.
+#      Edges in the meantime are the same dog and just keep the event going.
+#
+# Timestamps can be passed in, so recorded edge traces can be replayed faster than real time.
+
+class MotionPipeline:
+
+    def __init__(self, on_motion, debounce_seconds=0.5, rearm_seconds=60, settle_seconds=3,
+                 history=256, clock=time.monotonic):
+        """
+        on_motion is called as on_motion(timestamp) for each deduplicated event, on the thread that
+        called edge().
+        """
+        self.on_motion = on_motion
+        self.debounce_seconds = debounce_seconds
+        self.rearm_seconds = rearm_seconds
+        self.settle_seconds = settle_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        # The newest edges, for looking at what the PIR did.
+        self._edges = [None] * history
+        self.edges = 0
+        self.bounces = 0
+        self.masked = 0
+        self.events = 0
+        self._last_edge = None
+        self._last_accepted = None
+        self._moving = False
+        self._masked_until = None
+
+    def edge(self, timestamp=None):
+        """
+        Record a rising edge from the PIR.  Returns True if it started a new event.
+        """
+        now = self.clock() if timestamp is None else timestamp
+        with self._lock:
+            self._edges[self.edges % len(self._edges)] = now
+            self.edges += 1
+            last_edge = self._last_edge
+            self._last_edge = now
+            if last_edge is not None and now - last_edge < self.debounce_seconds:
+                self.bounces += 1
+                return False
+            if self._moving or (self._masked_until is not None and now < self._masked_until):
+                self.masked += 1
+                return False
+            last_accepted = self._last_accepted
+            self._last_accepted = now
+            if last_accepted is not None and now - last_accepted < self.rearm_seconds:
+                # Still the same visit.
+                return False
+            self.events += 1
+        self.on_motion(now)
+        return True
+
+    def door_moving(self, moving, timestamp=None):
+        """
+        Tell the pipeline the actuator started or stopped.  Edges are masked while it moves and for
+        settle_seconds after.
+        """
+        now = self.clock() if timestamp is None else timestamp
+        with self._lock:
+            if moving:
+                self._moving = True
+            elif self._moving:
+                self._moving = False
+                self._masked_until = now + self.settle_seconds
+
+    def recent_edges(self):
+        """
+        Timestamps of the edges still in the history, oldest first.
+        """
+        with self._lock:
+            size = len(self._edges)
+            return [self._edges[n % size] for n in range(max(0, self.edges - size), self.edges)]
+
+    def replay(self, trace):
+        """
+        Run a recorded trace through the pipeline.  trace is a list of (timestamp, what) where what is
+        'edge', 'moving' or 'stopped'.  Returns the timestamps of the events that came out.
+        """
+        events = []
+        on_motion = self.on_motion
+        self.on_motion = events.append
+        try:
+            for timestamp, what in trace:
+                if what == 'edge':
+                    self.edge(timestamp)
+                else:
+                    self.door_moving(what == 'moving', timestamp)
+        finally:
+            self.on_motion = on_motion
+        return events
@@ -0,0 +1,167 @@
+import queue
+import threading
+import time
+import weakref
+
+import metrics
+from handle_logging_lib import HandleLogging
+
+NOTIFICATION_SECONDS = metrics.histogram('bark_notification_seconds',
+                                         'How long each try at sending an alert took.')
+NOTIFICATIONS = metrics.counter('bark_notifications_total', 'Alerts by what happened to them.', ['result'])
+# Each door has a Notifier of its own.  The gauge is the alerts waiting across all of them.
+_NOTIFIERS = weakref.WeakSet()
+NOTIFICATION_QUEUE = metrics.gauge('bark_notification_queue_depth', 'Alerts waiting to be sent, over every door.',
+                                   function=lambda: sum(notifier.queue_depth() for notifier in list(_NOTIFIERS)))
+_SENT = NOTIFICATIONS.labels(result='sent')
+_FAILED = NOTIFICATIONS.labels(result='failed')
+_DROPPED = NOTIFICATIONS.labels(result='dropped')
+_COALESCED = NOTIFICATIONS.labels(result='coalesced')
+
+
+# The Notifier sends motion alerts (the IFTTT webhook) from its own thread.  The GPIO callback only
+# has to call notify(), which puts the event on a bounded queue and returns.  A slow or unreachable
+# endpoint then backs up this thread instead of every later PIR callback.
+
+class RequestsTransport:
+    """
+    Sends a GET over one keep-alive requests.Session so each alert reuses the same connection.
+    """
+
+    def __init__(self):
+        # requests takes a while to import on the Pi, so it is only imported once there is an alert
+        # to send.
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __call__(self, url, timeout):
+        response = self.session.get(url, timeout=timeout)
+        response.raise_for_status()
+
+    def close(self):
+        self.session.close()
+
+
+class Notifier:
+
+    def __init__(self, url, transport=None, max_queue=16, timeout=5, retries=3, backoff=0.5,
+                 coalesce_seconds=30):
+        """
+        url              - where to send the alert.
+        transport        - called as transport(url, timeout).  Raises if the alert wasn't delivered.
+        max_queue        - events past this many waiting are dropped.
+        timeout          - seconds to wait on the endpoint for each try.
+        retries          - tries after the first one fails.  The wait doubles from backoff seconds.
+        coalesce_seconds - events within this many seconds of a sent alert are merged into it.
+        """
+        self.url = url
+        self._transport = transport
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.coalesce_seconds = coalesce_seconds
+        self.log = HandleLogging()
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stats_lock = threading.Lock()
+        self._last_sent = None
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.last_latency = None
+        self._total_latency = 0.0
+        self._thread = threading.Thread(target=self._run, name='notifier', daemon=True)
+        self._thread.start()
+        _NOTIFIERS.add(self)
+
+    def notify(self, link=None):
+        """
+        Queue an alert.  link (a snapshot's URL) is sent along as IFTTT's value1.  Never blocks.
+        Returns False if the queue was full and the alert dropped.
+        """
+        try:
+            self._queue.put_nowait((time.monotonic(), link))
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+            _DROPPED.inc()
+            return False
+        return True
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._stats_lock:
+            return {'queue_depth': self._queue.qsize(),
+                    'sent': self.sent,
+                    'failed': self.failed,
+                    'dropped': self.dropped,
+                    'coalesced': self.coalesced,
+                    'last_latency': self.last_latency,
+                    'mean_latency': self._total_latency / self.sent if self.sent else None}
+
+    @property
+    def transport(self):
+        # Made the first time it is needed, on the notifier's thread.
+        if self._transport is None:
+            self._transport = RequestsTransport()
+        return self._transport
+
+    def close(self, timeout=None):
+        _NOTIFIERS.discard(self)
+        self._queue.put(None)
+        self._thread.join(timeout)
+        if hasattr(self._transport, 'close'):
+            self._transport.close()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            queued_at, link = item
+            if self._last_sent is not None and queued_at - self._last_sent < self.coalesce_seconds:
+                # Part of the burst the last alert was sent for.
+                with self._stats_lock:
+                    self.coalesced += 1
+                _COALESCED.inc()
+                continue
+            # Only an alert that got through starts a burst.  After a failed one, the next motion
+            # is tried again rather than merged into an alert nobody received.
+            if self._deliver(queued_at, link):
+                self._last_sent = queued_at
+
+    def _deliver(self, queued_at, link=None):
+        # True if the alert was sent, False once every try has failed.
+        url = self.url
+        if link is not None:
+            from urllib.parse import quote
+            url += ('&' if '?' in url else '?') + 'value1=' + quote(link, safe='')
+        wait = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                with NOTIFICATION_SECONDS.time():
+                    self.transport(url, self.timeout)
+            except Exception as e:
+                self.log.print("Notification try %d failed: %s", attempt + 1, e)
+                if attempt < self.retries:
+                    time.sleep(wait)
+                    wait *= 2
+                continue
+            latency = time.monotonic() - queued_at
+            with self._stats_lock:
+                self.sent += 1
+                self.last_latency = latency
+                self._total_latency += latency
+            _SENT.inc()
+            self.log.print("Sent a movement detection notification in %.3fs.", latency)
+            return True
+        with self._stats_lock:
+            self.failed += 1
+        _FAILED.inc()
+        return False
@@ -0,0 +1,230 @@
+import collections
+import configparser
+import re
+import threading
+import time
+
+import metrics
+from config import ConfigError
+
+RULES_FIRED = metrics.counter('bark_rules_fired_total', 'Door commands given by rules, by rule.', ['rule'])
+
+# The rules engine lets the door act on motion by itself, instead of a phone alert and someone pressing
+# Open on the dashboard.  Rules are in the file named by rules_file in the environment file, one
+# section per rule, tried in the order they are in the file:
+#
+#    [let the dog in]
+#    when = motion
+#    between = 07:00-21:00
+#    door_state = idle, unknown
+#    action = open
+#    close_after = 45
+#
+#    when         - the event the rule reacts to.  Only motion (a dog at the door) for now.
+#    between      - local times the rule is on, HH:MM-HH:MM.  May run past midnight (21:00-07:00).
+#                   All day if left out.
+#    door_state   - door states the rule applies in.  Any state if left out.
+#    action       - open, close or stop.
+#    close_after  - close the door this many seconds later.  Another command (from the dashboard,
+#                   say) or another firing of the rule cancels or restarts it.  Must be longer than
+#                   the door's seconds_to_open_door.  If the door is still moving then, the close
+#                   waits until it stops.
+#    door         - the door id the rule is for (see door_registry.py).  Every door if left out.
+#
+# The rules are compiled once into a table indexed by event, door state and minute of the day, so
+# matching an event is a dict lookup and a list index.  It runs on the GPIO callback thread, before
+# the phone alert is queued, and the command goes straight to the door's command arbiter.
+
+EVENTS = ('motion',)
+DOOR_STATES = ('CLOSING', 'OPENING', 'IDLE', 'UNKNOWN')
+ACTIONS = ('close', 'open', 'stop')
+MINUTES_PER_DAY = 24 * 60
+
+Rule = collections.namedtuple('Rule', ['name', 'event', 'start', 'end', 'door_states', 'action', 'close_after',
+                                       'door'])
+
+_TIME = re.compile(r'^(\d{1,2}):(\d{2})$')
+_OPTIONS = ('when', 'between', 'door_state', 'action', 'close_after', 'door')
+
+
+def _minute(text):
+    # Minute of the day for HH:MM.  24:00 is the end of the day.
+    match = _TIME.match(text.strip())
+    if not match:
+        raise ValueError(text)
+    hours, minutes = int(match.group(1)), int(match.group(2))
+    if minutes > 59 or hours * 60 + minutes > MINUTES_PER_DAY:
+        raise ValueError(text)
+    return hours * 60 + minutes
+
+
+def parse_rule(name, options):
+    """
+    A Rule from a rules file section.  Raises ValueError with every problem in it.
+    """
+    problems = []
+    unknown = sorted(set(options) - set(_OPTIONS))
+    if unknown:
+        problems.append("unknown options: {}".format(', '.join(unknown)))
+    event = options.get('when', 'motion').strip().lower()
+    if event not in EVENTS:
+        problems.append("when should be one of {}, not {!r}".format(', '.join(EVENTS), event))
+    start, end = 0, MINUTES_PER_DAY
+    if 'between' in options:
+        try:
+            start_text, end_text = options['between'].split('-')
+            start, end = _minute(start_text), _minute(end_text)
+        except ValueError:
+            problems.append("between should be HH:MM-HH:MM, not {!r}".format(options['between']))
+    door_states = frozenset(DOOR_STATES)
+    if options.get('door_state', '').strip():
+        door_states = frozenset(state.strip().upper() for state in options['door_state'].split(','))
+        bad = sorted(door_states - set(DOOR_STATES))
+        if bad:
+            problems.append("door_state should be from {}, not {}".format(
+                ', '.join(s.lower() for s in DOOR_STATES), ', '.join(s.lower() for s in bad)))
+    action = options.get('action', '').strip().lower()
+    if action not in ACTIONS:
+        problems.append("action should be one of {}, not {!r}".format(', '.join(ACTIONS), action))
+    close_after = None
+    if options.get('close_after', '').strip():
+        try:
+            close_after = float(options['close_after'])
+            if close_after <= 0:
+                raise ValueError
+        except ValueError:
+            problems.append("close_after should be a number of seconds, not {!r}".format(options['close_after']))
+    if problems:
+        raise ValueError('; '.join(problems))
+    return Rule(name, event, start, end, door_states, action, close_after, options.get('door', '').strip() or None)
+
+
+def load_rules(path, doors=None):
+    """
+    The rules in the file at path, in order.  doors is {door id: Config} of the doors the rules are
+    for: a close_after must be longer than the seconds_to_open_door of each door its rule applies to.
+    Raises ConfigError listing every problem in the file.
+    """
+    parser = configparser.ConfigParser(interpolation=None)
+    try:
+        with open(path) as f:
+            parser.read_file(f)
+    except (OSError, configparser.Error) as e:
+        raise ConfigError("Can't read rules_file {}: {}".format(path, e))
+    rules = []
+    problems = []
+    for name in parser.sections():
+        try:
+            rules.append(parse_rule(name, dict(parser.items(name))))
+        except ValueError as e:
+            problems.append("[{}] {}".format(name, e))
+    for rule in rules:
+        for door_id, config in (doors or {}).items():
+            if rule.close_after is None or rule.door not in (None, door_id):
+                continue
+            if rule.close_after <= config.seconds_to_open_door:
+                # The close would come while the door is still opening.
+                problems.append("[{}] close_after {:g} should be longer than [{}]'s seconds_to_open_door {:g}".format(
+                    rule.name, rule.close_after, door_id, config.seconds_to_open_door))
+    if problems:
+        raise ConfigError("Bad rules_file {}: {}".format(path, '; '.join(problems)))
+    return rules
+
+
+def compile_rules(rules, door_id=None):
+    """
+    {(event, door state): list of the first matching rule (or None) for each minute of the day}, for
+    the rules that apply to door_id.
+    """
+    index = {}
+    for rule in rules:
+        if rule.door is not None and rule.door != door_id:
+            continue
+        if rule.start <= rule.end:
+            minutes = range(rule.start, rule.end)
+        else:
+            # Past midnight.
+            minutes = list(range(rule.start, MINUTES_PER_DAY)) + list(range(0, rule.end))
+        for door_state in rule.door_states:
+            table = index.setdefault((rule.event, door_state), [None] * MINUTES_PER_DAY)
+            for minute in minutes:
+                # Earlier rules win.
+                if table[minute] is None:
+                    table[minute] = rule
+    return index
+
+
+class RulesEngine:
+
+    def __init__(self, rules, door_id=None, clock=time.time, retry_seconds=1.0):
+        """
+        rules is a list of Rules, of which those for door_id are used.  clock gives the time of day.
+        A close_after that comes due while the door is still moving is tried again every
+        retry_seconds.
+        """
+        self.rules = list(rules)
+        self.clock = clock
+        self.retry_seconds = retry_seconds
+        self._index = compile_rules(self.rules, door_id)
+        self._lock = threading.Lock()
+        self._close_timer = None
+        self.fired = 0
+
+    def match(self, event, door_state, timestamp=None):
+        """
+        The rule for event with the door in door_state ('IDLE' etc.), or None.
+        """
+        table = self._index.get((event, door_state))
+        if table is None:
+            return None
+        now = time.localtime(self.clock() if timestamp is None else timestamp)
+        return table[now.tm_hour * 60 + now.tm_min]
+
+    def motion(self, door):
+        """
+        Called with the SlidingDoor when it sees a dog at the door.  Returns the rule that fired, if any.
+        """
+        rule = self.match('motion', door.door_state_str(door.door_state))
+        if rule is None:
+            return None
+        self.fired += 1
+        RULES_FIRED.labels(rule=rule.name).inc()
+        door.do_action(getattr(door.button_states, rule.action), source='rule')
+        if rule.close_after is not None:
+            self._schedule_close(door, rule.close_after)
+        return rule
+
+    def command(self, source):
+        """
+        Called by the door for every command.  One that didn't come from a rule cancels the pending
+        close_after: someone has taken over.
+        """
+        if source != 'rule':
+            self.cancel_close()
+
+    def cancel_close(self):
+        with self._lock:
+            if self._close_timer is not None:
+                self._close_timer.cancel()
+                self._close_timer = None
+
+    def _schedule_close(self, door, seconds):
+        with self._lock:
+            if self._close_timer is not None:
+                self._close_timer.cancel()
+            timer = threading.Timer(seconds, self._close, args=(door,))
+            timer.daemon = True
+            self._close_timer = timer
+            timer.start()
+
+    def _close(self, door):
+        with self._lock:
+            if self._close_timer is None or self._close_timer is not threading.current_thread():
+                # Cancelled or restarted while firing.
+                return
+            self._close_timer = None
+        if door.door_state in (door.door_states.opening, door.door_states.closing):
+            # The door would ignore the close.  Try again once it has stopped.
+            self._schedule_close(door, self.retry_seconds)
+            return
+        door.do_action(door.button_states.close, source='rule')
@@ -0,0 +1,78 @@
+#
+# Production entry point for BARK.  BARK.service runs this file instead of bark_door_app.py so the
+# app is served by waitress with a fixed pool of worker threads, rather than by Flask's development
+# server (no reloader, no debugger).
+#
+# The server settings come from the environment file (see config.py):
+#   server_host              - address to listen on (default 0.0.0.0).
+#   server_port              - port to listen on (default 8519).
+#   server_threads           - worker threads handling requests (default 24).  Each open dashboard
+#                              holds two for as long as it is open, one for /events and one for
+#                              /stream, so the default leaves 8 for everything else with 8 viewers.
+#   server_backlog           - connections the OS queues before refusing more (default 64).
+#   server_keepalive_seconds - how long an idle keep-alive connection is held open (default 30).
+#   server_connection_limit  - most connections open at once (default 100).
+#   server_outbuf_bytes      - response bytes held for a slow client before its thread waits
+#                              (default 256KB, a few camera frames).  Without a limit waitress
+#                              queues every /stream frame a slow phone hasn't read yet, in memory
+#                              and then in a temporary file, and the phone falls further and further
+#                              behind.  With it the thread waits and then skips to the newest frame.
+#
+# The server starts listening as soon as the app is built; the door hardware comes up on a background
+# thread.  When the door can be controlled, systemd is told READY=1 (BARK.service is Type=notify) and
+# how long each phase of startup took is logged.
+#
+
+import sys
+
+from startup import PhaseTimer, sd_notify
+
+TIMER = PhaseTimer()
+
+with TIMER.phase('imports'):
+    from waitress import serve
+
+    from bark_door_app import create_app
+    from config import ConfigError, load_config
+    from door_registry import load_door_configs
+    from rules_engine import load_rules
+    from handle_logging_lib import HandleLogging
+
+
+def serve_settings(settings=None):
+    settings = load_config() if settings is None else settings
+    return {'host': settings.server_host,
+            'port': settings.server_port,
+            'threads': settings.server_threads,
+            'backlog': settings.server_backlog,
+            'channel_timeout': settings.server_keepalive_seconds,
+            'connection_limit': settings.server_connection_limit,
+            'outbuf_high_watermark': settings.server_outbuf_bytes}
+
+
+def main():
+    log = HandleLogging()
+    try:
+        with TIMER.phase('config'):
+            settings = load_config()
+            # Check the doors and rules files now too, rather than when the hardware comes up.
+            door_configs = load_door_configs(settings)
+            if settings.rules_file:
+                load_rules(settings.rules_file, door_configs)
+    except ConfigError as e:
+        log.print("%s", e)
+        sd_notify('STATUS={}'.format(e))
+        sys.exit(1)
+
+    def ready():
+        log.print("Door ready %.0fms after start (%s)", TIMER.since_start() * 1000, TIMER.summary())
+        sd_notify('READY=1')
+
+    # The app, and with it the one SlidingDoor that owns the GPIO pins, is built once.
+    with TIMER.phase('app'):
+        app = create_app(settings=settings, timer=TIMER, on_ready=ready)
+    serve(app, ident='BARK', **serve_settings(settings))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,84 +1,225 @@
-import datetime
-import os
+import threading
 from collections import namedtuple
 
-import RPi.GPIO as GPIO
-import requests
-
+import metrics
+from actuator_engine import ActuatorEngine
+from command_arbiter import CommandArbiter
+from config import load_config
+from distance_sampler import DistanceSampler, VL6180XBackend
+from event_hub import EventHub
+from event_store import EventStore
+from gpio_backend import default_backend
 from handle_logging_lib import HandleLogging
+from motion_pipeline import MotionPipeline
+from notifier import Notifier
+from rules_engine import RulesEngine, load_rules
+
+IFTTT_URL = 'https://maker.ifttt.com/trigger/Barking/with/key/e-deNt3oqThDXl2nSB4NAlNeImbIo_s8V1cnZDxNxWn'
+
+DOOR_COMMANDS = metrics.counter('bark_door_commands_total', 'Commands given to the door.', ['action'])
+DOOR_COMMANDS_IGNORED = metrics.counter('bark_door_commands_ignored_total',
+                                        'OPEN or CLOSE commands dropped because the door was already moving.')
+DOOR_TRANSITIONS = metrics.counter('bark_door_transitions_total', 'Door state changes, by new state.', ['state'])
+DOOR_STATE = metrics.gauge('bark_door_state', 'Door state: 0 closing, 1 opening, 2 idle, 3 unknown.', ['door'])
+MOTION_CALLBACK_SECONDS = metrics.histogram('bark_motion_callback_seconds',
+                                            'Time spent in the PIR GPIO callback.')
+MOTION_EVENTS = metrics.counter('bark_motion_events_total', 'Dog at the door detections.')
 
 
 # The SlidingDoor class:
 #    - controls the linear actuator by opening, closing, or stopping it.
 #    - detects and notifies if a dog is at the door.
+#
+# If door_closed_mm and door_open_mm are set in the environment file, the VL6180X distance sensor
+# is sampled in the background and the relays are cut as soon as the reading says the door is
+# closed (range <= door_closed_mm) or open (range >= door_open_mm).  seconds_to_open_door is then
+# only the longest a move is allowed to take.
 
 class SlidingDoor:
-    seconds_to_open_door = int(os.getenv('seconds_to_open_door'))
     Button_states = namedtuple('Button_states', ['close', 'open', 'stop'])
     button_states = Button_states(0, 1, 2)
     Door_states = namedtuple('Door_states', ['closing', 'opening', 'idle', 'unknown'])
     door_states = Door_states(0, 1, 2, 3)
 
-    def __init__(self):
-        self._init_GPIO()
-        self._init_motion()
+    def __init__(self, config=None, notifier=None, events=None, sampler=None, gpio=None, history=None,
+                 door_id='default', rules=None):
         # Variables unique to each instance
         self.log = HandleLogging()
+        # Which door this is, when the Pi runs several (see door_registry.py).
+        self.door_id = door_id
+        self._door_state_gauge = DOOR_STATE.labels(door=door_id)
+        # Settings from the environment file (see config.py).
+        self.config = load_config() if config is None else config
+        self.seconds_to_open_door = self.config.seconds_to_open_door
+        # The pins are driven through a GPIO backend: RPi.GPIO on the Pi, or a simulated one.
+        self.gpio = default_backend(self.config.gpio_backend) if gpio is None else gpio
+        # Door state changes and motion detections are published here for the dashboards.
+        self.events = EventHub() if events is None else events
+        # ...and recorded in the history file, if there is one (history_file in the environment file).
+        if history is None and self.config.history_file:
+            history = EventStore(self.config.history_file)
+        self.history = history
+        # What caused the next state change, for the history: a command's source, 'timer' or 'sensor'.
+        self._source = 'unknown'
+        # The move the door is making (what ActuatorEngine.start() returned), None when it is still.
+        self._move = None
+        self._door_state = None
+        # Rules that open or close the door by themselves on motion (rules_file in the environment file).
+        if rules is None and self.config.rules_file:
+            rules = RulesEngine(load_rules(self.config.rules_file, {door_id: self.config}), door_id)
+        self.rules = rules
+        # Alerts go out on the notifier's thread so the GPIO callback never waits on the network.
+        self.notifier = Notifier(IFTTT_URL) if notifier is None else notifier
+        self._init_GPIO()
+        self._init_motion()
+        # The engine turns the relays on and off on a timer thread so a move doesn't hold the caller.
+        self._engine = ActuatorEngine(self.gpio.output)
+        # The door state is changed by commands, the engine's timer thread and the distance sampler.
+        self._lock = threading.RLock()
+        # Commands from every request thread are carried out one at a time on the arbiter's thread.
+        self._arbiter = CommandArbiter(self._apply_command, self.button_states.stop)
+        self._init_distance(sampler)
         # Set the initial button and door states.
         self._button_state = self.button_states.stop
         self.door_state = self.door_states.unknown
 
+    @property
+    def door_state(self):
+        return self._door_state
+
+    @door_state.setter
+    def door_state(self, door_state):
+        if door_state != self._door_state:
+            self._door_state = door_state
+            self._door_state_gauge.set(door_state)
+            DOOR_TRANSITIONS.labels(state=self.door_state_str(door_state)).inc()
+            # The PIR sees the door move, so motion is masked while it does.
+            self.motion.door_moving(door_state in (self.door_states.opening, self.door_states.closing))
+            self.events.publish('state', door=self.door_id, door_state=self.door_state_str(door_state))
+            if self.history is not None:
+                self.history.append('state', self.door_state_str(door_state), self._source)
+
     def _init_GPIO(self):
-        GPIO.setwarnings(False)
-        GPIO.setmode(GPIO.BCM)
-        self.open_pin = int(os.getenv('open_pin'))
-        GPIO.setup(self.open_pin, GPIO.OUT)
-        self.close_pin = int(os.getenv('close_pin'))
-        GPIO.setup(self.close_pin, GPIO.OUT)
-        self.pir_pin = int(os.getenv('pir_pin'))
-        GPIO.setup(self.pir_pin, GPIO.IN, GPIO.PUD_DOWN)
+        self.open_pin = self.config.open_pin
+        self.gpio.setup_output(self.open_pin)
+        self.close_pin = self.config.close_pin
+        self.gpio.setup_output(self.close_pin)
+        self.pir_pin = self.config.pir_pin
+        self.gpio.setup_input(self.pir_pin)
 
-    def _init_motion(self):
-        # The event could have already been added.  This will cause a runtime error on add_event_detect
-        # if the event hasn't been removed first.
-        GPIO.remove_event_detect(self.pir_pin)
-        ms_between_detect = int(os.getenv('mins_between_detecting_motion')) * 60000
-        # Using bouncetime to stop detection that continually occur.  This is similar to a button's bounce behavior.
-        # Multiple detects occur when the sliding door is opening or closing.  We want to detect when a dog is at the
-        # backyard.
+    def _init_distance(self, sampler):
+        self.door_closed_mm = self.config.door_closed_mm
+        self.door_open_mm = self.config.door_open_mm
+        if self.door_closed_mm is None or self.door_open_mm is None:
+            # No positions to aim for, so moves run for seconds_to_open_door.
+            self.sampler = None
+            return
+        if sampler is None:
+            sampler = DistanceSampler(VL6180XBackend())
+            sampler.start()
+        self.sampler = sampler
 
-        GPIO.add_event_detect(self.pir_pin, GPIO.RISING, bouncetime=ms_between_detect)
-        GPIO.add_event_callback(self.pir_pin, self.movement_handler)
+    def door_position(self):
+        """
+        The door's distance reading in mm, from the sampler's buffer.  None without a sensor.
+        """
+        if self.sampler is None:
+            return None
+        return self.sampler.position()
+
+    def _init_motion(self):
+        # Every edge goes to the motion pipeline, which drops the PIR's double callbacks and the motion
+        # caused by the door itself.  After a dog is detected, the PIR has to be quiet for
+        # mins_between_detecting_motion before the next detection counts as a new dog at the door.
+        self.motion = MotionPipeline(self._dog_at_door,
+                                     rearm_seconds=self.config.mins_between_detecting_motion * 60)
+        # With a camera watching too, edges are checked against it first (see use_vision()).
+        self.fusion = None
+        # Where motion snapshots are kept, and the URL alerts link them with (see use_snapshots()).
+        self.snapshots = None
+        self.public_url = None
+        self.gpio.add_rising_callback(self.pir_pin, self.movement_handler)
 
         self.motion_detected = False
 
+    def use_vision(self, detector, **fusion_settings):
+        """
+        Only count motion the camera (a VisionMotionDetector) agrees with or is sure of on its own.
+        What gets through still goes through the motion pipeline.
+        """
+        from vision_motion import MotionFusion
+        self.fusion = MotionFusion(self.motion.edge, detector, **fusion_settings)
+
+    def use_snapshots(self, store, public_url=None):
+        """
+        Keep a camera snapshot (in store, a SnapshotStore) of every dog at the door.  With public_url,
+        the alert links to it.
+        """
+        self.snapshots = store
+        self.public_url = public_url
+
     def check_and_send(self):
-        # HERE'S AN ODD THING.  Each detection generates two callbacks to movement_handler.  One
-        # has the door_state set to UNKNOWN.  This only happens during __init__.  Once a do_action
-        # has occurred, the door_state is either OPENING, CLOSING, or IDLE.
-        self.log.print("Door state: {} ".format(self.door_state))
-        if self.door_state == self.door_states.idle:
-            # Send a notification to our phone.
-            requests.get(
-                'https://maker.ifttt.com/trigger/Barking/with/key/e-deNt3oqThDXl2nSB4NAlNeImbIo_s8V1cnZDxNxWn')
-            self.log.print(
-                "Sent a movement detection notification.  Door state: {}".format(self.door_state))
-            self.motion_detected = True
+        # Only called for motion the pipeline let through, so no moving door and no double callbacks.
+        self.log.print("Door state: %s ", self.door_state)
+        # The snapshot is only queued here.  The frame is grabbed and saved on the snapshot thread.
+        snapshot_id = None if self.snapshots is None else self.snapshots.capture(self.door_id)
+        # Queue a notification to our phone.
+        if snapshot_id is not None and self.public_url:
+            queued = self.notifier.notify(link='{}/snapshots/{}'.format(self.public_url.rstrip('/'), snapshot_id))
         else:
-            self.motion_detected = False
+            queued = self.notifier.notify()
+        if queued:
+            self.log.print(
+                "Queued a movement detection notification.  Door state: %s", self.door_state)
+        self.motion_detected = True
+        self.events.publish('motion', door=self.door_id, door_state=self.door_state_str(self.door_state),
+                            snapshot=snapshot_id)
+        if self.history is not None:
+            self.history.append('motion', self.door_state_str(self.door_state), 'pir')
+
+    def _dog_at_door(self, timestamp):
+        MOTION_EVENTS.inc()
+        # The rules act first, on this thread, so the relay doesn't wait on anything else.
+        if self.rules is not None:
+            self.rules.motion(self)
+        self.check_and_send()
 
     def movement_handler(self, pin):
         """
-        The movement_handler is the callback set up by call to  GPIO.add_event_callback.  It is called when the pir_pin
+        The movement_handler is the callback set up by call to gpio.add_rising_callback.  It is called when the pir_pin
         goes from LOW to HIGH (i.e.: GPIO.add_event_detect(pin,GPIO.RISING)
         """
-        self.check_and_send()
+        with MOTION_CALLBACK_SECONDS.time():
+            if self.fusion is None:
+                self.motion.edge()
+            else:
+                self.fusion.pir()
 
-    def do_action(self, button_action):
+    def do_action(self, button_action, source='dashboard'):
+        """
+        Carry out a button press and return the door state it led to.  Safe to call from any thread:
+        the command waits its turn on the arbiter (see command_arbiter.py).  A repeat of the command
+        already waiting is merged into it, and STOP goes ahead of everything waiting.
+        """
         # Making sure we get a button action we know how to handle.
         if button_action not in self.button_states:
-            self.log.print("The button action {} is not one of the button states.".format(button_action))
-            return
+            self.log.print("The button action %s is not one of the button states.", button_action)
+            return self.door_state
+        DOOR_COMMANDS.labels(action=self.button_state_str(button_action)).inc()
+        return self._arbiter.submit(button_action, source)
+
+    def _apply_command(self, button_action, source):
+        # On the arbiter's thread.
+        if self.rules is not None:
+            self.rules.command(source)
+        with self._lock:
+            if self.history is not None:
+                self.history.append('command', self.door_state_str(self.door_state), source, button_action)
+            self._source = source
+            self._do_action(button_action)
+            return self.door_state
+
+    def _do_action(self, button_action):
             # Take action if the door state is idle or the Stop button was pressed.
             # The stop button allows going from open to close (or close to open) before the full time it would take
             # to do so.  Multiple button clicks to the same button (unless it's the stop button) will be ignored.
@@ -106,45 +247,71 @@ class SlidingDoor:
                 self.stop()
         # Multiple clicks to OPEN or CLOSED while in the process of opening or closing.
         else:
-            self.log.print(
-                "_handle_button_press(): nada.... door state {} button action {}".format(
-                    self.door_state_str(self.door_state_str(self.door_state)),
-                    self.button_state_str(button_action)))
+            DOOR_COMMANDS_IGNORED.inc()
+            self.log.print("_handle_button_press(): nada.... door state %s button action %s",
+                           self.door_state_str(self.door_state), self.button_state_str(button_action))
 
     def close_door(self):
         self.door_state = self.door_states.closing
-        self.log.print("CHANGING DOOR STATE TO CLOSE.  Door state: {}".format(self.door_state))
+        self.log.print("CHANGING DOOR STATE TO CLOSE.  Door state: %s", self.door_state)
         self.move_door(self.close_pin)
 
     def open_door(self):
         self.door_state = self.door_states.opening
-        self.log.print("CHANGING DOOR STATE TO OPEN.  Door state: {}".format(self.door_state))
+        self.log.print("CHANGING DOOR STATE TO OPEN.  Door state: %s", self.door_state)
         self.move_door(self.open_pin)
 
     # Set both relays off.
     def stop(self):
         self._button_state = self.button_states.stop
+        # Throw away the pending deadline of a move in progress.
+        self._engine.cancel()
+        self._move = None
+        if self.sampler is not None:
+            self.sampler.unwatch()
         self.turn_off_switches()
         # Here the door is set to idle, but it could be partially opened.
         self.door_state = self.door_states.idle
         self.log.print("CHANGING DOOR STATE TO IDLE.")
 
     def turn_off_switches(self):
-        GPIO.output(self.open_pin, False)
-        GPIO.output(self.close_pin, False)
+        self.gpio.output(self.open_pin, False)
+        self.gpio.output(self.close_pin, False)
 
     def move_door(self, pin):
         self.turn_off_switches()
-        GPIO.output(pin, True)
-        self.wait(self.seconds_to_open_door)
-        GPIO.output(pin, False)
-
-    def wait(self, s):
-        now = datetime.datetime.now()
-        end_of_open_time = datetime.timedelta(seconds=s)
-        while datetime.datetime.now() < now + end_of_open_time:
-            pass
-        self.door_state = self.door_states.idle
+        # Returns right away.  The engine turns the relay off after seconds_to_open_door.
+        move = self._engine.start(pin, self.seconds_to_open_door, self._move_done)
+        self._move = move
+        if self.sampler is not None:
+            # ...or sooner, once the distance sensor says the door got there.
+            if pin == self.open_pin:
+                self.sampler.watch(lambda mm: mm >= self.door_open_mm, lambda: self._target_reached(move))
+            else:
+                self.sampler.watch(lambda mm: mm <= self.door_closed_mm, lambda: self._target_reached(move))
+
+    def _target_reached(self, move):
+        with self._lock:
+            # A late callback from an earlier move must not label the one in progress.
+            if not self._engine.is_current(move):
+                return
+            self._source = 'sensor'
+            self._engine.finish(move)
+
+    def _move_done(self, move):
+        # Called on the engine's timer thread once the door has had time to open or close.  The
+        # engine calls it after letting go of its lock, so a STOP and a new move may have got in
+        # first: then this move is long over, and the door is busy with the new one.
+        with self._lock:
+            if move != self._move:
+                return
+            self._move = None
+            if self.sampler is not None:
+                # A move that ran out of time leaves its distance watch set.
+                self.sampler.unwatch()
+            if self._source != 'sensor':
+                self._source = 'timer'
+            self.door_state = self.door_states.idle
         self.log.print("CHANGING DOOR STATE TO IDLE.")
 
     # Make reading the logfile's entry on door state more readable.
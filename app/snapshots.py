@@ -0,0 +1,292 @@
+import collections
+import os
+import queue
+import re
+import threading
+import time
+
+import metrics
+from handle_logging_lib import HandleLogging
+
+SNAPSHOT_SECONDS = metrics.histogram('bark_snapshot_seconds',
+                                     'Time from motion to its snapshot being available, by step.', ['step'])
+SNAPSHOT_CACHE = metrics.counter('bark_snapshot_cache_total', 'Snapshot reads, by where they were found.',
+                                 ['result'])
+SNAPSHOT_CACHE_BYTES = metrics.gauge('bark_snapshot_cache_bytes', 'Bytes of snapshots held in memory.')
+_HIT = SNAPSHOT_CACHE.labels(result='hit')
+_MISS = SNAPSHOT_CACHE.labels(result='miss')
+
+
+# When a dog is at the door, a snapshot of the camera is kept, so the phone alert can link to what
+# happened instead of to a live view the dog has long left.
+#
+# capture() is called on the motion path and only queues a request.  The snapshot thread grabs the
+# next camera frame (starting the camera if nobody is watching), keeps the JPEG as it came from the
+# camera, and makes a thumbnail (with Pillow, if it is installed).  Snapshots are kept:
+#    - on disk in snapshot_dir, if set, up to snapshot_disk_bytes.  The oldest go first.  They are
+#      found again after a restart.
+#    - in memory, in an LRU cache of up to snapshot_memory_bytes, so several phones opening the same
+#      alert are served without touching the SD card.
+# Without snapshot_dir, the memory cache is all there is.
+
+SnapshotInfo = collections.namedtuple('SnapshotInfo', ['id', 'door', 'timestamp', 'size', 'thumbnail_size'])
+
+KINDS = ('full', 'thumb')
+_FILE = re.compile(r'^(\d{8}-\d{6}-\d{3})\.([A-Za-z0-9_-]+)\.(full|thumb)\.jpg$')
+SNAPSHOT_ID = re.compile(r'^\d{8}-\d{6}-\d{3}$')
+
+
+def make_thumbnail(jpeg, size=(160, 120), quality=75):
+    """
+    A small JPEG of jpeg, or None if Pillow isn't installed.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    import io
+    image = Image.open(io.BytesIO(jpeg))
+    # Decode at a reduced size straight from the JPEG's DCT data.
+    image.draft('RGB', size)
+    image.thumbnail(size)
+    out = io.BytesIO()
+    image.convert('RGB').save(out, format='JPEG', quality=quality)
+    return out.getvalue()
+
+
+class ByteBudgetCache:
+    """
+    LRU cache of bytes values that holds at most budget bytes.
+    """
+
+    def __init__(self, budget, on_evict=None):
+        self.budget = budget
+        self.on_evict = on_evict
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                _MISS.inc()
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+        _HIT.inc()
+        return value
+
+    def put(self, key, value):
+        if len(value) > self.budget:
+            return
+        evicted = []
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old)
+            self._items[key] = value
+            self.bytes += len(value)
+            while self.bytes > self.budget:
+                old_key, old_value = self._items.popitem(last=False)
+                self.bytes -= len(old_value)
+                evicted.append(old_key)
+        SNAPSHOT_CACHE_BYTES.set(self.bytes)
+        if self.on_evict is not None:
+            for old_key in evicted:
+                self.on_evict(old_key)
+
+    def __contains__(self, key):
+        return key in self._items
+
+
+class SnapshotStore:
+
+    def __init__(self, camera, directory=None, memory_bytes=4000000, disk_bytes=64000000, frame_timeout=5,
+                 clock=time.time):
+        """
+        camera has snapshot(timeout) returning a JPEG (a CameraStream).  directory, memory_bytes and
+        disk_bytes are snapshot_dir, snapshot_memory_bytes and snapshot_disk_bytes.
+        """
+        self.camera = camera
+        self.directory = directory
+        self.disk_bytes = disk_bytes
+        self.frame_timeout = frame_timeout
+        self.clock = clock
+        self.log = HandleLogging()
+        self.cache = ByteBudgetCache(memory_bytes, on_evict=None if directory else self._forget)
+        self._lock = threading.Lock()
+        # id: SnapshotInfo, oldest first.
+        self._index = collections.OrderedDict()
+        # id: Event set once the snapshot is available (or failed).
+        self._pending = {}
+        self._disk_used = 0
+        self._last_id = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._load_index()
+        self._queue = queue.Queue(maxsize=16)
+        self._thread = threading.Thread(target=self._run, name='snapshots', daemon=True)
+        self._thread.start()
+
+    def _load_index(self):
+        sizes = {}
+        for name in os.listdir(self.directory):
+            match = _FILE.match(name)
+            if match:
+                snapshot_id, door, kind = match.groups()
+                entry = sizes.setdefault(snapshot_id, {'door': door})
+                entry[kind] = os.path.getsize(os.path.join(self.directory, name))
+        for snapshot_id in sorted(sizes):
+            entry = sizes[snapshot_id]
+            if 'full' not in entry:
+                continue
+            timestamp = (time.mktime(time.strptime(snapshot_id[:15], '%Y%m%d-%H%M%S')) +
+                         int(snapshot_id[16:]) / 1000)
+            self._index[snapshot_id] = SnapshotInfo(snapshot_id, entry['door'], timestamp, entry['full'],
+                                                    entry.get('thumb'))
+            self._disk_used += entry['full'] + entry.get('thumb', 0)
+
+    def _new_id(self, timestamp):
+        # Sortable, unique and safe in a URL and a file name: 20181104-153012-123.
+        millis = int(round(timestamp * 1000))
+        if self._last_id is not None and millis <= self._last_id:
+            millis = self._last_id + 1
+        self._last_id = millis
+        return '{}-{:03d}'.format(time.strftime('%Y%m%d-%H%M%S', time.localtime(millis // 1000)), millis % 1000)
+
+    def capture(self, door='default'):
+        """
+        Queue a snapshot of the next camera frame.  Never blocks.  Returns the snapshot's id, or None if
+        the queue is full.
+        """
+        now = self.clock()
+        with self._lock:
+            snapshot_id = self._new_id(now)
+            done = threading.Event()
+            self._pending[snapshot_id] = done
+        try:
+            self._queue.put_nowait((snapshot_id, door, now, time.monotonic()))
+        except queue.Full:
+            with self._lock:
+                del self._pending[snapshot_id]
+            done.set()
+            return None
+        return snapshot_id
+
+    def wait(self, snapshot_id, timeout=None):
+        """
+        Wait for a snapshot from capture() to be available.  Returns True if it is.
+        """
+        with self._lock:
+            done = self._pending.get(snapshot_id)
+        if done is not None:
+            done.wait(timeout)
+        return snapshot_id in self._index
+
+    def list(self, limit=None):
+        """
+        SnapshotInfo for each snapshot, newest first.  limit keeps only the newest limit.
+        """
+        if limit is not None and limit < 0:
+            raise ValueError("limit must be 0 or more, not {}".format(limit))
+        with self._lock:
+            snapshots = list(reversed(self._index.values()))
+        return snapshots if limit is None else snapshots[:limit]
+
+    def info(self, snapshot_id):
+        return self._index.get(snapshot_id)
+
+    def get(self, snapshot_id, kind='full', wait=2.0):
+        """
+        The JPEG bytes of a snapshot ('full' or 'thumb'), or None.  A snapshot still being taken is
+        waited for, up to wait seconds.
+        """
+        if not self.wait(snapshot_id, wait):
+            return None
+        data = self.cache.get((snapshot_id, kind))
+        if data is not None or not self.directory:
+            return data
+        info = self._index.get(snapshot_id)
+        if info is None:
+            return None
+        try:
+            with open(self._path(info, kind), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        self.cache.put((snapshot_id, kind), data)
+        return data
+
+    def _path(self, info, kind):
+        return os.path.join(self.directory, '{}.{}.{}.jpg'.format(info.id, info.door, kind))
+
+    def _forget(self, key):
+        # Memory only: a snapshot whose bytes left the cache is gone.
+        snapshot_id, kind = key
+        if kind == 'full':
+            with self._lock:
+                self._index.pop(snapshot_id, None)
+
+    def _run(self):
+        while True:
+            snapshot_id, door, timestamp, queued_at = self._queue.get()
+            try:
+                self._take(snapshot_id, door, timestamp, queued_at)
+            except Exception as e:
+                self.log.print("Snapshot %s failed: %s", snapshot_id, e)
+            finally:
+                with self._lock:
+                    done = self._pending.pop(snapshot_id, None)
+                if done is not None:
+                    done.set()
+
+    def _take(self, snapshot_id, door, timestamp, queued_at):
+        jpeg = self.camera.snapshot(self.frame_timeout)
+        if jpeg is None:
+            self.log.print("No camera frame for snapshot %s", snapshot_id)
+            return
+        SNAPSHOT_SECONDS.labels(step='frame').observe(time.monotonic() - queued_at)
+        try:
+            thumbnail = make_thumbnail(jpeg)
+        except Exception as e:
+            self.log.print("Couldn't make a thumbnail for snapshot %s: %s", snapshot_id, e)
+            thumbnail = None
+        info = SnapshotInfo(snapshot_id, door, timestamp, len(jpeg),
+                            None if thumbnail is None else len(thumbnail))
+        if self.directory:
+            self._write(info, 'full', jpeg)
+            if thumbnail is not None:
+                self._write(info, 'thumb', thumbnail)
+        with self._lock:
+            self._index[snapshot_id] = info
+            self._disk_used += len(jpeg) + len(thumbnail or b'')
+        # Newest first into the cache: it is the one the phones are about to ask for.
+        if thumbnail is not None:
+            self.cache.put((snapshot_id, 'thumb'), thumbnail)
+        self.cache.put((snapshot_id, 'full'), jpeg)
+        if self.directory:
+            self._trim_disk()
+        SNAPSHOT_SECONDS.labels(step='available').observe(time.monotonic() - queued_at)
+
+    def _write(self, info, kind, data):
+        path = self._path(info, kind)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+
+    def _trim_disk(self):
+        while True:
+            with self._lock:
+                if self._disk_used <= self.disk_bytes or len(self._index) <= 1:
+                    return
+                snapshot_id, info = self._index.popitem(last=False)
+                self._disk_used -= info.size + (info.thumbnail_size or 0)
+            for kind in KINDS:
+                try:
+                    os.remove(self._path(info, kind))
+                except OSError:
+                    pass
@@ -0,0 +1,73 @@
+import os
+import socket
+import threading
+import time
+
+import metrics
+
+# Startup support for serve.py:
+#    - PhaseTimer records how long each phase of startup took, for the log and /metrics.
+#    - sd_notify() tells systemd (Type=notify in BARK.service) when the door is controllable.
+
+STARTUP_PHASE_SECONDS = metrics.gauge('bark_startup_phase_seconds', 'How long each phase of startup took.',
+                                      ['phase'])
+
+
+class PhaseTimer:
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.started = clock()
+        # (phase, seconds) in the order they finished.
+        self.phases = []
+        self._lock = threading.Lock()
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.phases.append((name, seconds))
+        STARTUP_PHASE_SECONDS.labels(phase=name).set(seconds)
+
+    def since_start(self):
+        return self.clock() - self.started
+
+    def summary(self):
+        with self._lock:
+            return ', '.join('{} {:.0f}ms'.format(name, seconds * 1000) for name, seconds in self.phases)
+
+
+class _Phase:
+    def __init__(self, timer, name):
+        self._timer = timer
+        self._name = name
+
+    def __enter__(self):
+        self._start = self._timer.clock()
+        return self
+
+    def __exit__(self, *exc):
+        self._timer.record(self._name, self._timer.clock() - self._start)
+
+
+def sd_notify(message):
+    """
+    Send message (e.g. 'READY=1') to systemd.  Does nothing if we weren't started by systemd with
+    Type=notify.  Returns True if the message was sent.
+    """
+    address = os.getenv('NOTIFY_SOCKET')
+    if not address:
+        return False
+    if address.startswith('@'):
+        # Abstract namespace socket.
+        address = '\0' + address[1:]
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.connect(address)
+        sock.sendall(message.encode())
+    except OSError:
+        return False
+    finally:
+        sock.close()
+    return True
@@ -0,0 +1,131 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+
+try:
+    # Optional.  Without it only gzip versions are built.
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# The dashboard's CSS, JavaScript and images, served by the Pi itself instead of from CDNs, so the
+# dashboard loads on the LAN when the internet is down.
+#
+# Each asset is served under a name with a hash of its content in it (bootstrap.min.3f2a....css), so
+# the browser can cache it forever (Cache-Control: immutable) and never has to ask again; a changed
+# file gets a new name.  gzip (and brotli, if installed) versions are built once and kept in
+# build_dir, so nothing is compressed per request, and every version is held in memory.
+#
+# Templates link to assets with asset_url('bootstrap.min.css').  Run this file to build the
+# compressed versions ahead of time, e.g. when deploying.
+
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Compressing images that are already compressed doesn't pay.
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+
+def default_sources():
+    """
+    {name: path} for the app's static/ files and the Bootstrap and jQuery files Flask-Bootstrap ships.
+    """
+    import flask_bootstrap
+    bootstrap = os.path.join(os.path.dirname(flask_bootstrap.__file__), 'static')
+    sources = {'bootstrap.min.css': os.path.join(bootstrap, 'css', 'bootstrap.min.css'),
+               # Includes popper.js.
+               'bootstrap.bundle.min.js': os.path.join(bootstrap, 'js', 'bootstrap.bundle.min.js'),
+               'jquery.min.js': os.path.join(bootstrap, 'jquery.min.js')}
+    static = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    for name in sorted(os.listdir(static)):
+        path = os.path.join(static, name)
+        if os.path.isfile(path):
+            sources[name] = path
+    return sources
+
+
+class Asset:
+
+    def __init__(self, name, data, mimetype):
+        self.name = name
+        self.mimetype = mimetype
+        self.digest = hashlib.sha256(data).hexdigest()[:16]
+        root, ext = os.path.splitext(name)
+        self.hashed_name = '{}.{}{}'.format(root, self.digest, ext)
+        # {content encoding: bytes}, with None for the uncompressed data.
+        self.encodings = {None: data}
+
+    def etag(self, encoding):
+        return self.digest if encoding is None else '{}-{}'.format(self.digest, encoding)
+
+
+class AssetBundle:
+
+    def __init__(self, sources=None, build_dir=None):
+        """
+        sources is {name: path}, default_sources() if not given.  Compressed versions are read from
+        and written to build_dir (static/dist if not given); if it can't be written they are only
+        kept in memory.
+        """
+        sources = default_sources() if sources is None else sources
+        self.build_dir = (os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'dist')
+                          if build_dir is None else build_dir)
+        self.assets = {}
+        self._by_hashed_name = {}
+        for name, path in sources.items():
+            with open(path, 'rb') as f:
+                data = f.read()
+            mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            asset = Asset(name, data, mimetype)
+            if mimetype.startswith(COMPRESSIBLE):
+                self._compress(asset, data)
+            self.assets[name] = asset
+            self._by_hashed_name[asset.hashed_name] = asset
+
+    def _compress(self, asset, data):
+        compressors = [('gzip', '.gz', lambda d: gzip.compress(d, 9))]
+        if brotli is not None:
+            compressors.append(('br', '.br', lambda d: brotli.compress(d, quality=11)))
+        for encoding, suffix, compress in compressors:
+            path = os.path.join(self.build_dir, asset.hashed_name + suffix)
+            try:
+                with open(path, 'rb') as f:
+                    compressed = f.read()
+            except OSError:
+                compressed = compress(data)
+                try:
+                    os.makedirs(self.build_dir, exist_ok=True)
+                    # Written under another name first so a half written file is never read back.
+                    with open(path + '.tmp', 'wb') as f:
+                        f.write(compressed)
+                    os.replace(path + '.tmp', path)
+                except OSError:
+                    pass
+            # Keep it only if it is actually smaller.
+            if len(compressed) < len(data):
+                asset.encodings[encoding] = compressed
+
+    def url_name(self, name):
+        return self.assets[name].hashed_name
+
+    def lookup(self, hashed_name):
+        return self._by_hashed_name.get(hashed_name)
+
+    @staticmethod
+    def choose_encoding(asset, accept_encoding):
+        """
+        The best encoding of asset the client accepts: brotli, then gzip, then none.
+        """
+        accepted = set(part.split(';')[0].strip() for part in accept_encoding.split(','))
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted and encoding in asset.encodings:
+                return encoding
+        return None
+
+
+if __name__ == '__main__':
+    bundle = AssetBundle()
+    for asset in sorted(bundle.assets.values(), key=lambda a: a.name):
+        print('{:32} {}'.format(asset.hashed_name, ', '.join(
+            '{} {}'.format(encoding or 'identity', len(data)) for encoding, data in asset.encodings.items())))
@@ -0,0 +1,206 @@
+import threading
+import time
+
+import numpy as np
+
+import metrics
+from handle_logging_lib import HandleLogging
+
+VISION_FRAME_SECONDS = metrics.histogram('bark_vision_frame_seconds',
+                                         'Time to decode and analyse one camera frame.')
+VISION_FRAMES = metrics.counter('bark_vision_frames_total', 'Camera frames analysed for motion.')
+MOTION_FUSED = metrics.counter('bark_motion_fused_total',
+                               'Motion passed on to the motion pipeline, by what saw it.', ['seen_by'])
+
+
+# The PIR fires when the door moves, when the sun comes out and twice per detection.  The camera
+# pointing at the spot outside the door can tell it apart:
+#    - each frame is turned into a small grayscale image (80x60 by default), so the work per frame
+#      stays small whatever the camera resolution.
+#    - a running average of past frames is the background.  Pixels that differ from it by more than
+#      pixel_threshold have changed.  A change in overall brightness (sun, clouds) is taken out first,
+#      so it doesn't count.
+#    - only pixels in the region of interest (vision_roi in the environment file) are counted.
+#    - the score is the fraction of the region that changed.
+# All of it is a handful of NumPy operations on the whole image, with no per-pixel Python.
+#
+# MotionFusion then decides what counts as motion: the PIR and the camera agreeing within
+# agree_seconds of each other, or the camera alone when the score is high enough to be sure.
+
+def parse_roi(text):
+    """
+    (x0, y0, x1, y1) as fractions of the frame from 'x0,y0,x1,y1'.
+    """
+    values = tuple(float(v) for v in text.split(','))
+    if len(values) != 4 or not (0 <= values[0] < values[2] <= 1 and 0 <= values[1] < values[3] <= 1):
+        raise ValueError("vision_roi should be x0,y0,x1,y1 as fractions of the frame, not {!r}".format(text))
+    return values
+
+
+def to_gray(frame, width, height):
+    """
+    frame (an HxW or HxWx3 uint8 array) as a height x width uint8 grayscale image.  The frame is
+    averaged over blocks, so its size should be a whole multiple of width x height.
+    """
+    if frame.ndim == 3:
+        # The green channel is most of a pixel's brightness, and much cheaper than a weighted sum.
+        frame = frame[:, :, 1]
+    rows, cols = frame.shape
+    fy, fx = rows // height, cols // width
+    if fy == 1 and fx == 1:
+        return frame[:height, :width]
+    blocks = frame[:height * fy, :width * fx].reshape(height, fy, width, fx)
+    return (blocks.sum(axis=(1, 3), dtype=np.uint32) // (fy * fx)).astype(np.uint8)
+
+
+def decode_jpeg(jpeg, width, height):
+    """
+    A JPEG frame as a grayscale image about width x height.  The JPEG is decoded at a reduced size
+    straight from its DCT data (PIL's draft mode), which is most of the saving.
+    """
+    import io
+    from PIL import Image
+    image = Image.open(io.BytesIO(jpeg))
+    image.draft('L', (width, height))
+    return np.asarray(image.convert('L'))
+
+
+class VisionMotionDetector:
+
+    def __init__(self, width=80, height=60, roi=None, alpha=0.05, pixel_threshold=25, active_fraction=0.02,
+                 on_frame=None, clock=time.monotonic):
+        """
+        roi is (x0, y0, x1, y1) as fractions of the frame, the whole frame if not given.  alpha is how
+        fast the background follows the picture.  A frame is active when at least active_fraction of
+        the region changed.  on_frame is called as on_frame(timestamp, score) after each frame.
+        """
+        self.width = width
+        self.height = height
+        self.alpha = alpha
+        self.pixel_threshold = pixel_threshold
+        self.active_fraction = active_fraction
+        self.on_frame = on_frame
+        self.clock = clock
+        self.mask = np.zeros((height, width), dtype=bool)
+        x0, y0, x1, y1 = (0, 0, 1, 1) if roi is None else roi
+        self.mask[int(y0 * height):int(round(y1 * height)), int(x0 * width):int(round(x1 * width))] = True
+        self._roi_pixels = max(1, int(self.mask.sum()))
+        self._background = None
+        # Scratch arrays, so a frame allocates as little as possible.
+        self._diff = np.empty((height, width), dtype=np.float32)
+        self._changed = np.empty((height, width), dtype=bool)
+        self.frames = 0
+        self.score = 0.0
+        self.last_active = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self.log = HandleLogging()
+
+    def process(self, frame, timestamp=None):
+        """
+        Analyse one frame (a uint8 array, any multiple of width x height).  Returns its score, the
+        fraction of the region of interest that changed.
+        """
+        now = self.clock() if timestamp is None else timestamp
+        gray = to_gray(frame, self.width, self.height)
+        if self._background is None:
+            self._background = gray.astype(np.float32)
+            score = 0.0
+        else:
+            diff = self._diff
+            np.subtract(gray, self._background, out=diff)
+            # Take out a change of brightness across the whole region (the sun, a cloud).
+            diff -= diff[self.mask].mean()
+            np.abs(diff, out=diff)
+            np.greater(diff, self.pixel_threshold, out=self._changed)
+            self._changed &= self.mask
+            score = float(np.count_nonzero(self._changed)) / self._roi_pixels
+            # background += alpha * (gray - background)
+            self._background *= 1 - self.alpha
+            self._background += self.alpha * gray
+        self.frames += 1
+        self.score = score
+        if score >= self.active_fraction:
+            self.last_active = now
+        if self.on_frame is not None:
+            self.on_frame(now, score)
+        return score
+
+    def watch(self, camera):
+        """
+        Analyse the frames of camera (a CameraStream) on a thread of its own, as one more client of its
+        frame buffer.  When it falls behind it skips to the newest frame.
+        """
+        self._thread = threading.Thread(target=self._run, args=(camera,), name='vision', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self, camera):
+        while not self._stopped.is_set():
+            frames = camera.frames()
+            try:
+                for jpeg in frames:
+                    if self._stopped.is_set():
+                        break
+                    with VISION_FRAME_SECONDS.time():
+                        self.process(decode_jpeg(jpeg, self.width, self.height))
+                    VISION_FRAMES.inc()
+            except Exception as e:
+                self.log.print("Vision motion detection failed: %s", e)
+            finally:
+                frames.close()
+            # The camera stopped.  Try again in a while.
+            self._stopped.wait(5)
+
+
+class MotionFusion:
+
+    def __init__(self, on_motion, detector, agree_seconds=2.0, confident_fraction=0.15, clock=time.monotonic):
+        """
+        on_motion(timestamp) is called for motion both the PIR and detector saw within agree_seconds,
+        or that detector scored at least confident_fraction on its own.  pir() and the detector's
+        frames call it on their own threads.
+        """
+        self.on_motion = on_motion
+        self.detector = detector
+        self.agree_seconds = agree_seconds
+        self.confident_fraction = confident_fraction
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._last_pir = None
+        self.rejected = 0
+        detector.on_frame = self.vision
+
+    def pir(self, timestamp=None):
+        """
+        A PIR edge.  Passed on if the camera saw motion within agree_seconds before it.
+        """
+        now = self.clock() if timestamp is None else timestamp
+        last_active = self.detector.last_active
+        with self._lock:
+            if last_active is None or now - last_active > self.agree_seconds:
+                # The camera may not have caught up yet.  A frame within agree_seconds can still confirm it.
+                self._last_pir = now
+                self.rejected += 1
+                return False
+        MOTION_FUSED.labels(seen_by='both').inc()
+        self.on_motion(now)
+        return True
+
+    def vision(self, timestamp, score):
+        if score >= self.confident_fraction:
+            seen_by = 'camera'
+        elif score >= self.detector.active_fraction:
+            with self._lock:
+                if self._last_pir is None or timestamp - self._last_pir > self.agree_seconds:
+                    return
+                # This frame confirms the PIR edge it was waiting for.
+                self._last_pir = None
+                self.rejected -= 1
+            seen_by = 'both'
+        else:
+            return
+        MOTION_FUSED.labels(seen_by=seen_by).inc()
+        self.on_motion(timestamp)
@@ -0,0 +1,71 @@
+#
+# The app's modules live in app/ and import each other as top level modules (PyCharm marks app/ as a
+# source folder).  Put app/ on the path so the tests can be run with plain pytest too.
+#
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+# Off the Pi there is no .env, so give SlidingDoor the settings it needs.  Anything set in .env (loaded
+# by pytest-dotenv) wins.
+for name, value in (('open_pin', '20'), ('close_pin', '21'), ('pir_pin', '4'),
+                    ('seconds_to_open_door', '1'), ('mins_between_detecting_motion', '1')):
+    os.environ.setdefault(name, value)
+
+
+# Stand-ins and helpers shared by the test files.  Import the classes (from conftest import
+# QuietNotifier), or ask for the fixtures below.
+
+class QuietNotifier:
+    # Stands in for the Notifier.  Counts alerts, and keeps the snapshot links they carried.
+    def __init__(self):
+        self.notified = 0
+        self.links = []
+
+    def notify(self, link=None):
+        self.notified += 1
+        self.links.append(link)
+        return True
+
+
+class StillDoor:
+    # Stands in for SlidingDoor.  The door starts UNKNOWN, and every command leaves it idle.
+    door_state = 3
+
+    def do_action(self, button_action, source='dashboard'):
+        self.door_state = 2
+        return self.door_state
+
+    def door_state_str(self, door_state):
+        return {2: 'IDLE', 3: 'UNKNOWN'}[door_state]
+
+
+def wait_for(condition, timeout=5, interval=0.005):
+    """
+    Poll condition() until it is true.  Returns False if it wasn't within timeout seconds.
+    """
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if condition():
+            return True
+        time.sleep(interval)
+    return False
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+@pytest.fixture
+def quiet_notifier():
+    return QuietNotifier()
+
+
+@pytest.fixture
+def still_door():
+    return StillDoor()
@@ -1,27 +1,77 @@
+import threading
+
 import pytest
 
-from sliding_door import Actuator
+from conftest import QuietNotifier
+from gpio_backend import SimulatedGPIO
+from sliding_door import SlidingDoor
+
+
+@pytest.fixture()
+def gpio():
+    return SimulatedGPIO()
 
 
 @pytest.fixture()
-def actuator():
-    a = Actuator()
+def actuator(gpio):
+    a = SlidingDoor(notifier=QuietNotifier(), gpio=gpio)
+    a.seconds_to_open_door = 0.1
     return a
 
 
-def test_open(actuator):
+def test_open(actuator, gpio):
     actuator.open_door()
-    assert True
+    assert actuator.door_state == actuator.door_states.opening
+    assert gpio.levels[actuator.open_pin]
+    assert gpio.wait_for_write(actuator.open_pin, False, after=3, timeout=2) is not None
+    assert actuator.door_state == actuator.door_states.idle
 
 
-def test_close(actuator):
+def test_close(actuator, gpio):
     actuator.close_door()
-    assert True
+    assert actuator.door_state == actuator.door_states.closing
+    assert gpio.levels[actuator.close_pin]
+    assert gpio.wait_for_write(actuator.close_pin, False, after=3, timeout=2) is not None
+    assert actuator.door_state == actuator.door_states.idle
 
 
-def test_stop(actuator):
+def test_stop(actuator, gpio):
+    actuator.seconds_to_open_door = 5
+    actuator.open_door()
+    actuator.stop()
+    assert not gpio.levels[actuator.open_pin]
+    assert not gpio.levels[actuator.close_pin]
+    assert actuator.door_state == actuator.door_states.idle
+
+
+def test_late_move_done_leaves_next_move_alone(actuator, gpio):
+    # Hold the first move's on_done back until a STOP and a new OPEN have gone through.
+    move_done = actuator._move_done
+    gate = threading.Event()
+    held = threading.Event()
+    released = threading.Event()
+
+    def delayed(move):
+        if not held.is_set():
+            held.set()
+            gate.wait(2)
+            move_done(move)
+            released.set()
+        else:
+            move_done(move)
+
+    actuator._move_done = delayed
+    actuator.open_door()
+    assert held.wait(2)
+    actuator.seconds_to_open_door = 5
+    actuator.stop()
+    actuator.open_door()
+    gate.set()
+    assert released.wait(2)
+    assert actuator.door_state == actuator.door_states.opening
+    assert gpio.levels[actuator.open_pin]
+    assert actuator._engine.moving
     actuator.stop()
-    assert True
 
 
 def test_actuator_value(actuator):
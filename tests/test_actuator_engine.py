@@ -0,0 +1,108 @@
+#
+# The ActuatorEngine switches relays from a timer thread.  These tests use a list
+# of (pin, value) writes in place of GPIO.output so they run off the Pi.
+#
+import threading
+import time
+
+import pytest
+
+from actuator_engine import ActuatorEngine
+
+OPEN_PIN = 20
+CLOSE_PIN = 21
+
+
+class RecordingOutput:
+    def __init__(self):
+        self.writes = []
+        self.times = []
+
+    def __call__(self, pin, value):
+        self.writes.append((pin, value))
+        self.times.append(time.monotonic())
+
+
+@pytest.fixture()
+def output():
+    return RecordingOutput()
+
+
+@pytest.fixture()
+def engine(output):
+    return ActuatorEngine(output)
+
+
+def test_start_returns_right_away(engine, output):
+    start = time.monotonic()
+    engine.start(OPEN_PIN, 5)
+    elapsed = time.monotonic() - start
+    assert elapsed < 0.05
+    assert engine.moving
+    assert output.writes == [(OPEN_PIN, True)]
+    engine.cancel()
+
+
+def test_deadline_turns_relay_off(engine, output):
+    done = threading.Event()
+    engine.start(OPEN_PIN, 0.1, lambda move: done.set())
+    assert done.wait(2)
+    assert output.writes == [(OPEN_PIN, True), (OPEN_PIN, False)]
+    assert not engine.moving
+    on_time = output.times[1] - output.times[0]
+    assert 0.09 < on_time < 0.5
+
+
+def test_cancel_drops_deadline(engine, output):
+    done = threading.Event()
+    engine.start(CLOSE_PIN, 0.1, lambda move: done.set())
+    assert engine.cancel()
+    assert not done.wait(0.3)
+    assert output.writes == [(CLOSE_PIN, True), (CLOSE_PIN, False)]
+    assert not engine.cancel()
+
+
+def test_restart_cancels_previous_move(engine, output):
+    first = threading.Event()
+    second = threading.Event()
+    engine.start(OPEN_PIN, 0.1, lambda move: first.set())
+    engine.start(CLOSE_PIN, 0.1, lambda move: second.set())
+    assert second.wait(2)
+    assert not first.is_set()
+    assert output.writes == [(OPEN_PIN, True), (OPEN_PIN, False), (CLOSE_PIN, True), (CLOSE_PIN, False)]
+
+
+def test_finish_ends_move_early(engine, output):
+    done = threading.Event()
+    engine.start(OPEN_PIN, 5, lambda move: done.set())
+    engine.finish()
+    assert done.is_set()
+    assert output.writes == [(OPEN_PIN, True), (OPEN_PIN, False)]
+
+
+# The old wait() spun on datetime.now() for the whole move.  While the engine waits for
+# its deadline the process should be close to idle.
+def test_cpu_during_move(engine):
+    done = threading.Event()
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+    engine.start(OPEN_PIN, 0.5, lambda move: done.set())
+    assert done.wait(2)
+    cpu = time.process_time() - cpu_start
+    wall = time.monotonic() - wall_start
+    print("\n\ntest_cpu_during_move(): {:.1f}ms of CPU over a {:.0f}ms move ({:.2%})".format(
+        cpu * 1000, wall * 1000, cpu / wall))
+    assert cpu / wall < 0.1
+
+
+def test_stop_latency(engine, output):
+    latencies = []
+    for _ in range(100):
+        engine.start(OPEN_PIN, 5)
+        start = time.monotonic()
+        engine.cancel()
+        latencies.append(output.times[-1] - start)
+    latencies.sort()
+    print("\n\ntest_stop_latency(): median {:.3f}ms, worst {:.3f}ms".format(
+        latencies[50] * 1000, latencies[-1] * 1000))
+    assert latencies[-1] < 0.01
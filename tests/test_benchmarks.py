@@ -0,0 +1,88 @@
+#
+# Latency and throughput of the door control paths, run on the simulated GPIO backend so they can be
+# measured on any Linux box.  Each benchmark prints its numbers.
+#
+import json
+import time
+
+import pytest
+
+from bark_door_app import create_app
+from conftest import QuietNotifier
+from gpio_backend import SimulatedGPIO
+from sliding_door import SlidingDoor
+
+CLOSE, OPEN, STOP = 0, 1, 2
+
+
+@pytest.fixture()
+def gpio():
+    return SimulatedGPIO(clock=time.perf_counter)
+
+
+@pytest.fixture()
+def door(gpio):
+    d = SlidingDoor(notifier=QuietNotifier(), gpio=gpio)
+    d.seconds_to_open_door = 5
+    yield d
+    d.stop()
+
+
+def summary(name, latencies):
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[int(len(latencies) * 0.99)]
+    print("\n\n{}: {} runs, p50 {:.1f}us, p99 {:.1f}us".format(name, len(latencies), p50 * 1e6, p99 * 1e6))
+    return p50, p99
+
+
+def test_command_to_relay_latency(door, gpio):
+    latencies = []
+    for _ in range(500):
+        start = time.perf_counter()
+        door.do_action(OPEN)
+        latencies.append(gpio.writes[-1][0] - start)
+        assert gpio.writes[-1][1:] == (door.open_pin, True)
+        door.do_action(STOP)
+    p50, p99 = summary('test_command_to_relay_latency()', latencies)
+    assert p99 < 0.01
+
+
+def test_stop_preemption_latency(door, gpio):
+    latencies = []
+    for _ in range(500):
+        door.do_action(CLOSE)
+        start = time.perf_counter()
+        door.do_action(STOP)
+        off = [when for when, pin, value in gpio.writes if pin == door.close_pin and not value]
+        latencies.append(off[-1] - start)
+        assert not gpio.levels[door.close_pin]
+    p50, p99 = summary('test_stop_preemption_latency()', latencies)
+    assert p99 < 0.01
+
+
+def test_callback_throughput(door, gpio):
+    count = 20000
+    start = time.perf_counter()
+    for _ in range(count):
+        gpio.rising_edge(door.pir_pin)
+    elapsed = time.perf_counter() - start
+    print("\n\ntest_callback_throughput(): {:.0f} PIR callbacks/s, {:.1f}us each".format(
+        count / elapsed, elapsed / count * 1e6))
+    assert door.motion.edges == count
+    assert door.motion.events == 1
+    assert door.notifier.notified == 1
+
+
+def test_get_open_close_latency(door, gpio):
+    app = create_app(door=door, camera=object(), SECRET_KEY='test')
+    client = app.test_client()
+    latencies = []
+    for i in range(300):
+        body = json.dumps({'action': OPEN if i % 2 == 0 else STOP})
+        start = time.perf_counter()
+        response = client.post('/get_open_close', data=body, content_type='application/json')
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 202
+    p50, p99 = summary('test_get_open_close_latency()', latencies)
+    assert p99 < 0.05
@@ -5,7 +5,10 @@
 import datetime
 import os
 
-import RPi.GPIO as GPIO
+import pytest
+
+# Needs the Raspberry Pi.
+GPIO = pytest.importorskip('RPi.GPIO')
 
 GPIO.setmode(GPIO.BCM)
 # Class variables shared by all instances
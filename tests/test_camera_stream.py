@@ -0,0 +1,219 @@
+#
+# The /stream endpoint and the shared FrameBuffer, fed by a synthetic JPEG source.
+#
+import os
+import socket
+import struct
+import threading
+import time
+import tracemalloc
+
+import pytest
+from waitress.server import create_server
+
+from bark_door_app import create_app
+from camera_stream import CameraStream, FrameBuffer
+from config import load_config
+from conftest import wait_for
+from serve import serve_settings
+
+
+class SyntheticJpegSource:
+    # Frames shaped like JPEGs (SOI ... EOI markers) at a fixed frame rate.
+    def __init__(self, fps=30, size=40000):
+        self.interval = 1.0 / fps
+        self.size = size
+        self.opened = 0
+        self.closed = 0
+        self.frames = 0
+
+    def open(self):
+        self.opened += 1
+        self._next = time.monotonic()
+
+    def read(self):
+        self._next += self.interval
+        delay = self._next - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.frames += 1
+        return b'\xff\xd8' + os.urandom(self.size - 4) + b'\xff\xd9'
+
+    def close(self):
+        self.closed += 1
+
+
+def test_slow_reader_skips_to_newest():
+    buffer = FrameBuffer(size=4)
+    for i in range(10):
+        buffer.put(str(i).encode())
+    seq, frame = buffer.wait_newer(0, timeout=0)
+    assert (seq, frame) == (10, b'9')
+    assert buffer.wait_newer(10, timeout=0.01) == (10, None)
+
+
+def test_readers_share_frame_bytes():
+    buffer = FrameBuffer()
+    frame = b'\xff\xd8' + b'x' * 1000 + b'\xff\xd9'
+    buffer.put(frame)
+    assert buffer.wait_newer(0)[1] is frame
+    assert buffer.wait_newer(0)[1] is frame
+
+
+def test_clients_share_one_capture():
+    source = SyntheticJpegSource()
+    stream = CameraStream(source)
+    readers = [stream.frames() for _ in range(3)]
+    firsts = [next(reader) for reader in readers]
+    assert source.opened == 1
+    assert all(frame.startswith(b'\xff\xd8') for frame in firsts)
+    for reader in readers:
+        reader.close()
+    assert stream.clients == 0
+    assert wait_for(lambda: source.closed == 1)
+
+
+class BusyOnceSource(SyntheticJpegSource):
+    # The camera is busy with another process the first time it is opened.
+    def open(self):
+        if not self.opened:
+            self.opened += 1
+            raise OSError("Camera is in use")
+        super().open()
+
+
+def test_failed_open_lets_next_client_restart():
+    source = BusyOnceSource()
+    stream = CameraStream(source, frame_timeout=0.1)
+    # The first client gives up instead of waiting forever.
+    assert list(stream.frames()) == []
+    assert source.closed == 0
+    reader = stream.frames()
+    assert next(reader).startswith(b'\xff\xd8')
+    assert source.opened == 2
+    reader.close()
+    assert wait_for(lambda: source.closed == 1)
+
+
+def test_stream_route():
+    source = SyntheticJpegSource(size=1000)
+    app = create_app(door=object(), camera=source, LOGIN_DISABLED=True, SECRET_KEY='test')
+    response = app.test_client().get('/stream')
+    assert response.status_code == 200
+    assert response.mimetype == 'multipart/x-mixed-replace'
+    body = response.response
+    header = next(body)
+    assert header.startswith(b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: 1000\r\n\r\n')
+    assert len(next(body)) == 1000
+    body.close()
+    assert wait_for(lambda: source.closed == 1)
+
+
+class NumberedSource(SyntheticJpegSource):
+    # Each frame starts with its number, so a client can tell which frames it missed.
+    def read(self):
+        frame = super().read()
+        return frame[:2] + struct.pack('<I', self.frames) + frame[6:]
+
+
+def read_frames(port, count, delay):
+    # Read count frames of /stream, taking delay seconds over each.  Returns their numbers.
+    sock = socket.socket()
+    # A small window, so the kernel doesn't soak up the frames the server shouldn't be holding.
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16384)
+    sock.settimeout(10)
+    sock.connect(('127.0.0.1', port))
+    sock.sendall(b'GET /stream HTTP/1.0\r\n\r\n')
+    body = sock.makefile('rb')
+    numbers = []
+    try:
+        while body.readline() != b'\r\n':
+            pass
+        for _ in range(count):
+            length = None
+            for line in iter(body.readline, b'\r\n'):
+                if line.startswith(b'Content-Length:'):
+                    length = int(line.split(b':')[1])
+            frame = body.read(length)
+            body.readline()
+            numbers.append(struct.unpack('<I', frame[2:6])[0])
+            time.sleep(delay)
+    finally:
+        body.close()
+        sock.close()
+    return numbers
+
+
+def test_slow_client_skips_frames_over_waitress():
+    source = NumberedSource(fps=30, size=40000)
+    app = create_app(door=object(), camera=source, LOGIN_DISABLED=True, SECRET_KEY='test')
+    settings = serve_settings(load_config(server_host='127.0.0.1', server_port=0, server_threads=2,
+                                          server_outbuf_bytes=3 * source.size))
+    server = create_server(app, **settings)
+    # A small kernel buffer too (connections inherit it), as over a phone's Wi-Fi rather than loopback.
+    server.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 16384)
+    running = threading.Event()
+
+    def loop():
+        while not running.is_set():
+            server.asyncore.loop(timeout=0.05, map=server._map, count=1)
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    try:
+        numbers = read_frames(int(server.effective_port), 20, 0.1)
+        captured = source.frames
+    finally:
+        running.set()
+        thread.join()
+        server.task_dispatcher.shutdown()
+        server.close()
+    print("\n\ntest_slow_client_skips_frames_over_waitress(): 20 frames at 10fps of a 30fps camera, "
+          "last shown #{} of {} captured".format(numbers[-1], captured))
+    assert numbers == sorted(numbers)
+    # The client is shown frames from close to now, not every frame since it connected.
+    assert numbers[-1] > 30
+    assert captured - numbers[-1] < 30
+
+
+def test_stream_needs_login():
+    app = create_app(door=object(), camera=SyntheticJpegSource(), SECRET_KEY='test')
+    response = app.test_client().get('/stream')
+    assert response.status_code == 302
+    assert '/login' in response.headers['Location']
+
+
+# CPU and memory as the number of viewers grows.  Each viewer pulls frames for one second.
+@pytest.mark.parametrize('viewers', [1, 4, 16])
+def test_viewer_cost(viewers):
+    source = SyntheticJpegSource(fps=30, size=40000)
+    stream = CameraStream(source)
+    received = [0] * viewers
+    stop = threading.Event()
+
+    def viewer(n):
+        frames = stream.mjpeg()
+        for chunk in frames:
+            received[n] += 1
+            if stop.is_set():
+                break
+        frames.close()
+
+    tracemalloc.start()
+    cpu_start = time.process_time()
+    threads = [threading.Thread(target=viewer, args=(n,)) for n in range(viewers)]
+    for t in threads:
+        t.start()
+    time.sleep(1)
+    stop.set()
+    for t in threads:
+        t.join()
+    cpu = time.process_time() - cpu_start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    frames_each = min(received) // 3
+    print("\n\ntest_viewer_cost(): {} viewers, {} frames captured, >= {} frames each, "
+          "{:.0f}ms CPU, {:.0f}KB peak".format(viewers, source.frames, frames_each, cpu * 1000, peak / 1024))
+    assert frames_each > 10
+    # Memory is bounded by the ring, not by the number of viewers.
+    assert peak < 20 * source.size
@@ -0,0 +1,166 @@
+#
+# The command arbiter merges repeated commands, lets STOP jump the queue, and is the only thread
+# that carries out door commands.  The stress test fires thousands of mixed commands from many
+# threads at a SlidingDoor on the simulated GPIO backend and checks the relays and door state.
+#
+import random
+import threading
+import time
+
+import pytest
+
+from command_arbiter import CommandArbiter
+from conftest import QuietNotifier, wait_for
+from gpio_backend import SimulatedGPIO
+from sliding_door import SlidingDoor
+
+STOP = 'stop'
+THREADS = 32
+COMMANDS_PER_THREAD = 100
+
+
+class GatedApply:
+    # Holds the arbiter's thread inside the first command until released, so the test can line up
+    # the queue behind it.
+    def __init__(self):
+        self.applied = []
+        self.entered = threading.Event()
+        self.gate = threading.Event()
+
+    def __call__(self, command, source):
+        self.applied.append(command)
+        if len(self.applied) == 1:
+            self.entered.set()
+            self.gate.wait(5)
+        return 'after ' + command
+
+
+def submit_in_thread(arbiter, command, results):
+    thread = threading.Thread(target=lambda: results.append((command, arbiter.submit(command))))
+    thread.start()
+    return thread
+
+
+@pytest.fixture
+def gated():
+    apply = GatedApply()
+    arbiter = CommandArbiter(apply, STOP)
+    yield apply, arbiter
+    apply.gate.set()
+    arbiter.close(5)
+
+
+def test_repeats_are_merged(gated):
+    apply, arbiter = gated
+    results = []
+    threads = [submit_in_thread(arbiter, 'first', results)]
+    assert apply.entered.wait(5)
+    for command in ['open'] * 5 + ['close', 'close']:
+        threads.append(submit_in_thread(arbiter, command, results))
+        assert wait_for(lambda: arbiter.coalesced + arbiter.queue_depth() == len(threads) - 1, interval=0.001)
+    apply.gate.set()
+    for thread in threads:
+        thread.join(5)
+    assert apply.applied == ['first', 'open', 'close']
+    assert sorted(results) == sorted([('first', 'after first')] + [('open', 'after open')] * 5 +
+                                     [('close', 'after close')] * 2)
+    assert arbiter.coalesced == 5
+
+
+def test_stop_preempts_waiting_commands(gated):
+    apply, arbiter = gated
+    results = []
+    threads = [submit_in_thread(arbiter, 'first', results)]
+    assert apply.entered.wait(5)
+    for command in ('open', 'close'):
+        threads.append(submit_in_thread(arbiter, command, results))
+    assert wait_for(lambda: arbiter.queue_depth() == 2, interval=0.001)
+    threads.append(submit_in_thread(arbiter, STOP, results))
+    assert wait_for(lambda: arbiter.queue_depth() == 1, interval=0.001)
+    apply.gate.set()
+    for thread in threads:
+        thread.join(5)
+    assert apply.applied == ['first', STOP]
+    # Everyone the STOP overtook is told what the STOP did.
+    assert sorted(results) == sorted([('first', 'after first'), ('open', 'after stop'),
+                                      ('close', 'after stop'), (STOP, 'after stop')])
+    assert arbiter.preempted == 2
+
+
+def test_errors_reach_the_caller():
+    def apply(command, source):
+        raise ValueError(command)
+
+    arbiter = CommandArbiter(apply, STOP)
+    with pytest.raises(ValueError):
+        arbiter.submit('open')
+    arbiter.close(5)
+
+
+def test_nested_command_runs_inline():
+    arbiter = None
+
+    def apply(command, source):
+        if command == 'outer':
+            return arbiter.submit('inner')
+        return command
+
+    arbiter = CommandArbiter(apply, STOP)
+    assert arbiter.submit('outer', timeout=5) == 'inner'
+    arbiter.close(5)
+
+
+def relays_ever_both_on(gpio, door):
+    levels = {door.open_pin: False, door.close_pin: False}
+    for when, pin, value in list(gpio.writes):
+        levels[pin] = value
+        if levels[door.open_pin] and levels[door.close_pin]:
+            return True
+    return False
+
+
+def test_concurrent_commands_stress():
+    gpio = SimulatedGPIO()
+    door = SlidingDoor(notifier=QuietNotifier(), gpio=gpio)
+    # Short moves, so the engine's timer thread changes the state while commands come in.
+    door.seconds_to_open_door = 0.002
+    states = []
+    errors = []
+    lock = threading.Lock()
+    start = threading.Event()
+
+    def client(n):
+        rng = random.Random(n)
+        mine = []
+        start.wait()
+        try:
+            for i in range(COMMANDS_PER_THREAD):
+                mine.append(door.do_action(rng.choice(door.button_states)))
+        except Exception as e:
+            errors.append(e)
+        with lock:
+            states.extend(mine)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    began = time.perf_counter()
+    start.set()
+    for thread in threads:
+        thread.join(60)
+    elapsed = time.perf_counter() - began
+    arbiter = door._arbiter
+    total = THREADS * COMMANDS_PER_THREAD
+    print("\n{} commands from {} threads in {:.2f}s ({:.0f}/s): {} carried out, {} merged, {} preempted".format(
+        total, THREADS, elapsed, total / elapsed, arbiter.applied, arbiter.coalesced, arbiter.preempted))
+
+    assert not errors
+    assert len(states) == total
+    assert set(states) <= set(door.door_states)
+    # Every command was carried out, merged into another, or overtaken by a STOP.
+    assert arbiter.applied + arbiter.coalesced + arbiter.preempted == total
+    assert not relays_ever_both_on(gpio, door)
+
+    assert door.do_action(door.button_states.stop) == door.door_states.idle
+    assert not gpio.levels[door.open_pin] and not gpio.levels[door.close_pin]
+    assert not door._engine.moving
@@ -0,0 +1,142 @@
+#
+# The DistanceSampler with the fake range sensor, and closing the loop on the actuator with it.
+#
+import threading
+import time
+
+from actuator_engine import ActuatorEngine
+from config import load_config
+from conftest import QuietNotifier, wait_for
+from distance_sampler import DistanceSampler, FakeRangeSensor
+from gpio_backend import SimulatedGPIO
+from sliding_door import SlidingDoor
+
+OPEN_PIN = 20
+
+
+def test_samples_at_rate():
+    sensor = FakeRangeSensor(50)
+    sampler = DistanceSampler(sensor, rate_hz=100, size=8)
+    sampler.start()
+    time.sleep(0.3)
+    sampler.stop()
+    assert 20 <= sensor.reads <= 40
+    readings = sampler.readings()
+    assert len(readings) == 8
+    assert all(mm == 50 for t, mm in readings)
+    assert [t for t, mm in readings] == sorted(t for t, mm in readings)
+
+
+def test_position_is_smoothed():
+    sampler = DistanceSampler(FakeRangeSensor(), size=8, smoothing=3)
+    assert sampler.position() is None
+    for mm in (10, 20, 30, 90):
+        sampler._add(time.monotonic(), mm)
+    assert sampler.position() == (20 + 30 + 90) / 3
+    assert sampler.latest()[1] == 90
+
+
+def test_watch_fires_once():
+    sampler = DistanceSampler(FakeRangeSensor(), smoothing=1)
+    fired = []
+    sampler.watch(lambda mm: mm >= 100, lambda: fired.append(True))
+    for mm in (10, 50, 100, 120):
+        sampler._add(time.monotonic(), mm)
+    assert fired == [True]
+    sampler.watch(lambda mm: mm >= 100, lambda: fired.append(True))
+    sampler.unwatch()
+    sampler._add(time.monotonic(), 150)
+    assert fired == [True]
+
+
+# A door that moves 1000mm/s while the open relay is on, and starts closed at 20mm.
+class MovingDoor:
+    def __init__(self):
+        self.range_mm = 20.0
+        self.relay_on_at = None
+
+    def output(self, pin, value):
+        now = time.monotonic()
+        if self.relay_on_at is not None:
+            self.range_mm += (now - self.relay_on_at) * 1000
+        self.relay_on_at = now if value else None
+
+    def read(self):
+        if self.relay_on_at is None:
+            return self.range_mm
+        return self.range_mm + (time.monotonic() - self.relay_on_at) * 1000
+
+
+def test_relay_cut_when_door_is_open():
+    door = MovingDoor()
+    sampler = DistanceSampler(FakeRangeSensor(door.read), rate_hz=200, smoothing=1)
+    sampler.start()
+    engine = ActuatorEngine(door.output)
+    done = threading.Event()
+    start = time.monotonic()
+    move = engine.start(OPEN_PIN, 2, lambda move: done.set())
+    sampler.watch(lambda mm: mm >= 300, lambda: engine.finish(move))
+    assert done.wait(3)
+    elapsed = time.monotonic() - start
+    sampler.stop()
+    print("\n\ntest_relay_cut_when_door_is_open(): open after {:.0f}ms instead of the 2000ms ceiling, "
+          "stopped at {:.0f}mm".format(elapsed * 1000, door.range_mm))
+    assert elapsed < 0.5
+    assert 300 <= door.range_mm < 330
+
+
+def test_ceiling_when_sensor_never_gets_there():
+    sampler = DistanceSampler(FakeRangeSensor(20), rate_hz=200)
+    sampler.start()
+    engine = ActuatorEngine(lambda pin, value: None)
+    done = threading.Event()
+    move = engine.start(OPEN_PIN, 0.2, lambda move: done.set())
+    sampler.watch(lambda mm: mm >= 300, lambda: engine.finish(move))
+    assert done.wait(1)
+    sampler.stop()
+
+
+def door_with_sampler():
+    # The sampler isn't started: the tests feed it readings themselves.
+    sampler = DistanceSampler(FakeRangeSensor(20), smoothing=1)
+    door = SlidingDoor(load_config(door_closed_mm=20, door_open_mm=300), notifier=QuietNotifier(),
+                       sampler=sampler, gpio=SimulatedGPIO())
+    door.seconds_to_open_door = 0.05
+    return door, sampler
+
+
+def test_timed_out_move_unwatches():
+    door, sampler = door_with_sampler()
+    door.do_action(door.button_states.open)
+    assert sampler._watch is not None
+    assert wait_for(lambda: door.door_state == door.door_states.idle)
+    assert sampler._watch is None
+    assert door._source == 'timer'
+
+
+def test_late_sensor_callback_leaves_next_move_alone():
+    door, sampler = door_with_sampler()
+    door.seconds_to_open_door = 5
+    door.do_action(door.button_states.open)
+    first = door._engine._generation
+    door.do_action(door.button_states.stop)
+    door.do_action(door.button_states.close)
+    # The open move's callback, arriving after the close started.
+    door._target_reached(first)
+    assert door._source == 'dashboard'
+    assert door.door_state == door.door_states.closing
+    sampler._add(time.monotonic(), 20)
+    assert door.door_state == door.door_states.idle
+    assert door._source == 'sensor'
+
+
+def test_position_reads_the_buffer():
+    sensor = FakeRangeSensor(80)
+    sampler = DistanceSampler(sensor, rate_hz=50)
+    sampler.start()
+    assert wait_for(lambda: sampler.count > 0)
+    sampler.stop()
+    reads = sensor.reads
+    for _ in range(1000):
+        assert sampler.position() == 80
+    assert sensor.reads == reads
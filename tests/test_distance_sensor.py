@@ -3,9 +3,12 @@ Unit test the distance sensor.
 Distance is interesting for determining if the
 slide door is shut.  It is less interesting how much the door is open.
 """
-import adafruit_vl6180x
-import board
-import busio
+import pytest
+
+# Needs the Raspberry Pi with the sensor wired up.
+adafruit_vl6180x = pytest.importorskip('adafruit_vl6180x')
+board = pytest.importorskip('board')
+busio = pytest.importorskip('busio')
 
 
 def test_i2c():
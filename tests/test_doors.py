@@ -0,0 +1,181 @@
+#
+# Several doors on one Pi: the doors file, the /doors routes, and a benchmark showing a command to
+# one door takes as long with 16 doors busy around it as with the door on its own.
+#
+import threading
+import time
+
+import pytest
+
+from bark_door_app import create_app
+from config import ConfigError, load_config
+from conftest import QuietNotifier, percentile
+from door_registry import DoorRegistry, build_registry, load_door_configs
+from gpio_backend import SimulatedGPIO
+from sliding_door import SlidingDoor
+
+ENVIRON = {'open_pin': '20', 'close_pin': '21', 'pir_pin': '4', 'seconds_to_open_door': '10',
+           'mins_between_detecting_motion': '1', 'gpio_backend': 'simulated'}
+
+DOORS_FILE = """
+[back]
+open_pin = 20
+close_pin = 21
+pir_pin = 4
+
+[gate]
+open_pin = 5
+close_pin = 6
+pir_pin = 13
+seconds_to_open_door = 25
+"""
+
+
+def settings_for(tmpdir, text):
+    path = tmpdir.join('doors.ini')
+    path.write(text)
+    return load_config(ENVIRON, doors_file=str(path))
+
+
+def test_one_door_without_doors_file():
+    settings = load_config(ENVIRON)
+    assert list(load_door_configs(settings, ENVIRON)) == ['default']
+
+
+def test_doors_file(tmpdir):
+    configs = load_door_configs(settings_for(tmpdir, DOORS_FILE), ENVIRON)
+    assert list(configs) == ['back', 'gate']
+    assert (configs['gate'].open_pin, configs['gate'].pir_pin) == (5, 13)
+    assert configs['gate'].seconds_to_open_door == 25
+    # Left out of the section, so taken from the environment.
+    assert configs['back'].seconds_to_open_door == 10
+    assert configs['gate'].gpio_backend == 'simulated'
+
+
+def test_doors_file_problems(tmpdir):
+    text = DOORS_FILE + "\n[side door]\nopen_pin = 5\nclose_pin = x\nspeed = 3\n"
+    with pytest.raises(ConfigError) as error:
+        load_door_configs(settings_for(tmpdir, text), ENVIRON)
+    message = str(error.value)
+    assert '[side door] door ids may only use' in message
+    assert '[side door] unknown settings: speed' in message
+    assert "close_pin should be int, not 'x'" in message
+
+
+def test_doors_file_clashes(tmpdir):
+    text = DOORS_FILE.replace('open_pin = 5', 'open_pin = 21')
+    with pytest.raises(ConfigError) as error:
+        load_door_configs(settings_for(tmpdir, text), ENVIRON)
+    assert '[gate] open_pin 21 is already used by [back]' in str(error.value)
+
+
+def test_build_registry(tmpdir):
+    made = []
+
+    def factory(config, events=None, gpio=None, door_id=None):
+        made.append((door_id, gpio))
+        return SlidingDoor(config, notifier=QuietNotifier(), events=events, gpio=gpio, door_id=door_id)
+
+    registry = build_registry(settings_for(tmpdir, DOORS_FILE), factory=factory, environ=ENVIRON)
+    assert registry.ids() == ['back', 'gate']
+    assert registry.primary is registry.get('back')
+    # One GPIO backend drives every door's pins.
+    assert made[0][1] is made[1][1]
+    assert registry.get('gate').open_pin == 5
+
+
+class SlowGPIO(SimulatedGPIO):
+    # A relay board that takes a while to switch some pins (say, over a slow I2C expander).
+    def __init__(self, slow_pins, delay):
+        super().__init__()
+        self.slow_pins = set(slow_pins)
+        self.delay = delay
+
+    def output(self, pin, value):
+        if pin in self.slow_pins:
+            time.sleep(self.delay)
+        super().output(pin, value)
+
+
+def make_doors(count, gpio):
+    registry = DoorRegistry()
+    for n in range(count):
+        config = load_config(ENVIRON, open_pin=100 + 3 * n, close_pin=101 + 3 * n, pir_pin=102 + 3 * n)
+        door = SlidingDoor(config, notifier=QuietNotifier(), gpio=gpio, door_id='door{}'.format(n))
+        door.seconds_to_open_door = 0.05
+        registry.add(door.door_id, door)
+    return registry
+
+
+def client_for(registry):
+    return create_app(doors=registry, camera=object(), LOGIN_DISABLED=True, SECRET_KEY='test').test_client()
+
+
+def test_door_routes():
+    client = client_for(make_doors(2, SimulatedGPIO()))
+    assert [d['id'] for d in client.get('/doors').get_json()['doors']] == ['door0', 'door1']
+    response = client.post('/doors/door1/action', json={'action': 1})
+    assert response.status_code == 202
+    assert response.get_json()['door_state'] == 'OPENING'
+    assert client.get('/doors/door1/state').get_json()['door_state'] == 'OPENING'
+    assert client.get('/doors/door0/state').get_json()['door_state'] == 'UNKNOWN'
+    assert client.post('/doors/door1/action', json={'action': 2}).get_json()['door_state'] == 'IDLE'
+    assert client.post('/doors/nope/action', json={'action': 1}).status_code == 404
+    assert client.get('/doors/nope/state').status_code == 404
+    assert client.post('/doors/door0/action', json={}).status_code == 400
+    for action in (7, -1, True, '1', [1]):
+        assert client.post('/doors/door0/action', json={'action': action}).status_code == 400
+    assert client.get('/doors/door0/state').get_json()['door_state'] == 'UNKNOWN'
+
+
+def test_dashboard_follows_its_own_door():
+    client = client_for(make_doors(2, SimulatedGPIO()))
+    page = client.get('/dashboard').get_data(as_text=True)
+    # The buttons drive door0, so its badge ignores door1's events.
+    assert 'var DOOR = "door0";' in page
+
+
+def command_latencies(count, commands=200):
+    # Door 0 is timed through the app while every other door is kept busy on a slow relay board.
+    others = set()
+    for n in range(1, count):
+        others.update((100 + 3 * n, 101 + 3 * n))
+    gpio = SlowGPIO(others, delay=0.005)
+    registry = make_doors(count, gpio)
+    client = client_for(registry)
+    stop = threading.Event()
+
+    def keep_busy(door):
+        while not stop.is_set():
+            door.do_action(door.button_states.open)
+            door.do_action(door.button_states.stop)
+
+    busy = [threading.Thread(target=keep_busy, args=(registry.get('door{}'.format(n)),)) for n in range(1, count)]
+    for thread in busy:
+        thread.start()
+    latencies = []
+    try:
+        for i in range(commands):
+            start = time.perf_counter()
+            response = client.post('/doors/door0/action', json={'action': 1 if i % 2 == 0 else 2})
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 202
+    finally:
+        stop.set()
+        for thread in busy:
+            thread.join(5)
+    return latencies
+
+
+def test_latency_flat_as_doors_added_benchmark():
+    results = {}
+    print()
+    for count in (1, 4, 16):
+        latencies = command_latencies(count)
+        results[count] = (percentile(latencies, 0.5), percentile(latencies, 0.95))
+        print("{:2} doors: command to door0 p50 {:.2f}ms p95 {:.2f}ms".format(
+            count, results[count][0] * 1000, results[count][1] * 1000))
+    # The busy doors spend their time waiting on their own relays, not holding up door0.  Had they
+    # shared one command thread, door0 would wait out several 5ms relay switches per command.
+    assert results[16][0] < results[1][0] * 3 + 0.002
+    assert results[16][1] < 0.015
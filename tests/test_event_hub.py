@@ -0,0 +1,122 @@
+#
+# The EventHub and the /events Server-Sent Events route.
+#
+import json
+import threading
+import time
+
+from werkzeug.test import EnvironBuilder
+
+from bark_door_app import create_app
+from event_hub import EventHub
+
+
+def parse(chunk):
+    events = []
+    for block in chunk.decode().split('\n\n'):
+        if not block or block.startswith(':'):
+            continue
+        fields = dict(line.split(': ', 1) for line in block.split('\n'))
+        events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def test_subscribers_get_events_in_order():
+    hub = EventHub()
+    subscriptions = [hub.subscribe() for _ in range(3)]
+    hub.publish('state', door_state='OPENING')
+    hub.publish('state', door_state='IDLE')
+    for subscription in subscriptions:
+        assert parse(next(subscription)) == [('state', {'door_state': 'OPENING'}),
+                                            ('state', {'door_state': 'IDLE'})]
+    assert hub.subscribers == 3
+
+
+def test_disconnect_cleans_up():
+    hub = EventHub()
+    subscription = hub.subscribe()
+    hub.publish('motion')
+    next(subscription)
+    assert hub.subscribers == 1
+    subscription.close()
+    assert hub.subscribers == 0
+
+
+def test_heartbeat():
+    hub = EventHub(heartbeat=0.01)
+    assert next(hub.subscribe()) == b': keep-alive\n\n'
+
+
+def test_behind_subscriber_gets_newest():
+    hub = EventHub(size=4)
+    subscription = hub.subscribe(last_event_id=0)
+    for i in range(10):
+        hub.publish('ack', action=i)
+    assert [data['action'] for name, data in parse(next(subscription))] == [6, 7, 8, 9]
+
+
+def test_resume_from_last_event_id():
+    hub = EventHub()
+    for i in range(5):
+        hub.publish('ack', action=i)
+    assert [data['action'] for name, data in parse(next(hub.subscribe(last_event_id=3)))] == [3, 4]
+
+
+def test_events_route(still_door):
+    app = create_app(door=still_door, camera=object(), LOGIN_DISABLED=True, SECRET_KEY='test')
+    client = app.test_client()
+    response = client.get('/events')
+    assert response.mimetype == 'text/event-stream'
+    body = response.response
+    assert parse(next(body)) == [('state', {'door_state': 'UNKNOWN'})]
+    client.post('/get_open_close', data=json.dumps({'action': 1}), content_type='application/json')
+    assert parse(next(body)) == [('ack', {'door': 'default', 'action': 1, 'door_state': 'IDLE'})]
+    body.close()
+    assert app.events.subscribers == 0
+
+
+def test_events_closed_before_read(still_door):
+    app = create_app(door=still_door, camera=object(), LOGIN_DISABLED=True, SECRET_KEY='test')
+    # The client goes away before the server sends the first chunk.  (The test client would read
+    # the first chunk itself, so the WSGI app is called directly.)
+    body = app(EnvironBuilder('/events').get_environ(), lambda status, headers: None)
+    body.close()
+    assert app.events.subscribers == 0
+
+
+def test_publish_cost_with_many_subscribers():
+    # Big enough a ring that no subscriber misses an event.
+    hub = EventHub(size=256, heartbeat=0.1)
+    count = 200
+    received = []
+    stop = threading.Event()
+
+    def subscriber():
+        subscription = hub.subscribe()
+        mine = 0
+        for chunk in subscription:
+            mine += len(parse(chunk))
+            if mine >= count or stop.is_set():
+                break
+        subscription.close()
+        received.append(mine)
+
+    threads = [threading.Thread(target=subscriber) for _ in range(100)]
+    for t in threads:
+        t.start()
+    while hub.subscribers < 100:
+        time.sleep(0.01)
+    start = time.perf_counter()
+    for i in range(count):
+        hub.publish('state', door_state='IDLE')
+    publish_cost = (time.perf_counter() - start) / count
+    deadline = time.monotonic() + 10
+    for t in threads:
+        t.join(max(0, deadline - time.monotonic()))
+    stop.set()
+    for t in threads:
+        t.join()
+    print("\n\ntest_publish_cost_with_many_subscribers(): {:.1f}us per publish to 100 subscribers".format(
+        publish_cost * 1e6))
+    assert received == [count] * 100
+    assert hub.subscribers == 0
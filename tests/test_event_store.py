@@ -0,0 +1,133 @@
+#
+# The memory mapped event history and the /history route.
+#
+import os
+import time
+
+import pytest
+
+from bark_door_app import create_app
+from conftest import QuietNotifier
+from event_store import EventStore, RECORD, HEADER_SIZE
+from gpio_backend import SimulatedGPIO
+from sliding_door import SlidingDoor
+
+
+@pytest.fixture()
+def path(tmpdir):
+    return str(tmpdir.join('history.bin'))
+
+
+def test_file_is_presized(path):
+    store = EventStore(path, capacity=100)
+    assert os.path.getsize(path) == HEADER_SIZE + 100 * RECORD.size
+    for i in range(1000):
+        store.append('motion', timestamp=float(i))
+    store.close()
+    assert os.path.getsize(path) == HEADER_SIZE + 100 * RECORD.size
+
+
+def test_survives_restart(path):
+    store = EventStore(path, capacity=100)
+    store.append('command', 'IDLE', 'dashboard', 1, timestamp=10.0)
+    store.append('state', 'OPENING', 'dashboard', timestamp=10.5)
+    store.close()
+    store = EventStore(path, capacity=5000)
+    assert store.capacity == 100
+    assert store.query() == [
+        {'timestamp': 10.0, 'type': 'command', 'door_state': 'IDLE', 'source': 'dashboard', 'detail': 1},
+        {'timestamp': 10.5, 'type': 'state', 'door_state': 'OPENING', 'source': 'dashboard', 'detail': 0}]
+    store.close()
+
+
+def test_not_a_history_file(path):
+    with open(path, 'wb') as f:
+        f.write(b'x' * 200)
+    with pytest.raises(ValueError):
+        EventStore(path)
+
+
+def test_ring_keeps_newest(path):
+    store = EventStore(path, capacity=10)
+    for i in range(25):
+        store.append('motion', timestamp=float(i))
+    assert [e['timestamp'] for e in store.query()] == [float(i) for i in range(15, 25)]
+    assert [e['timestamp'] for e in store.query(start=17, end=20)] == [17.0, 18.0, 19.0]
+    # The newest few, from either side of where the ring wraps.
+    assert [e['timestamp'] for e in store.query(limit=7)] == [float(i) for i in range(18, 25)]
+    assert [e['timestamp'] for e in store.query(end=23, limit=0)] == []
+    store.close()
+
+
+def test_filters(path):
+    store = EventStore(path)
+    for i in range(30):
+        store.append(['command', 'state', 'motion'][i % 3], timestamp=float(i))
+    motion = store.query(types=['motion'])
+    assert [e['timestamp'] for e in motion] == [float(i) for i in range(2, 30, 3)]
+    assert [e['timestamp'] for e in store.query(start=10, types=['motion'], limit=2)] == [26.0, 29.0]
+    assert [e['timestamp'] for e in store.query(end=20, types=['command', 'state'], limit=3)] == [
+        16.0, 18.0, 19.0]
+    assert [e['timestamp'] for e in store.query(start=25, types=['motion'], limit=5)] == [26.0, 29.0]
+    store.close()
+
+
+def test_clock_stepping_back_keeps_order(path):
+    store = EventStore(path)
+    store.append('motion', timestamp=100.0)
+    store.append('motion', timestamp=50.0)
+    assert [e['timestamp'] for e in store.query()] == [100.0, 100.0]
+    store.close()
+
+
+def test_append_and_range_query_cost(path):
+    count = 65536
+    store = EventStore(path, capacity=count)
+    start = time.perf_counter()
+    for i in range(count):
+        store.append('motion', 'IDLE', 'pir', timestamp=1e9 + i)
+    append_cost = (time.perf_counter() - start) / count
+    start = time.perf_counter()
+    for i in range(1000):
+        events = store.query(start=1e9 + 30000, end=1e9 + 30010)
+    query_cost = (time.perf_counter() - start) / 1000
+    store.append('command', 'IDLE', 'dashboard', 1, timestamp=2e9)
+    start = time.perf_counter()
+    for i in range(100):
+        newest = store.query(types=['command'], limit=1)
+    newest_cost = (time.perf_counter() - start) / 100
+    store.close()
+    print("\n\ntest_append_and_range_query_cost(): {:.1f}us per append, {:.1f}us per 10 record query, "
+          "{:.1f}us for the newest command out of {}".format(
+              append_cost * 1e6, query_cost * 1e6, newest_cost * 1e6, count))
+    assert len(events) == 10
+    assert query_cost < 0.001
+    assert [e['timestamp'] for e in newest] == [2e9]
+    assert newest_cost < 0.001
+
+
+def test_history_route(path):
+    store = EventStore(path)
+    door = SlidingDoor(notifier=QuietNotifier(), gpio=SimulatedGPIO(),
+                       history=store)
+    door.seconds_to_open_door = 5
+    app = create_app(door=door, camera=object(), LOGIN_DISABLED=True, SECRET_KEY='test')
+    client = app.test_client()
+    client.post('/get_open_close', json={'action': 1})
+    door.gpio.rising_edge(door.pir_pin)
+    client.post('/get_open_close', json={'action': 2})
+    events = client.get('/history').get_json()['events']
+    assert [(e['type'], e['door_state'], e['source']) for e in events] == [
+        ('state', 'UNKNOWN', 'unknown'),
+        ('command', 'UNKNOWN', 'dashboard'),
+        ('state', 'OPENING', 'dashboard'),
+        ('command', 'OPENING', 'dashboard'),
+        ('state', 'IDLE', 'dashboard')]
+    commands = client.get('/history?type=command').get_json()['events']
+    assert [e['detail'] for e in commands] == [1, 2]
+    assert client.get('/history?type=bogus').status_code == 400
+    assert [e['detail'] for e in client.get('/history?type=command&limit=1').get_json()['events']] == [2]
+    assert client.get('/history?limit=-3').status_code == 400
+    with pytest.raises(ValueError):
+        store.query(limit=-3)
+    store.close()
@@ -0,0 +1,136 @@
+#
+# Checks the queue based HandleLogging and compares its cost per call with the
+# inspect.getframeinfo() version it replaced.
+#
+import inspect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+import handle_logging_lib
+from handle_logging_lib import HandleLogging
+
+
+# The HandleLogging class as it was before the queue based version.
+class LegacyHandleLogging:
+
+    def __init__(self, logfile):
+        self.logger = logging.getLogger('bark_legacy')
+        self.logger.handlers = []
+        handler = logging.FileHandler(logfile)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s  %(message)s',
+                                               datefmt='%b %-d,%Y %H:%M:%S'))
+        self.logger.addHandler(handler)
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate = False
+
+    def _make_message(self, message):
+        (filepathname, line_number,
+         name, lines, index) = inspect.getframeinfo(sys._getframe(2))
+        code_info_str = ": {} - {} - {} : ".format(os.path.basename(filepathname), line_number, name)
+        return (code_info_str + message)
+
+    def print(self, message):
+        self.logger.info(self._make_message(message))
+
+    def close(self):
+        for handler in self.logger.handlers:
+            handler.close()
+
+
+@pytest.fixture()
+def logfile(tmpdir):
+    path = str(tmpdir.join('bark.log'))
+    handle_logging_lib.configure(logfile=path)
+    yield path
+    handle_logging_lib.configure()
+
+
+def read_lines(path):
+    handle_logging_lib.flush()
+    with open(path) as f:
+        return f.read().splitlines()
+
+
+def test_caller_info(logfile):
+    log = HandleLogging()
+    log.print("Door state: %s", 'IDLE')
+    line = read_lines(logfile)[0]
+    assert ': test_handle_logging.py - ' in line
+    assert ' - test_caller_info : Door state: IDLE' in line
+
+
+def test_formatting_is_lazy(logfile):
+    # The message is not formatted at all if INFO is off, and only by the listener once queued.
+    formatted = []
+
+    class Recorded:
+        def __str__(self):
+            formatted.append(threading.current_thread())
+            return 'recorded'
+
+    log = HandleLogging()
+    logger = logging.getLogger(handle_logging_lib.LOGGER_NAME)
+    logger.setLevel(logging.WARNING)
+    log.print("%s", Recorded())
+    assert formatted == []
+    logger.setLevel(logging.DEBUG)
+
+    record = logger.makeRecord(logger.name, logging.INFO, 'x.py', 1, "%s", (Recorded(),), None)
+    queued = handle_logging_lib._LazyQueueHandler(None).prepare(record)
+    assert queued.args == record.args
+    assert formatted == []
+
+    log.print("%s", Recorded())
+    assert read_lines(logfile)[0].endswith('recorded')
+
+
+def test_json_lines(tmpdir):
+    path = str(tmpdir.join('bark.jsonl'))
+    handle_logging_lib.configure(logfile=path, json_lines=True)
+    HandleLogging().print("button action %d", 2)
+    entry = json.loads(read_lines(path)[0])
+    handle_logging_lib.configure()
+    assert entry['message'] == 'button action 2'
+    assert entry['function'] == 'test_json_lines'
+    assert entry['level'] == 'INFO'
+
+
+def test_size_rotation(tmpdir):
+    path = str(tmpdir.join('bark.log'))
+    handle_logging_lib.configure(logfile=path, max_bytes=2000, backup_count=2)
+    log = HandleLogging()
+    for i in range(200):
+        log.print("line %d", i)
+    handle_logging_lib.flush()
+    handle_logging_lib.configure()
+    assert os.path.exists(path + '.1')
+    assert os.path.exists(path + '.2')
+    assert not os.path.exists(path + '.3')
+    assert os.path.getsize(path) <= 2000
+
+
+def test_cost_per_call(tmpdir, logfile):
+    count = 2000
+    legacy = LegacyHandleLogging(str(tmpdir.join('legacy.log')))
+    start = time.perf_counter()
+    for i in range(count):
+        legacy.print("Door state: {}".format(i))
+    legacy_cost = (time.perf_counter() - start) / count
+    legacy.close()
+
+    log = HandleLogging()
+    start = time.perf_counter()
+    for i in range(count):
+        log.print("Door state: %s", i)
+    cost = (time.perf_counter() - start) / count
+    assert len(read_lines(logfile)) == count
+
+    print("\n\ntest_cost_per_call(): inspect + file handler {:.1f}us, queue handler {:.1f}us per call".format(
+        legacy_cost * 1e6, cost * 1e6))
+    assert cost < legacy_cost
@@ -0,0 +1,215 @@
+#
+# Logging in: the per-client throttle, the password worker pool, the sessions that got the password
+# right, and a load test of /get_open_close while something floods /login with wrong passwords.
+#
+import http.client
+import threading
+import time
+from urllib.parse import urlencode
+
+import pytest
+from flask_bcrypt import generate_password_hash
+from waitress.server import create_server
+
+from bark_door_app import create_app
+from config import load_config
+from conftest import StillDoor, percentile
+from login_guard import LoginBusy, LoginThrottle, PasswordChecker, SessionCache
+
+PASSWORD = 'woof woof'
+FLOODERS = 4
+ATTEMPTS = 20
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_throttle():
+    clock = Clock()
+    throttle = LoginThrottle(per_minute=6, burst=3, max_clients=2, clock=clock)
+    assert [throttle.allow('a') for _ in range(3)] == [0, 0, 0]
+    assert throttle.allow('a') == pytest.approx(10)
+    # Other clients have buckets of their own.
+    assert throttle.allow('b') == 0
+    clock.now += 10
+    assert throttle.allow('a') == 0
+    assert throttle.allow('a') == pytest.approx(10)
+    # Only the most recent max_clients are remembered.
+    throttle.allow('c')
+    assert 'b' not in throttle._buckets
+
+
+def test_sessions():
+    clock = Clock()
+    sessions = SessionCache(max_sessions=2, max_age=60, clock=clock)
+
+    class User:
+        id = 1
+
+    users = [User() for _ in range(3)]
+    tokens = [sessions.add(user) for user in users]
+    assert len(set(tokens)) == 3 and users[0].id == tokens[0]
+    # The oldest session made room for the newest.
+    assert sessions.get(tokens[0]) is None
+    assert sessions.get(tokens[2]) is users[2]
+    clock.now += 61
+    assert sessions.get(tokens[2]) is None
+    assert len(sessions) == 1
+
+
+def test_checker_turns_away_when_full():
+    checker = PasswordChecker(generate_password_hash(PASSWORD, 12), workers=1, queue_limit=0)
+    assert not checker.check('wrong')
+    started = threading.Event()
+
+    def slow_check():
+        started.set()
+        checker.check(PASSWORD)
+
+    thread = threading.Thread(target=slow_check)
+    thread.start()
+    started.wait()
+    time.sleep(0.05)
+    with pytest.raises(LoginBusy):
+        checker.check(PASSWORD)
+    thread.join()
+    assert checker.check(PASSWORD)
+
+
+def make_app(rounds=4, **settings):
+    settings = load_config(door_closed_mm=None, door_open_mm=None, **settings)
+    checker = PasswordChecker(generate_password_hash(PASSWORD, rounds), settings.login_workers,
+                              settings.login_queue)
+    return create_app(door=StillDoor(), camera=object(), passwords=checker, settings=settings,
+                      SECRET_KEY='test', WTF_CSRF_ENABLED=False)
+
+
+def test_login_flow():
+    client = make_app().test_client()
+    assert client.get('/doors').status_code == 302
+    response = client.post('/login', data={'password': 'not it'})
+    assert response.status_code == 200
+    assert b'incorrect' in response.data
+    response = client.post('/login', data={'password': PASSWORD})
+    assert response.status_code == 302
+    assert client.get('/doors').status_code == 200
+
+
+def test_session_settings():
+    app = make_app(login_max_sessions=1, login_session_days=0.5)
+    assert (app.sessions.max_sessions, app.sessions.max_age) == (1, 12 * 3600)
+    first, second = app.test_client(), app.test_client()
+    for client in (first, second):
+        assert client.post('/login', data={'password': PASSWORD}).status_code == 302
+    # Only the newest session is kept.
+    assert first.get('/doors').status_code == 302
+    assert second.get('/doors').status_code == 200
+
+
+def test_session_from_before_restart_logs_in_again():
+    client = make_app().test_client()
+    with client.session_transaction() as session:
+        # What the cookie held when every session's user id was 1.
+        session['_user_id'] = '1'
+        session['_fresh'] = True
+    assert client.get('/doors').status_code == 302
+
+
+def test_throttled_before_hashing():
+    app = make_app(login_burst=2, login_attempts_per_minute=1.0)
+    client = app.test_client()
+    for _ in range(2):
+        assert client.post('/login', data={'password': 'not it'}).status_code == 200
+    response = client.post('/login', data={'password': PASSWORD})
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) == 60
+    assert b'Too many tries' in response.data
+    # Looking at the form is never throttled.
+    assert client.get('/login').status_code == 200
+
+
+def door_latencies(port, count):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    latencies = []
+    try:
+        for i in range(count):
+            start = time.perf_counter()
+            conn.request('POST', '/get_open_close', '{"action": 2}', {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            response.read()
+            assert response.status == 202
+            latencies.append(time.perf_counter() - start)
+            time.sleep(0.005)
+    finally:
+        conn.close()
+    return latencies
+
+
+def flood(port, statuses, lock):
+    body = urlencode({'password': 'guess'})
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        for i in range(ATTEMPTS):
+            conn.request('POST', '/login', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+            response = conn.getresponse()
+            response.read()
+            with lock:
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+    finally:
+        conn.close()
+
+
+def run_flood(app):
+    # /get_open_close latencies while FLOODERS clients each send ATTEMPTS wrong passwords.
+    server = create_server(app, host='127.0.0.1', port=0, threads=8)
+    port = server.effective_port
+    running = threading.Event()
+
+    def loop():
+        while not running.is_set():
+            server.asyncore.loop(timeout=0.05, map=server._map, count=1)
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    statuses = {}
+    lock = threading.Lock()
+    try:
+        flooders = [threading.Thread(target=flood, args=(port, statuses, lock)) for _ in range(FLOODERS)]
+        for flooder in flooders:
+            flooder.start()
+        busy = door_latencies(port, 40)
+        for flooder in flooders:
+            flooder.join(30)
+    finally:
+        running.set()
+        thread.join()
+        server.task_dispatcher.shutdown()
+        server.close()
+    return busy, statuses
+
+
+@pytest.mark.parametrize('throttled', [False, True], ids=['pool only', 'pool and throttle'])
+def test_door_during_login_flood_benchmark(throttled):
+    settings = {'login_queue': 0}
+    if not throttled:
+        settings.update(login_burst=10 ** 6, login_attempts_per_minute=10.0 ** 6)
+    busy, statuses = run_flood(make_app(rounds=8, **settings))
+    print("\n/get_open_close during a login flood from {} clients, {}: p50 {:.1f}ms p99 {:.1f}ms; "
+          "/login answered {}".format(
+              FLOODERS, 'throttled' if throttled else 'pool only', percentile(busy, 0.5) * 1000,
+              percentile(busy, 0.99) * 1000,
+              ', '.join('{} x{}'.format(status, n) for status, n in sorted(statuses.items()))))
+    assert sum(statuses.values()) == FLOODERS * ATTEMPTS
+    if throttled:
+        # All the clients are 127.0.0.1: past the burst, every attempt is turned away unhashed.
+        assert statuses.get(429, 0) >= FLOODERS * ATTEMPTS - 10
+    else:
+        # One worker and no queue: the clients checking at the same time as another are turned away.
+        assert statuses.get(503, 0) > 0
+    # The door isn't held up behind bcrypt.
+    assert percentile(busy, 0.99) < 0.5
@@ -0,0 +1,96 @@
+#
+# The metrics registry, its text format, what the app records, and what recording costs.
+#
+import time
+
+import metrics
+from bark_door_app import create_app
+from conftest import QuietNotifier
+from gpio_backend import SimulatedGPIO
+from metrics import Registry
+from sliding_door import SlidingDoor
+
+
+def test_counter_and_gauge_text():
+    registry = Registry()
+    requests = registry.counter('requests_total', 'Requests.', ['route'])
+    requests.labels(route='/').inc()
+    requests.labels(route='/').inc(2)
+    depth = registry.gauge('depth', 'Depth.')
+    depth.set(4)
+    assert registry.render() == ('# HELP depth Depth.\n'
+                                 '# TYPE depth gauge\n'
+                                 'depth 4\n'
+                                 '# HELP requests_total Requests.\n'
+                                 '# TYPE requests_total counter\n'
+                                 'requests_total{route="/"} 3\n')
+
+
+def test_gauge_function():
+    registry = Registry()
+    registry.gauge('queue', 'Queue.', function=lambda: 7)
+    assert 'queue 7\n' in registry.render()
+
+
+def test_histogram_text():
+    registry = Registry()
+    latency = registry.histogram('latency_seconds', 'Latency.', buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value)
+    text = registry.render()
+    assert 'latency_seconds_bucket{le="0.1"} 2\n' in text
+    assert 'latency_seconds_bucket{le="1"} 3\n' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 4\n' in text
+    assert 'latency_seconds_count 4\n' in text
+    assert 'latency_seconds_sum 3.65\n' in text
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.counter('c', 'C.', ['path']).labels(path='a"b\\c').inc()
+    assert 'c{path="a\\"b\\\\c"} 1\n' in registry.render()
+
+
+def test_same_name_is_same_metric():
+    registry = Registry()
+    assert registry.counter('c', 'C.') is registry.counter('c', 'C.')
+
+
+def test_metrics_route():
+    door = SlidingDoor(notifier=QuietNotifier(), gpio=SimulatedGPIO())
+    door.seconds_to_open_door = 5
+    app = create_app(door=door, camera=object(), SECRET_KEY='test')
+    client = app.test_client()
+    client.post('/get_open_close', json={'action': 1})
+    client.post('/get_open_close', json={'action': 1})
+    client.post('/get_open_close', json={'action': 2})
+    door.gpio.rising_edge(door.pir_pin)
+    response = client.get('/metrics')
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert 'bark_http_request_seconds_count{endpoint="get_open_close"}' in text
+    assert 'bark_http_requests_total{endpoint="get_open_close",status="202"}' in text
+    assert 'bark_door_commands_total{action="OPEN"}' in text
+    assert 'bark_door_transitions_total{state="OPENING"}' in text
+    assert 'bark_relay_on_seconds_count' in text
+    assert 'bark_motion_callback_seconds_count' in text
+    assert metrics.REGISTRY.get('bark_door_commands_ignored_total').value >= 1
+
+
+def test_cost_per_event():
+    registry = Registry()
+    count = registry.counter('c', 'C.')
+    labelled = registry.counter('l', 'L.', ['state'])
+    histogram = registry.histogram('h', 'H.')
+    n = 100000
+    costs = {}
+    for name, record in (('counter', count.inc),
+                         ('labelled counter', lambda: labelled.labels(state='IDLE').inc()),
+                         ('histogram', lambda: histogram.observe(0.003))):
+        start = time.perf_counter()
+        for _ in range(n):
+            record()
+        costs[name] = (time.perf_counter() - start) / n
+    print("\n\ntest_cost_per_event(): " + ', '.join('{} {:.2f}us'.format(name, cost * 1e6)
+                                                   for name, cost in sorted(costs.items())))
+    assert max(costs.values()) < 5e-6
@@ -3,7 +3,12 @@
 # on this particular pir sensor within the project's wiki.
 #
 #
-from motion_detector import MotionDetector
+import pytest
+
+# Needs the Raspberry Pi.
+pytest.importorskip('RPi.GPIO')
+
+from sliding_door import SlidingDoor
 #
 # Note: According to https://bit.ly/1U3QVTZ , the pir sensor needs to be "plugged into" the rasp pi
 # for at least a minute prior to using.
@@ -12,7 +17,7 @@ from motion_detector import MotionDetector
 
 # GIVEN a HC-SR501 PIR sensor hooked up to the rasp pi and positioned so we can detect movement.
 def test_motion():
-    m = MotionDetector()
+    m = SlidingDoor()
     while not m.motion_detected:
         pass
     assert True
@@ -0,0 +1,87 @@
+#
+# The PIR motion pipeline, run over recorded edge traces instead of waiting on the sensor.
+#
+import random
+import time
+
+from motion_pipeline import MotionPipeline
+
+
+def pipeline(**kwargs):
+    return MotionPipeline(lambda timestamp: None, **kwargs)
+
+
+def test_double_callback_is_one_event():
+    p = pipeline()
+    assert p.replay([(100.0, 'edge'), (100.02, 'edge')]) == [100.0]
+    assert p.bounces == 1
+
+
+def test_rearm_after_quiet():
+    p = pipeline(rearm_seconds=60)
+    trace = [(0, 'edge'), (20, 'edge'), (50, 'edge'),   # one visit, the PIR keeps firing
+             (200, 'edge'),                             # back after a quiet spell
+             (230, 'edge')]
+    assert p.replay(trace) == [0, 200]
+
+
+def test_edges_masked_while_door_moves():
+    p = pipeline(settle_seconds=3)
+    trace = [(0, 'moving'), (1, 'edge'), (5, 'edge'), (10, 'stopped'),
+             (11, 'edge'),        # door still settling
+             (14, 'edge')]        # a dog
+    assert p.replay(trace) == [14]
+    assert p.masked == 3
+
+
+def test_masked_edges_dont_hold_off_a_dog():
+    # With the old bouncetime in minutes, the door's own motion started the lockout.
+    p = pipeline(rearm_seconds=60, settle_seconds=3)
+    trace = [(0, 'moving'), (2, 'edge'), (8, 'stopped'), (12, 'edge')]
+    assert p.replay(trace) == [12]
+
+
+def test_events_go_downstream():
+    seen = []
+    p = MotionPipeline(seen.append)
+    assert p.edge(5.0)
+    assert not p.edge(5.1)
+    assert seen == [5.0]
+    assert p.recent_edges() == [5.0, 5.1]
+
+
+def test_history_is_bounded():
+    p = pipeline(history=4)
+    for t in range(10):
+        p.edge(float(t))
+    assert p.recent_edges() == [6.0, 7.0, 8.0, 9.0]
+    assert p.edges == 10
+
+
+# A day of PIR edges: a visit every few minutes, each a burst of edges with double callbacks,
+# plus door moves.  Replayed much faster than real time.
+def test_replay_a_day():
+    rng = random.Random(1)
+    trace = []
+    t = 0.0
+    visits = 0
+    while t < 24 * 3600:
+        t += rng.uniform(300, 900)
+        visits += 1
+        for _ in range(rng.randint(1, 6)):
+            t += rng.uniform(5, 20)
+            trace.append((t, 'edge'))
+            trace.append((t + 0.01, 'edge'))
+        if rng.random() < 0.3:
+            trace.append((t + 30, 'moving'))
+            trace.append((t + 32, 'edge'))
+            trace.append((t + 45, 'stopped'))
+            t += 45
+    p = pipeline(rearm_seconds=60)
+    start = time.perf_counter()
+    events = p.replay(trace)
+    elapsed = time.perf_counter() - start
+    print("\n\ntest_replay_a_day(): {} edges, {} visits, {} events in {:.1f}ms".format(
+        p.edges, visits, len(events), elapsed * 1000))
+    assert len(events) == visits
+    assert elapsed < 1
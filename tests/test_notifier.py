@@ -0,0 +1,152 @@
+#
+# The Notifier is tested against a local HTTP server standing in for the IFTTT webhook.
+#
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from conftest import wait_for
+from notifier import NOTIFICATION_QUEUE, Notifier
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so the client can keep the connection open between alerts.
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.hits += 1
+        server.connections.add(self.client_address)
+        time.sleep(server.delay)
+        self.send_response(server.status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture()
+def webhook():
+    server = HTTPServer(('127.0.0.1', 0), WebhookHandler)
+    server.hits = 0
+    server.connections = set()
+    server.delay = 0
+    server.status = 200
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = 'http://127.0.0.1:{}/trigger/Barking'.format(server.server_port)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_alerts_reuse_one_connection(webhook):
+    notifier = Notifier(webhook.url, coalesce_seconds=0)
+    for _ in range(5):
+        assert notifier.notify()
+        assert wait_for(lambda: notifier.queue_depth() == 0)
+    assert wait_for(lambda: notifier.stats()['sent'] == 5)
+    assert webhook.hits == 5
+    assert len(webhook.connections) == 1
+    stats = notifier.stats()
+    print("\n\ntest_alerts_reuse_one_connection(): mean delivery latency {:.2f}ms".format(
+        stats['mean_latency'] * 1000))
+    notifier.close()
+
+
+def test_notify_does_not_wait_on_slow_endpoint(webhook):
+    webhook.delay = 0.5
+    notifier = Notifier(webhook.url, coalesce_seconds=0)
+    start = time.monotonic()
+    notifier.notify()
+    assert time.monotonic() - start < 0.01
+    assert wait_for(lambda: notifier.stats()['sent'] == 1)
+    assert notifier.stats()['last_latency'] >= 0.5
+    notifier.close()
+
+
+def test_timeout_and_retries(webhook):
+    webhook.delay = 0.3
+    notifier = Notifier(webhook.url, timeout=0.05, retries=2, backoff=0.01, coalesce_seconds=0)
+    notifier.notify()
+    assert wait_for(lambda: notifier.stats()['failed'] == 1)
+    assert notifier.stats()['sent'] == 0
+    notifier.close()
+
+
+def test_retry_recovers():
+    calls = []
+
+    def flaky(url, timeout):
+        calls.append(url)
+        if len(calls) < 3:
+            raise IOError('unreachable')
+
+    notifier = Notifier('http://bark', transport=flaky, retries=3, backoff=0.01)
+    notifier.notify()
+    assert wait_for(lambda: notifier.stats()['sent'] == 1)
+    assert len(calls) == 3
+    notifier.close()
+
+
+def test_burst_is_coalesced():
+    calls = []
+    notifier = Notifier('http://bark', transport=lambda url, timeout: calls.append(url), coalesce_seconds=30)
+    for _ in range(10):
+        notifier.notify()
+    assert wait_for(lambda: notifier.stats()['coalesced'] == 9)
+    assert len(calls) == 1
+    notifier.close()
+
+
+def test_failed_alert_does_not_coalesce():
+    calls = []
+
+    def down_once(url, timeout):
+        calls.append(url)
+        if len(calls) == 1:
+            raise IOError('unreachable')
+
+    notifier = Notifier('http://bark', transport=down_once, retries=0, coalesce_seconds=30)
+    notifier.notify()
+    assert wait_for(lambda: notifier.stats()['failed'] == 1)
+    # The next motion is sent, and it is what later motion is merged into.
+    notifier.notify()
+    notifier.notify()
+    assert wait_for(lambda: notifier.stats()['coalesced'] == 1)
+    assert notifier.stats()['sent'] == 1
+    assert len(calls) == 2
+    notifier.close()
+
+
+def test_full_queue_drops():
+    release = threading.Event()
+    notifier = Notifier('http://bark', transport=lambda url, timeout: release.wait(), max_queue=2,
+                        coalesce_seconds=0)
+    notifier.notify()
+    assert wait_for(lambda: notifier.queue_depth() == 0)
+    assert notifier.notify()
+    assert notifier.notify()
+    assert not notifier.notify()
+    assert notifier.stats()['dropped'] == 1
+    release.set()
+    notifier.close()
+
+
+def test_queue_gauge_counts_every_door():
+    release = threading.Event()
+    before = NOTIFICATION_QUEUE._function()
+    notifiers = [Notifier('http://bark', transport=lambda url, timeout: release.wait(), coalesce_seconds=0)
+                 for _ in range(2)]
+    for notifier in notifiers:
+        notifier.notify()
+        assert wait_for(lambda: notifier.queue_depth() == 0)
+        notifier.notify()
+        notifier.notify()
+    assert NOTIFICATION_QUEUE._function() - before == 4
+    release.set()
+    for notifier in notifiers:
+        notifier.close()
@@ -0,0 +1,165 @@
+#
+# The rules engine: parsing and compiling rules, acting on motion, close_after, and a benchmark of
+# the time from a PIR edge to the open relay switching on, on the simulated GPIO backend.
+#
+import time
+
+import pytest
+
+from config import ConfigError, load_config
+from conftest import QuietNotifier, percentile
+from gpio_backend import SimulatedGPIO
+from rules_engine import RulesEngine, compile_rules, load_rules, parse_rule
+from sliding_door import SlidingDoor
+
+RULES = """
+[let the dog in]
+when = motion
+between = 07:00-21:00
+door_state = idle, unknown
+action = open
+close_after = 45
+
+[night]
+between = 21:00-07:00
+door_state = idle
+action = close
+"""
+
+
+def at(hour, minute):
+    # A timestamp at hour:minute local time today.
+    now = time.localtime()
+    return time.mktime((now.tm_year, now.tm_mon, now.tm_mday, hour, minute, 0, 0, 0, -1))
+
+
+def write_rules(tmpdir, text):
+    path = tmpdir.join('rules.ini')
+    path.write(text)
+    return str(path)
+
+
+def test_load_rules(tmpdir):
+    rules = load_rules(write_rules(tmpdir, RULES))
+    assert [rule.name for rule in rules] == ['let the dog in', 'night']
+    first = rules[0]
+    assert (first.event, first.start, first.end, first.action, first.close_after) == ('motion', 420, 1260, 'open', 45)
+    assert first.door_states == frozenset(['IDLE', 'UNKNOWN'])
+
+
+def test_rule_problems(tmpdir):
+    text = "[bad]\nwhen = bark\nbetween = 7-9\ndoor_state = ajar\naction = wiggle\nclose_after = -1\ncolour = red\n"
+    with pytest.raises(ConfigError) as error:
+        load_rules(write_rules(tmpdir, text))
+    message = str(error.value)
+    for expected in ('unknown options: colour', "when should be", 'between should be', 'door_state should be',
+                     'action should be', 'close_after should be'):
+        assert expected in message
+
+
+def test_match_by_time_and_state(tmpdir):
+    engine = RulesEngine(load_rules(write_rules(tmpdir, RULES)))
+    assert engine.match('motion', 'IDLE', at(7, 0)).name == 'let the dog in'
+    assert engine.match('motion', 'UNKNOWN', at(20, 59)).name == 'let the dog in'
+    assert engine.match('motion', 'OPENING', at(12, 0)) is None
+    # The night rule runs past midnight.
+    assert engine.match('motion', 'IDLE', at(21, 0)).name == 'night'
+    assert engine.match('motion', 'IDLE', at(3, 30)).name == 'night'
+    assert engine.match('motion', 'UNKNOWN', at(3, 30)) is None
+
+
+def test_first_rule_wins_and_doors():
+    rules = [parse_rule('gate only', {'action': 'stop', 'door': 'gate'}),
+             parse_rule('everyone', {'action': 'open'}),
+             parse_rule('never', {'action': 'close'})]
+    assert compile_rules(rules, 'gate')[('motion', 'IDLE')][600].name == 'gate only'
+    assert compile_rules(rules, 'back')[('motion', 'IDLE')][600].name == 'everyone'
+
+
+def make_door(rules, gpio):
+    config = load_config(gpio_backend='simulated', door_closed_mm=None, door_open_mm=None)
+    door = SlidingDoor(config, notifier=QuietNotifier(), gpio=gpio, rules=RulesEngine(rules))
+    door.seconds_to_open_door = 0.02
+    # Every edge is a new visit, and the door's own moves don't mask the next one.
+    door.motion.debounce_seconds = 0
+    door.motion.rearm_seconds = 0
+    door.motion.settle_seconds = 0
+    return door
+
+
+def test_motion_opens_then_closes():
+    gpio = SimulatedGPIO()
+    door = make_door([parse_rule('in', {'action': 'open', 'close_after': '0.1'})], gpio)
+    writes = len(gpio.writes)
+    gpio.rising_edge(door.pir_pin)
+    assert gpio.levels[door.open_pin]
+    assert door.door_state == door.door_states.opening
+    assert gpio.wait_for_write(door.close_pin, True, after=writes, timeout=2) is not None
+    assert door.rules.fired == 1
+
+
+def test_close_after_shorter_than_the_move():
+    gpio = SimulatedGPIO()
+    door = make_door([parse_rule('in', {'action': 'open', 'close_after': '0.05'})], gpio)
+    door.rules.retry_seconds = 0.02
+    door.seconds_to_open_door = 0.2
+    writes = len(gpio.writes)
+    gpio.rising_edge(door.pir_pin)
+    # The close comes due while the door is still opening, and waits for it to finish.
+    opened_at = gpio.wait_for_write(door.open_pin, True, after=writes, timeout=2)
+    closed_at = gpio.wait_for_write(door.close_pin, True, after=writes, timeout=2)
+    assert closed_at is not None
+    assert closed_at - opened_at >= 0.2
+    assert door.door_state == door.door_states.closing
+
+
+def test_close_after_must_outlast_the_move(tmpdir):
+    path = write_rules(tmpdir, "[in]\naction = open\nclose_after = 10\n\n[gate]\ndoor = gate\naction = open\n"
+                                 "close_after = 20\n")
+    doors = {'back': load_config(seconds_to_open_door=15.0), 'gate': load_config(seconds_to_open_door=15.0)}
+    with pytest.raises(ConfigError) as error:
+        load_rules(path, doors)
+    message = str(error.value)
+    assert "[in] close_after 10 should be longer than [back]'s seconds_to_open_door 15" in message
+    assert '[gate] close_after' not in message
+    assert len(load_rules(path)) == 2
+
+
+def test_dashboard_command_cancels_close_after():
+    gpio = SimulatedGPIO()
+    door = make_door([parse_rule('in', {'action': 'open', 'close_after': '0.1'})], gpio)
+    gpio.rising_edge(door.pir_pin)
+    door.do_action(door.button_states.stop)
+    writes = len(gpio.writes)
+    assert gpio.wait_for_write(door.close_pin, True, after=writes, timeout=0.3) is None
+
+
+def test_motion_to_relay_benchmark():
+    gpio = SimulatedGPIO()
+    # Plenty of rules that don't apply, in front of the one that does.
+    rules = [parse_rule('other {}'.format(n), {'action': 'close', 'door_state': 'closing',
+                                               'between': '{:02}:00-{:02}:30'.format(n % 24, n % 24)})
+             for n in range(100)]
+    rules.append(parse_rule('in', {'action': 'open', 'door_state': 'idle, unknown'}))
+    door = make_door(rules, gpio)
+    latencies = []
+    for i in range(500):
+        writes = len(gpio.writes)
+        start = time.monotonic()
+        gpio.rising_edge(door.pir_pin)
+        switched = gpio.wait_for_write(door.open_pin, True, after=writes, timeout=1)
+        assert switched is not None
+        latencies.append(switched - start)
+        door.do_action(door.button_states.stop)
+
+    matches = 100000
+    start = time.perf_counter()
+    for i in range(matches):
+        door.rules.match('motion', 'IDLE')
+    match_seconds = (time.perf_counter() - start) / matches
+
+    print("\nmotion to open relay: p50 {:.0f}us p99 {:.0f}us max {:.0f}us; rule match {:.2f}us with {} rules".format(
+        percentile(latencies, 0.5) * 1e6, percentile(latencies, 0.99) * 1e6, max(latencies) * 1e6,
+        match_seconds * 1e6, len(rules)))
+    assert percentile(latencies, 0.5) < 0.005
+    assert match_seconds < 0.0001
@@ -0,0 +1,105 @@
+#
+# Load test: many clients loading the dashboard and posting to /get_open_close at once, against the
+# waitress setup in serve.py and against the Flask development server the service used to run.
+#
+import http.client
+import json
+import threading
+import time
+
+import pytest
+from waitress.server import create_server
+from werkzeug.serving import make_server
+
+from bark_door_app import create_app
+from conftest import StillDoor
+
+CLIENTS = 16
+REQUESTS_PER_CLIENT = 40
+
+
+@pytest.fixture(scope='module')
+def app():
+    return create_app(door=StillDoor(), LOGIN_DISABLED=True, SECRET_KEY='test')
+
+
+def run_clients(port):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    body = json.dumps({'action': 1})
+
+    def client(n):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        mine = []
+        try:
+            for i in range(REQUESTS_PER_CLIENT):
+                start = time.perf_counter()
+                if (n + i) % 2:
+                    conn.request('GET', '/dashboard')
+                else:
+                    conn.request('POST', '/get_open_close', body, {'Content-Type': 'application/json'})
+                response = conn.getresponse()
+                response.read()
+                mine.append(time.perf_counter() - start)
+                if response.status not in (200, 202):
+                    errors.append(response.status)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            conn.close()
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(CLIENTS)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {'errors': errors,
+            'count': len(latencies),
+            'throughput': len(latencies) / elapsed,
+            'p50': latencies[len(latencies) // 2],
+            'p99': latencies[int(len(latencies) * 0.99)]}
+
+
+def report(name, result):
+    print("\n\n{}: {} requests, {:.0f} req/s, p50 {:.1f}ms, p99 {:.1f}ms".format(
+        name, result['count'], result['throughput'], result['p50'] * 1000, result['p99'] * 1000))
+
+
+def test_waitress(app):
+    server = create_server(app, host='127.0.0.1', port=0, threads=4, backlog=64, channel_timeout=30)
+    stop = threading.Event()
+
+    def loop():
+        while not stop.is_set():
+            server.asyncore.loop(timeout=0.05, map=server._map, count=1)
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    try:
+        result = run_clients(server.effective_port)
+    finally:
+        stop.set()
+        thread.join()
+        server.task_dispatcher.shutdown()
+        server.close()
+    report('test_waitress()', result)
+    assert result['errors'] == []
+    assert result['count'] == CLIENTS * REQUESTS_PER_CLIENT
+
+
+def test_development_server(app):
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        result = run_clients(server.server_port)
+    finally:
+        server.shutdown()
+    report('test_development_server()', result)
+    assert result['errors'] == []
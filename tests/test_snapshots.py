@@ -0,0 +1,184 @@
+#
+# Motion snapshots: the byte budget caches, the /snapshots routes, a benchmark of the time from
+# motion to the snapshot being available, and the cache hit rate when several phones open the
+# same alert.
+#
+import os
+import threading
+import time
+
+import pytest
+
+from bark_door_app import create_app
+from camera_stream import CameraStream
+from config import load_config
+from conftest import QuietNotifier, percentile
+from gpio_backend import SimulatedGPIO
+from sliding_door import SlidingDoor
+from snapshots import ByteBudgetCache, SnapshotStore
+
+PHONES = 8
+
+
+class StillCamera:
+    # Hands out a JPEG-shaped frame after a camera-like delay.
+    def __init__(self, size=50000, delay=0.01):
+        self.size = size
+        self.delay = delay
+        self.taken = 0
+
+    def snapshot(self, timeout=None):
+        time.sleep(self.delay)
+        self.taken += 1
+        return b'\xff\xd8' + os.urandom(self.size - 4) + b'\xff\xd9'
+
+
+class FrameSource:
+    def __init__(self):
+        self.opened = 0
+
+    def open(self):
+        self.opened += 1
+
+    def read(self):
+        time.sleep(0.01)
+        return b'\xff\xd8frame\xff\xd9'
+
+    def close(self):
+        pass
+
+
+def test_cache_evicts_by_bytes():
+    evicted = []
+    cache = ByteBudgetCache(100, on_evict=evicted.append)
+    cache.put('a', b'x' * 40)
+    cache.put('b', b'x' * 40)
+    assert cache.get('a') is not None
+    cache.put('c', b'x' * 40)
+    # b was the least recently used.
+    assert evicted == ['b']
+    assert cache.bytes == 80
+    cache.put('huge', b'x' * 101)
+    assert 'huge' not in cache
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_memory_only_store_forgets_evicted():
+    store = SnapshotStore(StillCamera(size=1000, delay=0), memory_bytes=2500)
+    ids = [store.capture() for _ in range(4)]
+    for snapshot_id in ids:
+        assert store.wait(snapshot_id, 5)
+    assert [info.id for info in store.list()] == ids[:1:-1]
+    assert [info.id for info in store.list(1)] == ids[-1:]
+    with pytest.raises(ValueError):
+        store.list(-1)
+    assert store.get(ids[0]) is None
+    assert len(store.get(ids[-1])) == 1000
+
+
+def test_disk_budget_and_restart(tmpdir):
+    directory = str(tmpdir)
+    store = SnapshotStore(StillCamera(size=1000, delay=0), directory, disk_bytes=3500)
+    ids = [store.capture(door='back') for _ in range(5)]
+    for snapshot_id in ids:
+        store.wait(snapshot_id, 5)
+    assert [info.id for info in store.list()] == ids[:1:-1]
+    assert len(os.listdir(directory)) == 3
+    # A new store finds them again.
+    again = SnapshotStore(StillCamera(), directory)
+    assert [(info.id, info.door, info.size) for info in again.list()] == [(i, 'back', 1000) for i in ids[:1:-1]]
+    assert len(again.get(ids[-1])) == 1000
+    assert abs(again.list()[0].timestamp - time.time()) < 60
+
+
+def test_camera_snapshot_starts_capture():
+    camera = CameraStream(FrameSource())
+    assert camera.snapshot(timeout=5) == b'\xff\xd8frame\xff\xd9'
+    assert camera.source.opened == 1
+
+
+def test_alert_links_snapshot():
+    notifier = QuietNotifier()
+    door = SlidingDoor(load_config(door_closed_mm=None, door_open_mm=None), notifier=notifier, gpio=SimulatedGPIO())
+    store = SnapshotStore(StillCamera(delay=0))
+    door.use_snapshots(store, 'http://raspberrypi.lan:8519/')
+    door.check_and_send()
+    snapshot_id = notifier.links[0].rsplit('/', 1)[1]
+    assert store.wait(snapshot_id, 5)
+    assert notifier.links == ['http://raspberrypi.lan:8519/snapshots/{}'.format(snapshot_id)]
+    assert store.info(snapshot_id).door == 'default'
+
+
+def make_client(store):
+    app = create_app(door=object(), camera=object(), snapshots=store, LOGIN_DISABLED=True, SECRET_KEY='test')
+    return app.test_client()
+
+
+def test_snapshot_routes(tmpdir):
+    store = SnapshotStore(StillCamera(delay=0), str(tmpdir))
+    snapshot_id = store.capture()
+    client = make_client(store)
+    response = client.get('/snapshots/' + snapshot_id)
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'image/jpeg'
+    assert 'immutable' in response.headers['Cache-Control']
+    again = client.get('/snapshots/' + snapshot_id, headers={'If-None-Match': response.headers['ETag']})
+    assert again.status_code == 304
+    listing = client.get('/snapshots').get_json()['snapshots']
+    assert [(s['id'], s['url']) for s in listing] == [(snapshot_id, '/snapshots/' + snapshot_id)]
+    assert client.get('/snapshots?limit=0').get_json()['snapshots'] == []
+    assert client.get('/snapshots?limit=-1').status_code == 400
+    assert client.get('/snapshots/20180101-000000-000').status_code == 404
+    assert client.get('/snapshots/../config').status_code == 404
+    assert client.get('/snapshots/{}/huge'.format(snapshot_id)).status_code == 404
+
+
+def test_capture_to_available_benchmark(tmpdir):
+    camera = StillCamera(delay=0.005)
+    store = SnapshotStore(camera, str(tmpdir), disk_bytes=10 ** 9)
+    latencies = []
+    call_latencies = []
+    for i in range(100):
+        start = time.perf_counter()
+        snapshot_id = store.capture()
+        call_latencies.append(time.perf_counter() - start)
+        assert store.wait(snapshot_id, 5)
+        latencies.append(time.perf_counter() - start)
+    print("\ncapture() on the motion path: p50 {:.0f}us max {:.0f}us".format(
+        percentile(call_latencies, 0.5) * 1e6, max(call_latencies) * 1e6))
+    print("motion to snapshot available (5ms camera): p50 {:.1f}ms p99 {:.1f}ms".format(
+        percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000))
+    assert percentile(call_latencies, 0.5) < 0.001
+    assert percentile(latencies, 0.5) < 0.05
+
+
+def test_phones_opening_same_alert_benchmark(tmpdir):
+    directory = str(tmpdir)
+    first = SnapshotStore(StillCamera(delay=0), directory, disk_bytes=10 ** 9)
+    ids = [first.capture() for _ in range(10)]
+    for snapshot_id in ids:
+        first.wait(snapshot_id, 5)
+    # A fresh store (after a restart) starts with nothing in memory.
+    store = SnapshotStore(StillCamera(), directory)
+    client = make_client(store)
+    errors = []
+
+    def phone():
+        for snapshot_id in ids:
+            if client.get('/snapshots/' + snapshot_id).status_code != 200:
+                errors.append(snapshot_id)
+
+    threads = [threading.Thread(target=phone) for _ in range(PHONES)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    elapsed = time.perf_counter() - start
+    cache = store.cache
+    hit_rate = cache.hits / (cache.hits + cache.misses)
+    print("\n{} phones x {} alerts in {:.3f}s: cache hit rate {:.0%} ({} hits, {} misses)".format(
+        PHONES, len(ids), elapsed, hit_rate, cache.hits, cache.misses))
+    assert not errors
+    # Only the first phone to open each alert (give or take a race) reads the SD card.
+    assert hit_rate >= 0.75
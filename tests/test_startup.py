@@ -0,0 +1,117 @@
+#
+# Startup: the settings are checked in one place, the slow imports wait until they are needed, and
+# serve.py tells systemd READY=1 once the door can be controlled.  The benchmark starts serve.py with
+# the simulated GPIO backend and prints how long each phase took.
+#
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from config import ConfigError, load_config
+from startup import PhaseTimer, sd_notify
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+
+GOOD = {'open_pin': '20', 'close_pin': '21', 'pir_pin': '4', 'seconds_to_open_door': '12.5',
+        'mins_between_detecting_motion': '1'}
+
+
+def test_config_types():
+    config = load_config(dict(GOOD, server_port='9000'))
+    assert config.open_pin == 20
+    assert config.seconds_to_open_door == 12.5
+    assert config.server_port == 9000
+    assert config.gpio_backend == 'rpi'
+    assert config.door_closed_mm is None
+    assert load_config(GOOD, gpio_backend='simulated').gpio_backend == 'simulated'
+
+
+def test_config_reports_every_problem():
+    environ = dict(GOOD, close_pin='twenty one', server_threads='lots')
+    del environ['pir_pin']
+    with pytest.raises(ConfigError) as error:
+        load_config(environ)
+    message = str(error.value)
+    assert 'pir_pin is not set' in message
+    assert "close_pin should be int, not 'twenty one'" in message
+    assert 'server_threads' in message
+
+
+@pytest.fixture
+def notify_socket(tmpdir):
+    path = str(tmpdir.join('notify'))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(path)
+    yield sock, path
+    sock.close()
+
+
+def test_sd_notify(notify_socket, monkeypatch):
+    sock, path = notify_socket
+    monkeypatch.delenv('NOTIFY_SOCKET', raising=False)
+    assert not sd_notify('READY=1')
+    monkeypatch.setenv('NOTIFY_SOCKET', path)
+    assert sd_notify('READY=1')
+    assert sock.recv(256) == b'READY=1'
+
+
+def test_phase_timer():
+    timer = PhaseTimer()
+    with timer.phase('one'):
+        time.sleep(0.01)
+    timer.record('two', 0.5)
+    assert [name for name, seconds in timer.phases] == ['one', 'two']
+    assert timer.phases[0][1] >= 0.01
+    assert timer.summary().endswith('two 500ms')
+
+
+def environment(**extra):
+    env = dict(os.environ, gpio_backend='simulated', **GOOD)
+    env.pop('NOTIFY_SOCKET', None)
+    env.pop('history_file', None)
+    env.pop('logfile', None)
+    env.update(extra)
+    return env
+
+
+def test_slow_imports_deferred():
+    # bcrypt is only needed to log in, and requests to send an alert.
+    script = ('import json, sys\n'
+              'from bark_door_app import create_app\n'
+              'app = create_app(camera=object())\n'
+              'assert app.door_ready.wait(10)\n'
+              'print(json.dumps([m for m in ("bcrypt", "flask_bcrypt", "requests") if m in sys.modules]))\n')
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=APP_DIR, env=environment(),
+                                     timeout=60)
+    assert json.loads(output.decode().strip().splitlines()[-1]) == []
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_serve_startup_benchmark(notify_socket):
+    sock, path = notify_socket
+    sock.settimeout(30)
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, 'serve.py'], cwd=APP_DIR, stderr=subprocess.PIPE,
+                               env=environment(NOTIFY_SOCKET=path, server_host='127.0.0.1',
+                                               server_port=str(free_port())))
+    try:
+        assert sock.recv(256) == b'READY=1'
+        ready = time.perf_counter() - start
+    finally:
+        process.terminate()
+        _, stderr = process.communicate(timeout=10)
+    summary = [line for line in stderr.decode().splitlines() if 'Door ready' in line]
+    print("\nserve.py to READY=1: {:.0f}ms".format(ready * 1000))
+    print(summary[-1] if summary else stderr.decode())
+    assert summary
+    assert ready < 30
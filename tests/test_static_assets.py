@@ -0,0 +1,125 @@
+#
+# The dashboard's assets are served from the Pi under content hashed names, compressed ahead of time,
+# with ETags and immutable caching.  The warm reload test loads the dashboard the way a browser with a
+# cache would and counts the requests and bytes a second load takes.
+#
+import gzip
+import re
+
+import pytest
+
+from bark_door_app import create_app
+from conftest import StillDoor
+from static_assets import CACHE_CONTROL, AssetBundle
+
+
+@pytest.fixture(scope='module')
+def bundle(tmpdir_factory):
+    return AssetBundle(build_dir=str(tmpdir_factory.mktemp('dist')))
+
+
+@pytest.fixture(scope='module')
+def client(bundle):
+    app = create_app(door=StillDoor(), camera=object(), assets=bundle, LOGIN_DISABLED=True, SECRET_KEY='test',
+                     WTF_CSRF_ENABLED=False)
+    return app.test_client()
+
+
+def page_assets(html):
+    return re.findall(r'(?:href|src)="(/assets/[^"]+)"', html)
+
+
+@pytest.mark.parametrize('page', ['/dashboard', '/login'])
+def test_no_cdn_links(client, page):
+    html = client.get(page).get_data(as_text=True)
+    assert not re.search(r'(?:href|src)="(?:https?:)?//', html)
+    assert page_assets(html)
+
+
+def test_hashed_names_follow_content(bundle, tmpdir):
+    path = tmpdir.join('app.js')
+    path.write_binary(b'var a = 1;' * 100)
+    first = AssetBundle({'app.js': str(path)}, build_dir=str(tmpdir.join('dist'))).url_name('app.js')
+    path.write_binary(b'var a = 2;' * 100)
+    second = AssetBundle({'app.js': str(path)}, build_dir=str(tmpdir.join('dist'))).url_name('app.js')
+    assert first != second
+    assert re.match(r'app\.[0-9a-f]{16}\.js$', first)
+
+
+def test_compressed_versions_built_once(tmpdir):
+    path = tmpdir.join('site.css')
+    path.write_binary(b'body { margin: 0; }\n' * 500)
+    build_dir = tmpdir.join('dist')
+    bundle = AssetBundle({'site.css': str(path)}, build_dir=str(build_dir))
+    built = build_dir.join(bundle.url_name('site.css') + '.gz')
+    assert gzip.decompress(built.read_binary()) == path.read_binary()
+    # A restart reads the file back instead of compressing again.
+    built.write_binary(b'x')
+    again = AssetBundle({'site.css': str(path)}, build_dir=str(build_dir))
+    assert again.assets['site.css'].encodings['gzip'] == b'x'
+
+
+def test_asset_headers(client, bundle):
+    url = '/assets/' + bundle.url_name('bootstrap.min.css')
+    plain = client.get(url)
+    assert plain.status_code == 200
+    assert plain.headers['Cache-Control'] == CACHE_CONTROL
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.headers['Content-Type'].startswith('text/css')
+
+    zipped = client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert zipped.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(zipped.get_data()) == plain.get_data()
+    assert len(zipped.get_data()) < len(plain.get_data()) / 3
+    assert zipped.headers['ETag'] != plain.headers['ETag']
+
+    revalidated = client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': zipped.headers['ETag']})
+    assert revalidated.status_code == 304
+    assert revalidated.get_data() == b''
+
+    assert client.get('/assets/bootstrap.min.css').status_code == 404
+
+
+class Browser:
+    # Just enough of a browser cache: immutable responses are reused without asking, anything else
+    # with an ETag is revalidated.
+    def __init__(self, client):
+        self.client = client
+        self.cache = {}
+        self.requests = 0
+        self.bytes = 0
+
+    def get(self, url):
+        cached = self.cache.get(url)
+        if cached is not None and 'immutable' in cached.headers.get('Cache-Control', ''):
+            return cached
+        headers = {'Accept-Encoding': 'gzip, deflate'}
+        if cached is not None and 'ETag' in cached.headers:
+            headers['If-None-Match'] = cached.headers['ETag']
+        response = self.client.get(url, headers=headers)
+        self.requests += 1
+        self.bytes += len(response.get_data())
+        if response.status_code == 304:
+            return cached
+        self.cache[url] = response
+        return response
+
+    def load(self, page):
+        requests, size = self.requests, self.bytes
+        html = self.get(page).get_data(as_text=True)
+        for url in page_assets(html):
+            self.get(url)
+        return self.requests - requests, self.bytes - size
+
+
+def test_warm_reload_benchmark(client):
+    browser = Browser(client)
+    cold_requests, cold_bytes = browser.load('/dashboard')
+    warm_requests, warm_bytes = browser.load('/dashboard')
+    print("\ndashboard cold load: {} requests, {} bytes".format(cold_requests, cold_bytes))
+    print("dashboard warm reload: {} requests, {} bytes".format(warm_requests, warm_bytes))
+    # Only the page itself is fetched again.
+    assert cold_requests >= 4
+    assert warm_requests == 1
+    assert warm_bytes < cold_bytes / 10
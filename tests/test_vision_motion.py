@@ -0,0 +1,141 @@
+#
+# Camera motion detection on synthetic frame sequences: a dog walking through the region outside the
+# door, the sun coming out, and the door moving outside the region.  Then the PIR/camera fusion, and
+# a benchmark of frames per second at the camera's 640x480.
+#
+import io
+import time
+
+import numpy as np
+import pytest
+
+from config import load_config
+from gpio_backend import SimulatedGPIO
+from sliding_door import SlidingDoor
+from vision_motion import MotionFusion, VisionMotionDetector, decode_jpeg, parse_roi, to_gray
+
+HEIGHT, WIDTH = 480, 640
+# The bottom half of the picture is outside the door.  The door is in the top half.
+ROI = (0, 0.5, 1, 1)
+
+
+def scene(seed=1):
+    rng = np.random.RandomState(seed)
+    background = rng.randint(40, 200, size=(HEIGHT, WIDTH)).astype(np.int16)
+
+    def frame(brightness=0, blob_at=None, blob_size=100):
+        picture = background + brightness + rng.randint(-5, 6, size=(HEIGHT, WIDTH))
+        if blob_at is not None:
+            y, x = blob_at
+            picture[y:y + blob_size, x:x + blob_size] = 250
+        return np.clip(picture, 0, 255).astype(np.uint8)
+
+    return frame
+
+
+def scores(frames):
+    detector = VisionMotionDetector(roi=ROI)
+    return [detector.process(frame, timestamp=float(i)) for i, frame in enumerate(frames)]
+
+
+def test_dog_in_region():
+    frame = scene()
+    frames = [frame() for _ in range(20)] + [frame(blob_at=(300, x)) for x in range(0, 500, 25)]
+    result = scores(frames)
+    assert max(result[:20]) < 0.01
+    assert min(result[21:]) > 0.05
+
+
+def test_sun_coming_out():
+    frame = scene()
+    frames = [frame() for _ in range(20)] + [frame(brightness=b) for b in range(0, 60, 3)]
+    assert max(scores(frames)) < 0.01
+
+
+def test_door_moving_outside_region():
+    frame = scene()
+    frames = [frame() for _ in range(20)] + [frame(blob_at=(60, x)) for x in range(0, 500, 25)]
+    assert max(scores(frames)) < 0.01
+
+
+def test_to_gray_and_roi():
+    colour = np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8)
+    colour[:, :, 1] = 120
+    gray = to_gray(colour, 80, 60)
+    assert gray.shape == (60, 80)
+    assert (gray == 120).all()
+    assert parse_roi('0,0.5,1,1') == ROI
+    with pytest.raises(ValueError):
+        parse_roi('0.5,0,0.2,1')
+
+
+class FakeDetector:
+    active_fraction = 0.02
+    last_active = None
+    on_frame = None
+
+
+def test_fusion():
+    fired = []
+    detector = FakeDetector()
+    fusion = MotionFusion(fired.append, detector, agree_seconds=2, confident_fraction=0.15)
+    # The PIR alone isn't enough.
+    assert not fusion.pir(10.0)
+    # ...until a frame agrees within agree_seconds.
+    fusion.vision(11.0, 0.05)
+    assert fired == [11.0]
+    # The camera already saw something.
+    detector.last_active = 20.0
+    assert fusion.pir(21.0)
+    # A quiet frame, or a weak one long after the PIR, does nothing.
+    fusion.vision(30.0, 0.0)
+    fusion.vision(40.0, 0.05)
+    # The camera alone, when it is sure.
+    fusion.vision(50.0, 0.3)
+    assert fired == [11.0, 21.0, 50.0]
+
+
+def test_door_with_vision(quiet_notifier):
+    gpio = SimulatedGPIO()
+    door = SlidingDoor(load_config(door_closed_mm=None, door_open_mm=None), notifier=quiet_notifier, gpio=gpio)
+    detector = VisionMotionDetector(roi=ROI)
+    door.use_vision(detector)
+    frame = scene()
+    for _ in range(5):
+        detector.process(frame())
+    # The sun shifting sets the PIR off, but the camera sees nothing.
+    gpio.rising_edge(door.pir_pin)
+    assert door.motion.events == 0
+    # A dog walks up.
+    for x in range(0, 200, 25):
+        detector.process(frame(blob_at=(300, x)))
+    assert door.motion.events == 1
+
+
+def test_frame_rate_benchmark():
+    frame = scene()
+    frames = [frame(blob_at=(300, (i * 7) % 500)) for i in range(100)]
+    detector = VisionMotionDetector(roi=ROI)
+    count = 600
+    start = time.perf_counter()
+    for i in range(count):
+        detector.process(frames[i % len(frames)])
+    per_frame = (time.perf_counter() - start) / count
+    print("\nvision motion: {:.2f}ms per 640x480 frame ({:.0f} fps)".format(per_frame * 1000, 1 / per_frame))
+    # The camera runs at 15 fps.  A Pi is several times slower than this machine, so leave plenty of room.
+    assert 1 / per_frame > 150
+
+
+def test_jpeg_frame_rate_benchmark():
+    Image = pytest.importorskip('PIL.Image')
+    buffer = io.BytesIO()
+    Image.fromarray(scene()()).save(buffer, format='JPEG')
+    jpeg = buffer.getvalue()
+    detector = VisionMotionDetector(roi=ROI)
+    count = 200
+    start = time.perf_counter()
+    for i in range(count):
+        detector.process(decode_jpeg(jpeg, detector.width, detector.height))
+    per_frame = (time.perf_counter() - start) / count
+    print("\nvision motion with JPEG decode: {:.2f}ms per frame ({:.0f} fps)".format(per_frame * 1000, 1 / per_frame))
+    assert 1 / per_frame > 150